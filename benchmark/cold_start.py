@@ -0,0 +1,222 @@
+"""各サービスのコールドスタート時間を計測するスクリプト.
+
+サービスごとに新しい Python プロセスを起動し, 以下を計測する. \n
+・python -X importtime による lambda_function のインポート時間と, 時間のかかっているモジュール \n
+・lambda_function.handler の初回呼び出しにかかる時間 (benchmark/events/<service>.json がある場合のみ)
+
+初回呼び出しは実際に AWS 等へ通信するため, 認証情報や環境変数は --env で指定すること. \n
+--stub を指定すると AWS のクライアント/リソースとツイートをスタブ (benchmark/stubs.py) に差し替え, 通信せずに呼び出す. \n
+予算 (COLD_START_BUDGET_MS) を超えたサービスがあった場合は終了コード 1 を返す.
+
+使い方:
+    $ python benchmark/cold_start.py
+    $ python benchmark/cold_start.py --src deploy --layer deploy_layer --repeat 5
+    $ python benchmark/cold_start.py --service post_twitter_service --env TWITTER_API_KEY=twitter_api_key
+    $ python benchmark/cold_start.py --stub
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+import yaml
+
+from stubs import STUB_ENV
+
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+BENCHMARK_DIR = Path(__file__).resolve().parent
+EVENTS_DIR = BENCHMARK_DIR / "events"
+LAMBDA_PARAM_FILE_PATH = ROOT_DIR / "env_param" / "lambda_param.yaml"
+
+# サービスごとのコールドスタート時間の予算 (インポート + 初回呼び出し, ミリ秒)
+COLD_START_BUDGET_MS = {
+    "youtube_schedule_service": 1500,
+    "create_rule_service": 800,
+    "notify_schedule_service": 800,
+    "post_twitter_service": 1500,
+    "register_schedule_master_service": 100,
+    "manual_schedule_service": 100,
+    "dispatch_schedule_service": 800,
+    "reconcile_rule_service": 800,
+}
+DEFAULT_BUDGET_MS = 1000
+
+# 子プロセスで実行するコード
+CHILD_CODE = """
+import json
+import os
+import sys
+import time
+
+
+class Context:
+    function_name = "cold_start_benchmark"
+    aws_request_id = "cold_start_benchmark"
+
+    def __init__(self):
+        self._deadline = time.monotonic() + 300
+
+    def get_remaining_time_in_millis(self):
+        return int((self._deadline - time.monotonic()) * 1000)
+
+
+t0 = time.perf_counter()
+import lambda_function
+t1 = time.perf_counter()
+result = {"import_ms": (t1 - t0) * 1000, "invoke_ms": None, "invoke_error": None}
+if len(sys.argv) > 1:
+    with open(sys.argv[1], encoding="utf-8") as f:
+        event = json.load(f)
+    if os.environ.get("BENCHMARK_STUB"):
+        import stubs
+        stubs.install(lambda_function)
+    t2 = time.perf_counter()
+    try:
+        lambda_function.handler(event, Context())
+    except Exception as e:
+        result["invoke_error"] = repr(e)
+    result["invoke_ms"] = (time.perf_counter() - t2) * 1000
+print(json.dumps(result))
+"""
+
+
+def parse_importtime(stderr: str) -> list[tuple[str, int]]:
+    """-X importtime の出力から, lambda_function が直接インポートしたモジュールごとの累積時間を取り出す関数.
+
+    -X importtime は子モジュールを親より先に, ネストの深さ分字下げして出力する
+
+    Args:
+        stderr (str): -X importtime の出力
+
+    Returns:
+        list[tuple[str, int]]: (モジュール名, 累積時間[us]) のリスト
+    """
+    children = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children.append((name.strip(), int(cumulative)))
+        elif depth == 0:
+            if name.strip() == "lambda_function":
+                return children
+            children = []
+    return []
+
+
+def run_once(service_dir: Path, layer_dirs: list[Path], env: dict, event_path: Path | None) -> dict:
+    """新しいプロセスで lambda_function をインポート (および呼び出し) する関数.
+
+    Args:
+        service_dir (Path): サービスのディレクトリ
+        layer_dirs (list[Path]): Lambda Layer の python ディレクトリ
+        env (dict): 環境変数
+        event_path (Path | None): 初回呼び出しに使用するイベントファイル
+
+    Returns:
+        dict: import_ms, invoke_ms, invoke_error, modules
+    """
+    args = [sys.executable, "-X", "importtime", "-c", CHILD_CODE]
+    if event_path is not None:
+        args.append(str(event_path))
+    child_env = {**env, "PYTHONPATH": os.pathsep.join(str(path) for path in layer_dirs), "PYTHONDONTWRITEBYTECODE": "1"}
+    proc = subprocess.run(args, cwd=service_dir, env=child_env, capture_output=True, text=True)
+    if proc.returncode != 0 or not proc.stdout.strip():
+        raise RuntimeError(f"{service_dir.name}: {proc.stderr.strip().splitlines()[-1:]}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["modules"] = parse_importtime(proc.stderr)
+    return result
+
+
+def benchmark(service_dir: Path, layer_dirs: list[Path], env: dict, repeat: int, top: int) -> dict:
+    """サービス1つ分のコールドスタート時間を計測する関数.
+
+    Args:
+        service_dir (Path): サービスのディレクトリ
+        layer_dirs (list[Path]): Lambda Layer の python ディレクトリ
+        env (dict): 環境変数
+        repeat (int): 計測回数 (中央値を採用する)
+        top (int): 表示する時間のかかっているモジュールの数
+
+    Returns:
+        dict: 計測結果
+    """
+    event_path = EVENTS_DIR / f"{service_dir.name}.json"
+    runs = [
+        run_once(service_dir, layer_dirs, env, event_path if event_path.exists() else None)
+        for _ in range(repeat)
+    ]
+    import_ms = statistics.median(run["import_ms"] for run in runs)
+    invoke_ms = statistics.median(run["invoke_ms"] for run in runs) if runs[0]["invoke_ms"] is not None else None
+    modules = sorted(runs[-1]["modules"], key=lambda module: module[1], reverse=True)[:top]
+    total_ms = import_ms + (invoke_ms or 0.0)
+    budget_ms = COLD_START_BUDGET_MS.get(service_dir.name, DEFAULT_BUDGET_MS)
+    return {
+        "service": service_dir.name,
+        "import_ms": import_ms,
+        "invoke_ms": invoke_ms,
+        "invoke_error": runs[-1]["invoke_error"],
+        "total_ms": total_ms,
+        "budget_ms": budget_ms,
+        "over_budget": total_ms > budget_ms,
+        "modules": modules,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure cold start time of each lambda_function.handler.")
+    parser.add_argument("--src", default="lambda", help="directory containing each service (lambda or deploy)")
+    parser.add_argument("--layer", default="layer", help="directory containing each layer (layer or deploy_layer)")
+    parser.add_argument("--service", action="append", help="service name to measure (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs per service")
+    parser.add_argument("--top", type=int, default=5, help="number of slowest imports to show")
+    parser.add_argument("--env", action="append", default=[], help="extra environment variable (KEY=VALUE)")
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    parser.add_argument("--stub", action="store_true", help="replace AWS clients and tweets with stubs (benchmark/stubs.py)")
+    args = parser.parse_args()
+
+    with open(LAMBDA_PARAM_FILE_PATH, "r", encoding="utf-8") as f:
+        lambda_param = yaml.safe_load(f)
+    extra_env = dict(item.split("=", 1) for item in args.env)
+
+    src_dir = ROOT_DIR / args.src
+    layer_dirs = sorted(path / "python" for path in (ROOT_DIR / args.layer).iterdir() if (path / "python").is_dir())
+    service_dirs = sorted(path for path in src_dir.iterdir() if (path / "lambda_function.py").exists())
+    if args.service:
+        service_dirs = [path for path in service_dirs if path.name in args.service]
+    stub_env = {}
+    if args.stub:
+        # 子プロセスから stubs をインポートできるようにし, スタックで設定される環境変数は既定値を使用する
+        layer_dirs.append(BENCHMARK_DIR)
+        stub_env = {**STUB_ENV, "BENCHMARK_STUB": "1"}
+
+    results = []
+    for service_dir in service_dirs:
+        env = {**stub_env, **os.environ, **lambda_param.get(service_dir.name, {}), **extra_env}
+        results.append(benchmark(service_dir, layer_dirs, env, args.repeat, args.top))
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print(f"{'service':<36} {'import[ms]':>11} {'invoke[ms]':>11} {'budget[ms]':>11}")
+        for result in results:
+            invoke = f"{result['invoke_ms']:.1f}" if result["invoke_ms"] is not None else "-"
+            mark = " OVER" if result["over_budget"] else ""
+            print(f"{result['service']:<36} {result['import_ms']:>11.1f} {invoke:>11} {result['budget_ms']:>11}{mark}")
+            for name, cumulative in result["modules"]:
+                print(f"    {name:<32} {cumulative / 1000:>11.1f}")
+            if result["invoke_error"]:
+                print(f"    invoke error: {result['invoke_error']}")
+    return 1 if any(result["over_budget"] for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
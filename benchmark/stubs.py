@@ -0,0 +1,180 @@
+"""コールドスタート計測で AWS 等へ通信せずに handler を呼び出すためのスタブ.
+
+cold_start.py の --stub を指定すると, 子プロセスは lambda_function のインポート後に install を呼び出し, \n
+aws_clients.set_client/set_resource でクライアント/リソースをスタブに差し替えてから handler を呼び出す. \n
+スタブは呼び出されたメソッドに対して空の (成功した) レスポンスを返す. \n
+※ テーブル等は常に空のため, 計測できるのは handler の固定的な処理 (インポート, クライアント生成, 分岐) のみ
+"""
+from __future__ import annotations
+
+from types import SimpleNamespace
+
+
+# --stub を指定した場合の環境変数の既定値 (本来はスタックで設定される値)
+STUB_ENV = {
+    "SCHEDULE_MASTER_TABLE": "dyn_schedule_master_table_cdk",
+    "NOTIFY_CONTROLLER_TABLE": "dyn_notify_controller_table_cdk",
+    "SCHEDULE_INDEX_TABLE": "dyn_schedule_index_table_cdk",
+    "SNS_TOPICK_ARN": "arn:aws:sns:ap-northeast-1:000000000000:sns_create_rule_service_cdk",
+    "POST_TWITTER_SERVICE": "arn:aws:sns:ap-northeast-1:000000000000:sns_post_twitter_service_cdk",
+    "NOTIFY_SCHEDULE_SERVICE": "arn:aws:lambda:ap-northeast-1:000000000000:function:lmd_notify_schedule_service_cdk",
+    "SHARD_QUEUE_URL": "https://sqs.ap-northeast-1.amazonaws.com/000000000000/sqs_youtube_schedule_shard_cdk",
+    "SHARDING": "false",
+    "SHARD_SIZE": "50",
+    "LIVE_TRACKING": "false",
+    "LIVE_TRACKING_INTERVAL_MINUTES": "5",
+    "COALESCE": "false",
+    "YOUTUBE_API_KEY": "youtube_api_key",
+    "TWITTER_API_KEY": "twitter_api_key",
+    "TWITTER_API_SECRET_KEY": "twitter_api_secret_key",
+    "TWITTER_ACCESS_TOKEN": "twitter_access_token",
+    "TWITTER_ACCESS_TOKEN_SECRET": "twitter_access_token_secret",
+}
+
+# 通知管理テーブルのマスターの current_version (events の通知と同じ値にするとツイートまで進む)
+STUB_VERSION = "benchmark"
+
+
+class StubExceptions:
+    """client.exceptions.XxxException を参照された場合に, 例外クラスを返すオブジェクト."""
+
+    def __init__(self):
+        self._classes = {}
+
+    def __getattr__(self, name: str) -> type:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self._classes.setdefault(name, type(name, (Exception,), {}))
+
+
+class StubClient:
+    """boto3 のクライアントのスタブ. 定義していないメソッドは空のレスポンスを返す."""
+
+    def __init__(self, service_name: str):
+        self.service_name = service_name
+        self.exceptions = StubExceptions()
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: {}
+
+    def get_parameters(self, Names: list[str], **kwargs) -> dict:
+        return {"Parameters": [{"Name": name, "Value": "stub"} for name in Names], "InvalidParameters": []}
+
+    def publish_batch(self, PublishBatchRequestEntries: list[dict], **kwargs) -> dict:
+        return {"Successful": [{"Id": entry["Id"]} for entry in PublishBatchRequestEntries], "Failed": []}
+
+    def send_message_batch(self, Entries: list[dict], **kwargs) -> dict:
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries], "Failed": []}
+
+
+class StubBatchWriter:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        return None
+
+    def put_item(self, **kwargs) -> None:
+        return None
+
+    def delete_item(self, **kwargs) -> None:
+        return None
+
+
+class StubTable:
+    """DynamoDB のテーブルのスタブ. 常に空のテーブルとして振る舞う."""
+
+    def __init__(self, client: StubClient):
+        self.meta = SimpleNamespace(client=client)
+
+    def get_item(self, **kwargs) -> dict:
+        return {}
+
+    def query(self, **kwargs) -> dict:
+        return {"Items": []}
+
+    def scan(self, **kwargs) -> dict:
+        return {"Items": []}
+
+    def put_item(self, **kwargs) -> dict:
+        return {}
+
+    def update_item(self, **kwargs) -> dict:
+        return {}
+
+    def delete_item(self, **kwargs) -> dict:
+        return {}
+
+    def batch_writer(self, **kwargs) -> StubBatchWriter:
+        return StubBatchWriter()
+
+
+class StubDynamoDBResource:
+    """DynamoDB のリソースのスタブ.
+
+    batch_get_item は要求された全ての video ID のマスター (current_version=STUB_VERSION) を返す
+    """
+
+    def __init__(self, client: StubClient):
+        self.meta = SimpleNamespace(client=client)
+
+    def Table(self, table_name: str) -> StubTable:
+        return StubTable(self.meta.client)
+
+    def batch_get_item(self, RequestItems: dict, **kwargs) -> dict:
+        responses = {
+            table_name: [
+                {**key, "current_version": STUB_VERSION, "content_hash": "", "title": "benchmark"}
+                for key in request["Keys"]
+            ]
+            for table_name, request in RequestItems.items()
+        }
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+
+class StubSNSResource:
+    def Topic(self, topic_arn: str):
+        return SimpleNamespace(arn=topic_arn, publish=lambda **kwargs: {"MessageId": "stub"})
+
+
+class StubTwitterAPI:
+    """tweepy.API のスタブ (post_twitter_service が使用する update_status のみ)."""
+
+    def __init__(self):
+        self.last_response = SimpleNamespace(headers={})
+        self._count = 0
+
+    def update_status(self, status: str, **kwargs):
+        self._count += 1
+        return SimpleNamespace(id_str=str(self._count))
+
+
+def install(lambda_function) -> None:
+    """クライアント/リソースをスタブに差し替える関数.
+
+    post_twitter_service の場合は, tweepy の読み込みは計測に含めたままツイートのみをスタブにする
+
+    Args:
+        lambda_function (module): 計測対象の lambda_function モジュール
+    """
+    # 親プロセス (cold_start.py) は Lambda Layer を参照しないため, 子プロセスで呼び出された時点で読み込む
+    import aws_clients
+
+    clients = {
+        service_name: StubClient(service_name)
+        for service_name in ("dynamodb", "events", "lambda", "sns", "sqs", "ssm")
+    }
+    for service_name, client in clients.items():
+        aws_clients.set_client(service_name, client)
+    aws_clients.set_resource("dynamodb", StubDynamoDBResource(clients["dynamodb"]))
+    aws_clients.set_resource("sns", StubSNSResource())
+
+    if hasattr(lambda_function, "build_twitter_api"):
+
+        def build_twitter_api(secrets: dict[str, str]) -> StubTwitterAPI:
+            lambda_function.import_tweepy()
+            return StubTwitterAPI()
+
+        lambda_function.build_twitter_api = build_twitter_api
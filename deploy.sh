@@ -1,15 +1,66 @@
 # param
 DEPLOY_DIR="deploy/"
 SRC_DIR="lambda"
+LAYER_DEPLOY_DIR="deploy_layer/"
+LAYER_SRC_DIR="layer"
+# Lambda ランタイムと同じバージョンでコンパイルしないと .pyc が使用されない
+PYTHON="${PYTHON:-python3.9}"
+# Lambda ランタイムに同梱されているため, デプロイパッケージには含めない
+RUNTIME_PACKAGES="boto3 botocore s3transfer jmespath dateutil six"
+
+# 不要なファイルを削除し, .pyc をコンパイルする
+slim() {
+    target=$1
+    for pkg in ${RUNTIME_PACKAGES}
+    do
+        rm -r -f ${target}/${pkg} ${target}/${pkg}.py
+    done
+    find ${target} -depth -type d \( -name "tests" -o -name "test" -o -name "*.dist-info" -o -name "*.egg-info" -o -name "__pycache__" \) -exec rm -r -f {} +
+    ${PYTHON} -m compileall -q --invalidation-mode unchecked-hash ${target}
+}
+
+# 各関数のサイズとインポート時間を表示する
+report() {
+    name=$1
+    target=$2
+    size=`du -s -h ${target} | cut -f 1`
+    import_ms=`cd ${target} && LOG_LEVEL=INFO PYTHONPATH="${OLDPWD}/${LAYER_DEPLOY_DIR}common_layer/python" ${PYTHON} -c "import time; t = time.perf_counter(); import lambda_function; print(f'{(time.perf_counter() - t) * 1000:.1f}')" 2>/dev/null || echo "-"`
+    printf "%-40s %8s %12s ms\n" ${name} ${size} ${import_ms}
+}
 
 # init
 rm ${DEPLOY_DIR} -f -r
+rm ${LAYER_DEPLOY_DIR} -f -r
 mkdir ${DEPLOY_DIR}
+mkdir ${LAYER_DEPLOY_DIR}
 cp -r ${SRC_DIR}/* ${DEPLOY_DIR}/
+cp -r ${LAYER_SRC_DIR}/* ${LAYER_DEPLOY_DIR}/
+
+# pip install (layer)
+for dir in `ls -d -1 ${LAYER_DEPLOY_DIR}*`
+do
+    if [ -f ${dir}/requirements.txt ]; then
+        ${PYTHON} -m pip install -r ${dir}/requirements.txt -t ${dir}/python/
+    fi
+    slim ${dir}/python
+done
 
-# pip install
-cd ${DEPLOY_DIR}
-for dir in `ls -d -1 *`
+# pip install (function)
+for dir in `ls -d -1 ${DEPLOY_DIR}*`
+do
+    if [ -f ${dir}/requirements.txt ]; then
+        ${PYTHON} -m pip install -r ${dir}/requirements.txt -t ${dir}/
+    fi
+    slim ${dir}
+done
+
+# report
+printf "%-40s %8s %15s\n" "name" "size" "import time"
+for dir in `ls -d -1 ${LAYER_DEPLOY_DIR}*`
+do
+    printf "%-40s %8s %15s\n" `basename ${dir}` `du -s -h ${dir} | cut -f 1` "-"
+done
+for dir in `ls -d -1 ${DEPLOY_DIR}*`
 do
-    pip install -r ${dir}/requirements.txt -t ${dir}/
-done
\ No newline at end of file
+    report `basename ${dir}` ${dir}
+done
@@ -3,7 +3,7 @@ from __future__ import annotations
 import json
 from datetime import datetime
 
-import boto3
+from aws_clients import get_client
 
 
 def put_rule_to_sns(time: datetime, contents: dict, lambda_arn: str, rule_name: str, description: str) -> None:
@@ -16,7 +16,7 @@ def put_rule_to_sns(time: datetime, contents: dict, lambda_arn: str, rule_name:
         rule_name (str): 作成するルール名
         description (str): ルールの詳細
     """
-    client = boto3.client("events")
+    client = get_client("events")
     client.put_rule(
         Name=rule_name,
         ScheduleExpression=time.strftime("cron(%M %H %d %m ? %Y)"),
@@ -4,57 +4,181 @@ import logging
 import os
 import json
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 from create_utils import (
     put_rule_to_sns,
 )
+from schedule_index import (
+    put_schedule_to_index,
+)
+from rule_reconciler import (
+    reconcile_rules,
+)
 
 # set logging
 logger = logging.getLogger()
 logger.setLevel(os.environ["LOG_LEVEL"])
 
+# 通知のスケジュール方法
+# rule : 通知ごとに EventBridge のルールを作成する
+# table: 予定テーブルに登録し, dispatch_schedule_service が1分毎に取り出して通知する
+RULE_ENGINE = "rule"
+TABLE_ENGINE = "table"
+
+
+def schedule_notify(
+    schedule_engine: str,
+    time: datetime.datetime,
+    contents: dict,
+    lambda_arn: str,
+    schedule_index_table_name: str,
+) -> None:
+    """指定された方法で時間指定の通知を登録する関数.
+
+    Args:
+        schedule_engine (str): スケジュール方法 (rule/table)
+        time (datetime.datetime): 送信時刻
+        contents (dict): 送信したい内容
+        lambda_arn (str): 通知用の Lambda の ARN
+        schedule_index_table_name (str): 予定テーブル名
+    """
+    if schedule_engine == TABLE_ENGINE:
+        put_schedule_to_index(
+            table_name=schedule_index_table_name,
+            time=time,
+            contents=contents,
+            rule_name=contents["rule_name"],
+        )
+    else:
+        put_rule_to_sns(
+            time=time,
+            contents=contents,
+            lambda_arn=lambda_arn,
+            rule_name=contents["rule_name"],
+            description=contents["title"],
+        )
+
+
+def schedule_message(
+    message: dict,
+    lambda_arn: str,
+    schedule_engine: str,
+    schedule_index_table_name: str,
+    live_tracking: bool,
+) -> None:
+    """youtube_schedule_service から受け取った配信予定1件について, 時間指定の通知を登録する関数.
+
+    Args:
+        message (dict): 配信予定 (channel_id, video_id, version, title, scheduled_start_time)
+        lambda_arn (str): 通知用の Lambda の ARN
+        schedule_engine (str): スケジュール方法 (rule/table)
+        schedule_index_table_name (str): 予定テーブル名
+        live_tracking (bool): 配信状態を追跡する場合 True
+    """
+    message["status"] = "30分後に配信が始まります"
+    message["rule_name"] = f"rul_{message['channel_id']}_{message['video_id']}_30_sdk"
+    scheduled_start_time = datetime.datetime.strptime(message["scheduled_start_time"], '%Y-%m-%dT%H:%M:%SZ')
+    scheduled_start_time_30 = scheduled_start_time - datetime.timedelta(minutes=30)
+    now_time = datetime.datetime.now()
+
+    if scheduled_start_time_30 > now_time:
+        schedule_notify(
+            schedule_engine=schedule_engine,
+            time=scheduled_start_time_30,
+            contents=message,
+            lambda_arn=lambda_arn,
+            schedule_index_table_name=schedule_index_table_name,
+        )
+    message["status"] = "配信が始まりました"
+    message["rule_name"] = f"rul_{message['channel_id']}_{message['video_id']}_sdk"
+
+    # 配信状態を追跡する場合, 配信開始は youtube_schedule_service が actualStartTime を検知して通知する
+    if scheduled_start_time > now_time and not live_tracking:
+        schedule_notify(
+            schedule_engine=schedule_engine,
+            time=scheduled_start_time,
+            contents=message,
+            lambda_arn=lambda_arn,
+            schedule_index_table_name=schedule_index_table_name,
+        )
+
 
 def service(
     event: dict,
-    lambda_arn: str
-):
+    lambda_arn: str,
+    schedule_engine: str,
+    schedule_index_table_name: str,
+    notify_controller_table_name: str,
+    reconcile_inline: bool,
+    live_tracking: bool,
+    max_workers: int,
+) -> dict:
+    """SQS から受け取った配信予定をまとめて登録する.
+
+    SNSトピックから SQS 経由で起動される. レコードごとに失敗を切り離し, \n
+    失敗したレコードのみ batchItemFailures として返し SQS から再配信させる
+
+    Returns:
+        dict: batchItemFailures
+    """
 
     logger.debug("Service Start!")
 
-    for record in event["Records"]:
+    records = event["Records"]
 
-        message = json.loads(record["Sns"]["Message"])
-        message["status"] = "30分後に配信が始まります"
-        message["rule_name"] = f"rul_{message['channel_id']}_{message['video_id']}_30_sdk"
-        scheduled_start_time = datetime.datetime.strptime(message["scheduled_start_time"], '%Y-%m-%dT%H:%M:%SZ')
-        scheduled_start_time_30 = scheduled_start_time - datetime.timedelta(minutes=30)
-        now_time = datetime.datetime.now()
+    def process(record: dict) -> dict:
+        message = json.loads(record["body"])
+        schedule_message(
+            message=message,
+            lambda_arn=lambda_arn,
+            schedule_engine=schedule_engine,
+            schedule_index_table_name=schedule_index_table_name,
+            live_tracking=live_tracking,
+        )
+        return message
 
-        if scheduled_start_time_30 > now_time:
-            put_rule_to_sns(
-                time=scheduled_start_time_30,
-                contents=message,
-                lambda_arn=lambda_arn,
-                rule_name=message["rule_name"],
-                description=message["title"]
+    # EventBridge の呼び出しはクライアントを共有して並列に実行する
+    # 予定テーブルへの登録は DynamoDB のリソース (スレッドセーフではない) を使うため, 1件ずつ実行する
+    workers = max(1, int(max_workers)) if schedule_engine == RULE_ENGINE else 1
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(process, record) for record in records]
 
-            )
-        message["status"] = "配信が始まりました"
-        message["rule_name"] = f"rul_{message['channel_id']}_{message['video_id']}_sdk"
+    batch_item_failures = []
+    messages = []
+    for record, future in zip(records, futures):
+        try:
+            messages.append(future.result())
+        except Exception:
+            logger.exception(f"failed to schedule: {record['messageId']}")
+            batch_item_failures.append({"itemIdentifier": record["messageId"]})
 
-        if scheduled_start_time > now_time:
-            put_rule_to_sns(
-                time=scheduled_start_time,
-                contents=message,
-                lambda_arn=lambda_arn,
-                rule_name=message["rule_name"],
-                description=message["title"]
+    if reconcile_inline and schedule_engine == RULE_ENGINE:
+        # 予定時刻が過去に変わった場合等, 上書きされずに残った古いバージョンのルールを削除する
+        # 削除に失敗しても通知は登録済みのため再配信はさせず, 定期実行の reconcile_rule_service に任せる
+        for message in messages:
+            try:
+                reconcile_rules(
+                    notify_controller_table_name=notify_controller_table_name,
+                    name_prefix=f"rul_{message['channel_id']}_{message['video_id']}_",
+                    max_workers=2,
+                )
+            except Exception:
+                logger.exception(f"failed to reconcile: {message['video_id']}")
 
-            )
+    if batch_item_failures:
+        logger.warning(f"failed records: {len(batch_item_failures)}/{len(records)}")
+    return {"batchItemFailures": batch_item_failures}
 
 
 def handler(event, context):
-    service(
+    return service(
         event=event,
         lambda_arn=os.environ["NOTIFY_SCHEDULE_SERVICE"],
+        schedule_engine=os.environ["SCHEDULE_ENGINE"],
+        schedule_index_table_name=os.environ["SCHEDULE_INDEX_TABLE"],
+        notify_controller_table_name=os.environ["NOTIFY_CONTROLLER_TABLE"],
+        reconcile_inline=os.environ["RECONCILE_INLINE"].lower() == "true",
+        live_tracking=os.environ["LIVE_TRACKING"].lower() == "true",
+        max_workers=os.environ["MAX_WORKERS"],
     )
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import logging
+import os
+import datetime
+
+from schedule_index import (
+    iter_buckets,
+    query_due_schedules,
+    delete_schedules_from_index,
+)
+from common_utils import (
+    invoke_lambda_async,
+)
+
+# set logging
+logger = logging.getLogger()
+logger.setLevel(os.environ["LOG_LEVEL"])
+
+
+def service(
+    schedule_index_table_name: str,
+    lambda_arn: str,
+    lookback_minutes: int,
+    batch_size: int,
+) -> int:
+    """予定テーブルから送信時刻を迎えた通知を取り出し, 通知用の Lambda に渡す.
+
+    1分毎に実行する. 実行が遅れたり失敗した場合に備え, lookback_minutes 分前のバケットまで遡る \n
+    送信した通知は予定テーブルから削除し, 呼び出しに失敗した通知は次回の実行で再送する \n
+    lookback_minutes 分を過ぎても送信できなかった通知は送信せず, 予定テーブルの TTL で削除される
+    """
+
+    logger.debug("Service Start!")
+
+    now = datetime.datetime.utcnow()
+    status_code = 200
+    for bucket in iter_buckets(now, int(lookback_minutes)):
+        schedules = query_due_schedules(schedule_index_table_name, bucket)
+        for i in range(0, len(schedules), int(batch_size)):
+            batch = schedules[i:i + int(batch_size)]
+            rule_names = [schedule["rule_name"] for schedule in batch]
+            try:
+                invoke_lambda_async(lambda_arn, [schedule["contents"] for schedule in batch])
+            except Exception:
+                logger.exception(f"failed to dispatch: {bucket} {rule_names}")
+                status_code = 500
+                continue
+            delete_schedules_from_index(schedule_index_table_name, bucket, rule_names)
+            logger.info(f"dispatch: {bucket} {rule_names}")
+
+    return status_code
+
+
+def handler(event, context):
+    return service(
+        schedule_index_table_name=os.environ["SCHEDULE_INDEX_TABLE"],
+        lambda_arn=os.environ["NOTIFY_SCHEDULE_SERVICE"],
+        lookback_minutes=os.environ["LOOKBACK_MINUTES"],
+        batch_size=os.environ["DISPATCH_BATCH_SIZE"],
+    )
@@ -5,8 +5,11 @@ import os
 import json
 import datetime
 
-from notify_utils import (
+from common_utils import (
     publish_to_sns,
+    get_masters,
+    coalesce_messages,
+    parse_datetime,
 )
 
 # set logging
@@ -14,26 +17,67 @@ logger = logging.getLogger()
 logger.setLevel(os.environ["LOG_LEVEL"])
 
 
-def service(
-    event: dict,
-    topic_arn: str,
-) -> int:
+def format_jst(scheduled_start_time: str) -> str:
+    return parse_datetime(scheduled_start_time).astimezone(datetime.timezone(datetime.timedelta(hours=9))).isoformat()
 
-    logger.debug("Service Start!")
-    logger.info(event)
 
-    dt = datetime.datetime.fromisoformat(event["scheduled_start_time"].replace('Z', '+00:00'))
-    dt_j = dt.astimezone(datetime.timezone(datetime.timedelta(hours=9)))
-    notify_str = f"{event['status']}: {event['title']} [{dt_j.isoformat()}]"
+def notify(
+    message: dict,
+    topic_arn: str,
+) -> None:
+    if "items" in message:
+        # まとめた通知 (coalesce_messages) の場合は1通に並べる
+        lines = [f"{item['title']} [{format_jst(item['scheduled_start_time'])}]" for item in message["items"]]
+        notify_str = f"{message['status']} ({len(lines)}件)\n" + "\n".join(lines)
+    else:
+        notify_str = f"{message['status']}: {message['title']} [{format_jst(message['scheduled_start_time'])}]"
     publish_to_sns(
         topic_arn=topic_arn,
         item={
-            "default": json.dumps(event, ensure_ascii=False),
+            "default": json.dumps(message, ensure_ascii=False),
             "email": notify_str,
-            "lambda": json.dumps(event, ensure_ascii=False),
+            "lambda": json.dumps(message, ensure_ascii=False),
             "sms": notify_str,
         }
     )
+
+
+def apply_current_title(message: dict, master: dict | None) -> dict:
+    """ルール作成後にタイトルのみ変更されていた場合, マスターの最新のタイトルに差し替える関数.
+
+    Args:
+        message (dict): 通知内容
+        master (dict | None): 通知管理テーブルのマスター
+
+    Returns:
+        dict: 通知内容
+    """
+    if master and master.get("title") and master["current_version"] == message["version"]:
+        return {**message, "title": master["title"]}
+    return message
+
+
+def service(
+    event: dict,
+    topic_arn: str,
+    notify_controller_table_name: str,
+    coalesce: bool,
+    coalesce_window_minutes: float,
+    coalesce_max_group_size: int,
+) -> int:
+
+    logger.debug("Service Start!")
+    logger.info(event)
+
+    # EventBridge のルールからは通知1件, dispatch_schedule_service からは {"messages": [...]} で呼び出される
+    messages = event["messages"] if "messages" in event else [event]
+    masters = get_masters(notify_controller_table_name, list(dict.fromkeys(message["video_id"] for message in messages)))
+    messages = [apply_current_title(message, masters.get(message["video_id"])) for message in messages]
+    if coalesce:
+        # 同じ時間帯に始まる配信の通知は1件にまとめ, 通知やツイートの数を抑える
+        messages = coalesce_messages(messages, coalesce_window_minutes, coalesce_max_group_size)
+    for message in messages:
+        notify(message, topic_arn)
     
     return 200
 
@@ -42,4 +86,8 @@ def handler(event, context):
     return service(
         event=event,
         topic_arn=os.environ["POST_TWITTER_SERVICE"],
+        notify_controller_table_name=os.environ["NOTIFY_CONTROLLER_TABLE"],
+        coalesce=os.environ["COALESCE"].lower() == "true",
+        coalesce_window_minutes=os.environ["COALESCE_WINDOW_MINUTES"],
+        coalesce_max_group_size=os.environ["COALESCE_MAX_GROUP_SIZE"],
     )
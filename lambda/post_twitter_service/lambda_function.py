@@ -4,56 +4,425 @@ import logging
 import os
 import json
 import datetime
+import heapq
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Mapping
 
-import tweepy
+import rate_limit
 
+from common_utils import (
+    get_values_from_ssm,
+    get_masters,
+    invoke_lambda_async,
+    coalesce_messages,
+    parse_datetime,
+)
 from post_utils import (
-    get_value_from_ssm,
-    get_version_from_db,
     delete_rule_to_lambda,
 )
 
+if TYPE_CHECKING:
+    # 型注釈のみで参照する (実行時は import_tweepy で読み込む)
+    import tweepy
+
 # set logging
 logger = logging.getLogger()
 logger.setLevel(os.environ["LOG_LEVEL"])
 
+# レート制限の解除を待つ際に一度に眠る最大秒数 (実行時間の上限を確認するため)
+MAX_SLEEP_SECONDS = 5.0
+# 実行時間内にツイートしきれず, 自身に引き継いだ場合のステータスコード
+INCOMPLETE_STATUS_CODE = 206
+
+# ツイートの長さの上限と数え方 (URL は一律 23 文字, TWEET_LIGHT_RANGES 以外の文字は1文字を2として数える)
+MAX_TWEET_LENGTH = 280
+TWEET_URL_LENGTH = 23
+TWEET_LIGHT_RANGES = [(0x0000, 0x10FF), (0x2000, 0x200D), (0x2010, 0x201F), (0x2032, 0x2037)]
+URL_PATTERN = re.compile(r"https?://\S+")
+
+
+def import_tweepy():
+    """tweepy を読み込む関数.
+
+    tweepy (と依存する requests/oauthlib) の読み込みはコールドスタート時間の大半を占めるため, \n
+    実際にツイートする時点まで読み込まない
+
+    Returns:
+        module: tweepy
+    """
+    import tweepy
+    return tweepy
+
+
+def build_twitter_api(secrets: dict[str, str]) -> tweepy.API:
+    """Twitterオブジェクトを生成する関数.
+
+    Args:
+        secrets (dict[str, str]): パラメータ名 -> 値
+
+    Returns:
+        tweepy.API: Twitterオブジェクト
+    """
+    tweepy = import_tweepy()
+    auth = tweepy.OAuthHandler(
+        secrets[os.environ["TWITTER_API_KEY"]],
+        secrets[os.environ["TWITTER_API_SECRET_KEY"]],
+    )
+    auth.set_access_token(
+        secrets[os.environ["TWITTER_ACCESS_TOKEN"]],
+        secrets[os.environ["TWITTER_ACCESS_TOKEN_SECRET"]],
+    )
+    return tweepy.API(auth)
+
+
+def calc_tweet_length(text: str) -> int:
+    """Twitter の数え方でツイートの長さを返す関数.
+
+    URL は一律 TWEET_URL_LENGTH 文字, 日本語等 (TWEET_LIGHT_RANGES 以外) は1文字を2として数える
+
+    Args:
+        text (str): ツイート
+
+    Returns:
+        int: 長さ
+    """
+    urls = URL_PATTERN.findall(text)
+    length = TWEET_URL_LENGTH * len(urls)
+    for char in URL_PATTERN.sub("", text):
+        code = ord(char)
+        length += 1 if any(start <= code <= end for start, end in TWEET_LIGHT_RANGES) else 2
+    return length
+
+
+def iter_items(sns_message: dict) -> list[dict]:
+    # まとめた通知 (common_utils.coalesce_messages) の場合は元の通知のリストを返す
+    return sns_message.get("items", [sns_message])
+
+
+def build_post_messages(sns_message: dict) -> list[str]:
+    """通知内容からツイートを作成する関数.
+
+    まとめた通知の場合は1件のツイートに並べ, MAX_TWEET_LENGTH を超える場合はスレッドに分ける
+
+    Args:
+        sns_message (dict): 通知内容
+
+    Returns:
+        list[str]: ツイート (2件目以降は前のツイートへの返信とする)
+    """
+    if "items" not in sns_message:
+        return [f"{sns_message['status']}\n{sns_message['title']}\nhttps://youtu.be/{sns_message['video_id']}"]
+
+    post_messages = []
+    current = f"{sns_message['status']} ({len(sns_message['items'])}件)"
+    has_item = False
+    for item in sns_message["items"]:
+        entry = f"{item['title']}\nhttps://youtu.be/{item['video_id']}"
+        candidate = f"{current}\n\n{entry}"
+        if has_item and calc_tweet_length(candidate) > MAX_TWEET_LENGTH:
+            post_messages.append(current)
+            current = entry
+        else:
+            current = candidate
+        has_item = True
+    post_messages.append(current)
+    return post_messages
+
+
+def calc_useful_until(sns_message: dict, useful_window_minutes: float) -> datetime.datetime:
+    """通知をツイートする意味がある期限を返す関数.
+
+    Args:
+        sns_message (dict): 通知内容
+        useful_window_minutes (float): 予定開始時刻を過ぎてからツイートしてよい分数
+
+    Returns:
+        datetime.datetime: 期限 (UTC)
+    """
+    return parse_datetime(sns_message["scheduled_start_time"]) + datetime.timedelta(minutes=float(useful_window_minutes))
+
+
+def dispatch_tweets(
+    post: Callable[[str, str | None], tuple[str, Mapping[str, str]]],
+    sns_messages: list[dict],
+    useful_window_minutes: float,
+    max_attempts: int,
+    backoff_base_seconds: float,
+    backoff_max_seconds: float,
+    is_near_deadline: Callable[[], bool],
+    on_finished: Callable[[dict], None],
+) -> list[dict]:
+    """レート制限に合わせて, 予定開始時刻の早い順に通知をツイートする関数.
+
+    レスポンスヘッダーの残り回数を使い切った場合はリセット時刻まで待ち, \n
+    429 (rate_limit.RateLimitedError) やサーバーエラー (rate_limit.RetryableError) の場合は \n
+    バックオフして同じ通知から再試行する. rate_limit.PermanentError の場合はその通知を諦める \n
+    期限 (calc_useful_until) までにツイートできない通知は諦める \n
+    スレッドに分けた通知は1件ずつ投稿し, 投稿済みの位置 (thread_posted, thread_reply_to) を通知内容に記録する
+
+    Args:
+        post (Callable[[str, str | None], tuple[str, Mapping[str, str]]]): \n
+            ツイート (と返信先の ID) を受け取って投稿し, (ツイートの ID, レスポンスヘッダー) を返す関数. \n
+            失敗した場合は rate_limit の例外を送出する
+        sns_messages (list[dict]): 通知内容のリスト
+        useful_window_minutes (float): 予定開始時刻を過ぎてからツイートしてよい分数
+        max_attempts (int): 1件あたりの最大試行回数
+        backoff_base_seconds (float): 1回目の再試行までの待ち時間
+        backoff_max_seconds (float): 再試行までの待ち時間の上限
+        is_near_deadline (Callable[[], bool]): 実行時間の上限が近い場合 True を返す関数
+        on_finished (Callable[[dict], None]): ツイートした (または諦めた) 通知ごとに呼び出す関数
+
+    Returns:
+        list[dict]: 実行時間内にツイートしきれなかった通知
+    """
+    queue = [(sns_message["scheduled_start_time"], index, sns_message) for index, sns_message in enumerate(sns_messages)]
+    heapq.heapify(queue)
+    attempts = 0
+    while queue:
+        if is_near_deadline():
+            return [sns_message for _, _, sns_message in sorted(queue)]
+        _, _, sns_message = queue[0]
+        now = datetime.datetime.now(datetime.timezone.utc)
+        useful_until = calc_useful_until(sns_message, useful_window_minutes)
+        wait_seconds = rate_limit.calc_wait_seconds()
+        if now + datetime.timedelta(seconds=wait_seconds) > useful_until or attempts >= int(max_attempts):
+            heapq.heappop(queue)
+            attempts = 0
+            logger.error(f"give up tweeting: {sns_message['rule_name']} (wait={wait_seconds:.0f}s)")
+            on_finished(sns_message)
+            continue
+        if wait_seconds > 0:
+            # 実行時間の上限を確認しながら, 少しずつ待つ
+            time.sleep(min(wait_seconds, MAX_SLEEP_SECONDS))
+            continue
+
+        posted = int(sns_message.get("thread_posted", 0))
+        post_messages = build_post_messages(sns_message)
+        try:
+            status_id, headers = post(post_messages[posted], sns_message.get("thread_reply_to"))
+        except rate_limit.RateLimitedError as e:
+            attempts += 1
+            rate_limit.update(e.headers)
+            if rate_limit.calc_wait_seconds() == 0:
+                rate_limit.block_for(rate_limit.calc_backoff_seconds(attempts, backoff_base_seconds, backoff_max_seconds))
+            logger.warning(f"rate limited: {sns_message['rule_name']} attempt={attempts}")
+            continue
+        except rate_limit.RetryableError as e:
+            attempts += 1
+            rate_limit.block_for(rate_limit.calc_backoff_seconds(attempts, backoff_base_seconds, backoff_max_seconds))
+            logger.warning(f"retry tweeting: {sns_message['rule_name']} attempt={attempts} {e!r}")
+            continue
+        except rate_limit.PermanentError as e:
+            heapq.heappop(queue)
+            attempts = 0
+            logger.error(f"failed to tweet: {sns_message['rule_name']} {e!r}")
+            on_finished(sns_message)
+            continue
+
+        rate_limit.update(headers)
+        attempts = 0
+        logger.info(f"tweet: {sns_message['rule_name']} ({posted + 1}/{len(post_messages)})")
+        if posted + 1 < len(post_messages):
+            # スレッドの続きは同じ通知として続けて投稿する
+            sns_message["thread_posted"] = posted + 1
+            sns_message["thread_reply_to"] = status_id
+            continue
+        heapq.heappop(queue)
+        on_finished(sns_message)
+    return []
+
 
 def service(
-    event: dict,
-) -> int:
+    sns_messages: list[dict],
+    ssm_cache_ttl_seconds: float,
+    notify_controller_table_name: str,
+    max_workers: int,
+    useful_window_minutes: float,
+    max_attempts: int,
+    backoff_base_seconds: float,
+    backoff_max_seconds: float,
+    get_remaining_time_in_millis: Callable[[], int],
+    deadline_margin_seconds: float,
+) -> list[dict]:
+    """通知内容をツイートし, 使用済みのルールを削除する.
+
+    全通知のバージョンを1回の BatchGetItem でまとめて確認してから, dispatch_tweets でツイートする \n
+    ルールの削除はツイートを待たずにスレッドプールで並列に実行する
+
+    Returns:
+        list[dict]: 実行時間内にツイートしきれなかった通知
+    """
 
     logger.debug("Service Start!")
-    logger.info(json.dumps(event))
 
     # 取得した各種キーを格納-----------------------------------------------------
-    consumer_key = get_value_from_ssm(os.environ["TWITTER_API_KEY"])
-    consumer_secret = get_value_from_ssm(os.environ["TWITTER_API_SECRET_KEY"])
-    access_token = get_value_from_ssm(os.environ["TWITTER_ACCESS_TOKEN"])
-    access_token_secret = get_value_from_ssm(os.environ["TWITTER_ACCESS_TOKEN_SECRET"])
-
-    # Twitterオブジェクトの生成
-    auth = tweepy.OAuthHandler(consumer_key, consumer_secret)
-    auth.set_access_token(access_token, access_token_secret)
-    api = tweepy.API(auth)
+    # 1回の GetParameters でまとめて取得し, ウォームスタート時はキャッシュを使用する
+    ssm_keys = [
+        os.environ["TWITTER_API_KEY"],
+        os.environ["TWITTER_API_SECRET_KEY"],
+        os.environ["TWITTER_ACCESS_TOKEN"],
+        os.environ["TWITTER_ACCESS_TOKEN_SECRET"],
+    ]
+
+    # Twitterオブジェクトは最初に投稿する時点で生成する
+    api = None
     #-------------------------------------------------------------------------
 
-    for record in event["Records"]:
-        sns_message = json.loads(record["Sns"]["Message"])
-        current_version = get_version_from_db(os.environ["NOTIFY_CONTROLLER_TABLE"], sns_message["video_id"])
-        if current_version != sns_message['version']:
-            continue
-        post_message = f"{sns_message['status']}\n{sns_message['title']}\nhttps://youtu.be/{sns_message['video_id']}"
-        api.update_status(post_message)
-        delete_rule_to_lambda(sns_message["rule_name"])
-        logger.info(f"delete: {sns_message['rule_name']}")
+    def update_status(post_message: str, kwargs: dict):
+        nonlocal api
+        if api is None:
+            api = build_twitter_api(get_values_from_ssm(ssm_keys, float(ssm_cache_ttl_seconds)))
+        try:
+            return api.update_status(post_message, **kwargs)
+        except import_tweepy().errors.Unauthorized:
+            # キーが更新されている可能性があるため, 取得し直して再度投稿する
+            logger.warning("unauthorized. refresh twitter keys")
+            api = build_twitter_api(get_values_from_ssm(ssm_keys, float(ssm_cache_ttl_seconds), force_refresh=True))
+            return api.update_status(post_message, **kwargs)
 
-    # ツイートを投稿
-    # api.update_status("test")
-    
-    return 200
+    def post(post_message: str, in_reply_to_status_id: str | None) -> tuple[str, Mapping[str, str]]:
+        # tweepy の例外は dispatch_tweets が扱う rate_limit の例外に置き換える
+        tweepy = import_tweepy()
+        kwargs = {}
+        if in_reply_to_status_id is not None:
+            kwargs = {"in_reply_to_status_id": in_reply_to_status_id, "auto_populate_reply_metadata": True}
+        try:
+            status = update_status(post_message, kwargs)
+        except tweepy.errors.TooManyRequests as e:
+            raise rate_limit.RateLimitedError(e.response.headers) from e
+        except tweepy.errors.TwitterServerError as e:
+            raise rate_limit.RetryableError(repr(e)) from e
+        except tweepy.errors.HTTPException as e:
+            raise rate_limit.PermanentError(repr(e)) from e
+        except tweepy.errors.TweepyException as e:
+            # 通信エラー
+            raise rate_limit.RetryableError(repr(e)) from e
+        return status.id_str, api.last_response.headers
+
+    masters = get_masters(
+        notify_controller_table_name,
+        list(dict.fromkeys(item["video_id"] for sns_message in sns_messages for item in iter_items(sns_message))),
+    )
+
+    deletions = {}
+    with ThreadPoolExecutor(max_workers=max(1, int(max_workers))) as executor:
+
+        def delete_rules(sns_message: dict) -> None:
+            for item in iter_items(sns_message):
+                deletions[item["rule_name"]] = executor.submit(delete_rule_to_lambda, item["rule_name"])
+
+        targets = []
+        for sns_message in sns_messages:
+            items = []
+            for item in iter_items(sns_message):
+                master = masters.get(item["video_id"])
+                if master is None or master["current_version"] != item["version"]:
+                    # 古いバージョン (マスターが削除されたものを含む) のルールは二度と使用しないため, ツイートせずに削除する
+                    delete_rules(item)
+                    reason = "master not found" if master is None else "version mismatch"
+                    logger.info(f"delete ({reason}): {item['rule_name']}")
+                    continue
+                items.append(item)
+            if not items:
+                continue
+            if "items" in sns_message:
+                sns_message = {**sns_message, "items": items}
+            targets.append(sns_message)
+
+        deferred = []
+        if targets:
+            deferred = dispatch_tweets(
+                post=post,
+                sns_messages=targets,
+                useful_window_minutes=useful_window_minutes,
+                max_attempts=max_attempts,
+                backoff_base_seconds=backoff_base_seconds,
+                backoff_max_seconds=backoff_max_seconds,
+                is_near_deadline=lambda: get_remaining_time_in_millis() < float(deadline_margin_seconds) * 1000,
+                on_finished=delete_rules,
+            )
+
+    # ツイート済みのため削除の失敗では再実行させず, 残ったルールは reconcile_rule_service に任せる
+    for rule_name, deletion in deletions.items():
+        if deletion.exception() is not None:
+            logger.warning(f"failed to delete: {rule_name} {deletion.exception()!r}")
+
+    return deferred
+
+
+def parse_records(records: list[dict]) -> tuple[list[dict], dict[str, str], list[str]]:
+    """SQS のレコードから通知内容を取り出す関数.
+
+    Args:
+        records (list[dict]): SQS のレコード (body は SNS の通知内容)
+
+    Returns:
+        tuple[list[dict], dict[str, str], list[str]]: \n
+            通知内容のリスト, ルール名 -> メッセージ ID, 読み込めなかったレコードのメッセージ ID
+    """
+    sns_messages = []
+    record_ids = {}
+    failures = []
+    for record in records:
+        try:
+            sns_message = json.loads(record["body"])
+        except (KeyError, ValueError):
+            logger.exception(f"invalid record: {record.get('messageId')}")
+            failures.append(record["messageId"])
+            continue
+        sns_messages.append(sns_message)
+        for item in iter_items(sns_message):
+            record_ids[item["rule_name"]] = record["messageId"]
+    return sns_messages, record_ids, failures
 
 
 def handler(event, context):
-    return service(
-        event=event,
+    logger.info(json.dumps(event, ensure_ascii=False))
+
+    # SNSトピックを購読する SQS からは Records, 自身の引き継ぎ (invoke_lambda_async) からは {"messages": [...]} で呼び出される
+    from_queue = "messages" not in event
+    if from_queue:
+        sns_messages, record_ids, failures = parse_records(event["Records"])
+        if os.environ["COALESCE"].lower() == "true":
+            # SQS のバッチ (最大 POST_TWITTER_MAX_BATCHING_WINDOW_SECONDS 秒待って受け取ったもの) に含まれる通知をまとめる
+            sns_messages = coalesce_messages(
+                sns_messages,
+                window_minutes=os.environ["COALESCE_WINDOW_MINUTES"],
+                max_group_size=os.environ["COALESCE_MAX_GROUP_SIZE"],
+            )
+    else:
+        # 引き継いだ通知はまとめ済み (スレッドの投稿位置を持つ) のため, そのままツイートする
+        sns_messages, record_ids, failures = event["messages"], {}, []
+
+    deferred = service(
+        sns_messages=sns_messages,
+        ssm_cache_ttl_seconds=os.environ["SSM_CACHE_TTL_SECONDS"],
+        notify_controller_table_name=os.environ["NOTIFY_CONTROLLER_TABLE"],
+        max_workers=os.environ["MAX_WORKERS"],
+        useful_window_minutes=os.environ["TWEET_USEFUL_WINDOW_MINUTES"],
+        max_attempts=os.environ["TWEET_MAX_ATTEMPTS"],
+        backoff_base_seconds=os.environ["TWEET_BACKOFF_BASE_SECONDS"],
+        backoff_max_seconds=os.environ["TWEET_BACKOFF_MAX_SECONDS"],
+        get_remaining_time_in_millis=context.get_remaining_time_in_millis,
+        deadline_margin_seconds=os.environ["DEADLINE_MARGIN_SECONDS"],
     )
+    if deferred:
+        # 期限内の通知は自身を呼び出して引き継ぐ (期限を過ぎたものは引き継ぎ先で諦める)
+        logger.warning(f"deadline reached. deferred tweets: {len(deferred)}")
+        try:
+            invoke_lambda_async(context.function_name, deferred)
+        except Exception:
+            if not from_queue:
+                raise
+            # 引き継げなかった通知のレコードは SQS から再配信させる
+            logger.exception("failed to defer tweets")
+            failures.extend(record_ids[item["rule_name"]] for sns_message in deferred for item in iter_items(sns_message))
+
+    if not from_queue:
+        return INCOMPLETE_STATUS_CODE if deferred else 200
+    failures = list(dict.fromkeys(failures))
+    if failures:
+        logger.warning(f"failed records: {len(failures)}/{len(event['Records'])}")
+    return {"batchItemFailures": [{"itemIdentifier": message_id} for message_id in failures]}
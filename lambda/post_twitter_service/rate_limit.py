@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import time
+from typing import Mapping
+
+
+# ツイートの投稿のレート制限の状態 (レスポンスヘッダーから更新する)
+# ウォームスタート時も引き継ぐため, モジュールスコープで保持する
+# _remaining が None の場合は残り回数が不明 (投稿してよい) とみなす
+_remaining: int | None = None
+_reset_at: float = 0.0
+
+
+class RateLimitedError(Exception):
+    """投稿がレート制限 (429) で拒否された場合の例外.
+
+    Args:
+        headers (Mapping[str, str]): レスポンスヘッダー
+    """
+
+    def __init__(self, headers: Mapping[str, str]):
+        super().__init__("rate limited")
+        self.headers = headers
+
+
+class RetryableError(Exception):
+    """サーバーエラーや通信エラー等, 再試行すれば成功する可能性がある場合の例外."""
+
+
+class PermanentError(Exception):
+    """重複投稿等, 再試行しても成功しない場合の例外."""
+
+
+def update(headers: Mapping[str, str]) -> None:
+    """投稿のレスポンスヘッダーの x-rate-limit-remaining / x-rate-limit-reset でレート制限の状態を更新する関数.
+
+    ヘッダーに残り回数がない場合は, 把握している残り回数から1回分を差し引く
+
+    Args:
+        headers (Mapping[str, str]): レスポンスヘッダー
+    """
+    global _remaining, _reset_at
+    remaining = headers.get("x-rate-limit-remaining")
+    reset = headers.get("x-rate-limit-reset")
+    if remaining is not None:
+        _remaining = int(remaining)
+    elif _remaining is not None and _remaining > 0:
+        _remaining -= 1
+    if reset is not None:
+        _reset_at = float(reset)
+
+
+def block_for(seconds: float, now: float | None = None) -> None:
+    """指定した秒数だけ投稿を止める関数.
+
+    429 にヘッダーがない場合やサーバーエラー等, レート制限の状態が分からない場合に使用する
+
+    Args:
+        seconds (float): 投稿を止める秒数
+        now (float | None): 現在時刻 (UNIX 時間)
+    """
+    global _remaining, _reset_at
+    _remaining = 0
+    _reset_at = max(_reset_at, (now or time.time()) + seconds)
+
+
+def calc_wait_seconds(now: float | None = None) -> float:
+    """次に投稿できるまでの秒数を返す関数.
+
+    Args:
+        now (float | None): 現在時刻 (UNIX 時間)
+
+    Returns:
+        float: 待つ秒数. すぐに投稿できる場合は 0
+    """
+    global _remaining
+    now = now or time.time()
+    if _remaining is None or _remaining > 0:
+        return 0.0
+    if now >= _reset_at:
+        # リセット時刻を過ぎたため, 残り回数は次のレスポンスで分かるまで不明とする
+        _remaining = None
+        return 0.0
+    return _reset_at - now
+
+
+def calc_backoff_seconds(attempt: int, base_seconds: float, max_seconds: float) -> float:
+    """再試行までの待ち時間 (指数バックオフ) を返す関数.
+
+    Args:
+        attempt (int): 失敗した回数 (1以上)
+        base_seconds (float): 1回目の待ち時間
+        max_seconds (float): 待ち時間の上限
+
+    Returns:
+        float: 待ち時間 (秒)
+    """
+    return min(float(max_seconds), float(base_seconds) * 2 ** max(0, attempt - 1))
+
+
+def reset() -> None:
+    """レート制限の状態を初期化する関数 (テストで使う場合など)."""
+    global _remaining, _reset_at
+    _remaining = None
+    _reset_at = 0.0
@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+import logging
+import os
+
+from rule_reconciler import (
+    reconcile_rules,
+)
+
+# set logging
+logger = logging.getLogger()
+logger.setLevel(os.environ["LOG_LEVEL"])
+
+
+def service(
+    notify_controller_table_name: str,
+    expired_grace_minutes: float,
+    max_workers: int,
+    dry_run: bool,
+) -> int:
+
+    logger.debug("Service Start!")
+
+    deleted = reconcile_rules(
+        notify_controller_table_name=notify_controller_table_name,
+        expired_grace_minutes=float(expired_grace_minutes),
+        max_workers=int(max_workers),
+        dry_run=dry_run,
+    )
+    for rule_name in deleted:
+        logger.info(f"delete: {rule_name}")
+
+    return 200
+
+
+def handler(event, context):
+    return service(
+        notify_controller_table_name=os.environ["NOTIFY_CONTROLLER_TABLE"],
+        expired_grace_minutes=os.environ["EXPIRED_GRACE_MINUTES"],
+        max_workers=os.environ["MAX_WORKERS"],
+        dry_run=os.environ["DRY_RUN"].lower() == "true",
+    )
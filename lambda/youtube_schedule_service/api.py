@@ -1,4 +1,125 @@
-import requests
+from __future__ import annotations
+
+import threading
+from typing import TYPE_CHECKING, Callable, Iterator
+
+from quota import (
+    VIDEOS_MAX_IDS,
+    is_key_error,
+    is_quota_exceeded,
+    mark_exhausted,
+    record_key_error,
+    record_usage,
+    resolve_key,
+)
+
+if TYPE_CHECKING:
+    # 型注釈のみで参照する (実行時は get_session で読み込む)
+    import requests
+
+
+# チャンネルの公開 Atom フィード (API Key, quota 不要)
+CHANNEL_FEED_URL = "https://www.youtube.com/feeds/videos.xml"
+
+# HTTP クライアントの設定
+# (接続タイムアウト, 読込タイムアウト) 秒
+HTTP_TIMEOUT = (3.05, 10)
+# 並列にポーリングするスレッド数以上にしておく
+HTTP_POOL_MAXSIZE = 16
+HTTP_RETRY_TOTAL = 3
+HTTP_RETRY_BACKOFF_FACTOR = 0.5
+HTTP_RETRY_STATUS_FORCELIST = (429, 500, 502, 503, 504)
+
+# ウォームスタート時に TCP/TLS 接続を再利用するため, モジュールスコープで保持する
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """googleapis.com 向けの requests.Session を返す関数.
+
+    初回呼び出し時にのみ生成し, 以降は同一コンテナ内で使い回す \n
+    5xx/429 の場合はバックオフしながらリトライする \n
+    リトライし切った場合もレスポンスをそのまま返し, 呼び出し側の is_error で判定する
+
+    Returns:
+        requests.Session: コネクションプール付きのセッション
+    """
+    global _session
+    with _session_lock:
+        if _session is not None:
+            return _session
+        # requests はコールドスタート時間を抑えるため, 初めて通信する時点で読み込む
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(
+            total=HTTP_RETRY_TOTAL,
+            backoff_factor=HTTP_RETRY_BACKOFF_FACTOR,
+            status_forcelist=HTTP_RETRY_STATUS_FORCELIST,
+            allowed_methods=frozenset(["GET"]),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=2,
+            pool_maxsize=HTTP_POOL_MAXSIZE,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        _session = session
+        return _session
+
+
+def _get(url: str, params: dict) -> dict:
+    """Data API を呼び出す関数.
+
+    呼び出しごとに消費 quota を記録する. API Key が無効等のエラーも記録する \n
+    API Key の quota を使い切った場合は, プール内の次の API Key に切り替えて再度呼び出す
+
+    Args:
+        url (str): エンドポイントの URL
+        params (dict): クエリパラメータ (key を含む)
+
+    Returns:
+        dict: レスポンス
+    """
+    endpoint = url.rsplit("/", 1)[-1]
+    params = {**params, "key": resolve_key(params["key"])}
+    while True:
+        res = get_session().get(url, params=params, timeout=HTTP_TIMEOUT).json()
+        record_usage(endpoint, params["key"])
+        if is_key_error(res):
+            record_key_error(params["key"])
+        if not is_quota_exceeded(res):
+            return res
+        next_key = mark_exhausted(params["key"])
+        if next_key is None:
+            return res
+        params["key"] = next_key
+
+
+def iter_pages(request: Callable[[str | None], dict]) -> Iterator[dict]:
+    """nextPageToken をたどりながら, レスポンスを1ページずつ返します.
+
+    呼び出し側が反復をやめた時点で以降のページは取得しない \n
+    エラーのレスポンスを返した場合はそこで終了する
+
+    Args:
+        request ([Callable]): page_token を受け取り1ページ分のレスポンスを返す関数
+
+    Yields:
+        [dict]: 1ページ分の取得したデータ
+    """
+    page_token = None
+    while True:
+        res = request(page_token)
+        yield res
+        page_token = res.get("nextPageToken")
+        if res.get("error") or not page_token:
+            return
 
 
 def search(YT_API_KEY: str, channel_id:str, page_token=None, kwags=None) -> dict:
@@ -29,7 +150,23 @@ def search(YT_API_KEY: str, channel_id:str, page_token=None, kwags=None) -> dict
         params["pageToken"] = page_token
     if kwags is not None:
         params.update(kwags)
-    return requests.get(url, params=params).json()
+    return _get(url, params)
+
+
+def search_pages(YT_API_KEY: str, channel_id: str, kwags=None) -> Iterator[dict]:
+    """search を全ページ分, 1ページずつ返します.
+
+    Args:
+        YT_API_KEY ([String]): YoutTube API Key
+        channel_id ([String]): channel ID
+        kwags      ([dict])  : 今回設定していないパラメタを設定する場合に必要
+
+    Returns:
+        [Iterator]: 1ページずつ取得したデータ
+    """
+    return iter_pages(
+        lambda page_token: search(YT_API_KEY=YT_API_KEY, channel_id=channel_id, page_token=page_token, kwags=kwags)
+    )
 
 
 def get_video(YT_API_KEY, video_id, page_token=None, kwags=None):
@@ -59,4 +196,116 @@ def get_video(YT_API_KEY, video_id, page_token=None, kwags=None):
         params["pageToken"] = page_token
     if kwags is not None:
         params.update(kwags)
-    return requests.get(url, params=params).json()
+    return _get(url, params)
+
+
+def get_videos(YT_API_KEY: str, video_ids: list[str], kwags=None) -> Iterator[dict]:
+    """複数の video ID をまとめて問い合わせ, レスポンスを順に返します.
+
+    video ID をカンマ区切りで id パラメタに指定し, 1リクエストあたり最大50件ずつ取得する \n
+    呼び出し側でエラーを検知した時点で以降のリクエストを打ち切れるよう, ジェネレータとしている
+
+    Args:
+        YT_API_KEY ([String])         : YoutTube API Key
+        video_ids  ([list])           : Video ID のリスト
+        kwags      ([type], optional) : 今回設定していないパラメタを設定する場合に必要 Defaults to None.
+
+    Yields:
+        [dict]: 50件ごとに取得したデータ
+    """
+    for i in range(0, len(video_ids), VIDEOS_MAX_IDS):
+        yield get_video(
+            YT_API_KEY=YT_API_KEY,
+            video_id=",".join(video_ids[i:i + VIDEOS_MAX_IDS]),
+            kwags=kwags,
+        )
+
+
+def get_channels(YT_API_KEY: str, channel_id: str, page_token=None, kwags=None) -> dict:
+    """API リクエストのパラメータに一致するチャンネルのリストを返します.
+
+    アップロード動画の再生リスト ID (contentDetails.relatedPlaylists.uploads) を取得することがここでの主目的 \n
+    channel ID はカンマ区切りで最大50件まで指定できる
+
+    Args:
+        YT_API_KEY ([String])         : YoutTube API Key
+        channel_id ([String])         : channel ID
+        page_token ([String])         : page_token デフォルト: None (使用しない場合)
+        kwags      ([type], optional) : 今回設定していないパラメタを設定する場合に必要 Defaults to None.
+
+    Returns:
+        [dict]: 取得したデータ
+    """
+    url = "https://www.googleapis.com/youtube/v3/channels"
+    params = {
+        "key": YT_API_KEY,
+        "id": channel_id,
+        "part": "contentDetails",
+        "maxResults": 50}
+    if page_token is not None:
+        params["pageToken"] = page_token
+    if kwags is not None:
+        params.update(kwags)
+    return _get(url, params)
+
+
+def get_playlist_items(YT_API_KEY: str, playlist_id: str, page_token=None, kwags=None) -> dict:
+    """API リクエストのパラメータに一致する再生リストアイテムのリストを返します.
+
+    アップロード動画の再生リストから直近の video ID を取得することがここでの主目的 \n
+    search と比べて quota の消費が少ない (search: 100, playlistItems: 1) \n
+    一回で取得できる最大数は50件までであるため, それ以上取得する場合は page_tokeを使用する
+
+    Args:
+        YT_API_KEY  ([String])         : YoutTube API Key
+        playlist_id ([String])         : 再生リスト ID
+        page_token  ([String])         : page_token デフォルト: None (使用しない場合)
+        kwags       ([type], optional) : 今回設定していないパラメタを設定する場合に必要 Defaults to None.
+
+    Returns:
+        [dict]: 取得したデータ
+    """
+    url = "https://www.googleapis.com/youtube/v3/playlistItems"
+    params = {
+        "key": YT_API_KEY,
+        "playlistId": playlist_id,
+        "part": "snippet",
+        "maxResults": 50}
+    if page_token is not None:
+        params["pageToken"] = page_token
+    if kwags is not None:
+        params.update(kwags)
+    return _get(url, params)
+
+
+def get_playlist_items_pages(YT_API_KEY: str, playlist_id: str, kwags=None) -> Iterator[dict]:
+    """playlistItems を全ページ分, 1ページずつ返します.
+
+    Args:
+        YT_API_KEY  ([String])         : YoutTube API Key
+        playlist_id ([String])         : 再生リスト ID
+        kwags       ([type], optional) : 今回設定していないパラメタを設定する場合に必要 Defaults to None.
+
+    Returns:
+        [Iterator]: 1ページずつ取得したデータ
+    """
+    return iter_pages(
+        lambda page_token: get_playlist_items(
+            YT_API_KEY=YT_API_KEY, playlist_id=playlist_id, page_token=page_token, kwags=kwags
+        )
+    )
+
+
+def get_channel_feed(channel_id: str) -> tuple[int, str]:
+    """チャンネルの公開 Atom フィードを取得します.
+
+    直近15件の投稿を quota を消費せずに取得できる
+
+    Args:
+        channel_id ([String]): channel ID
+
+    Returns:
+        [tuple]: (HTTP ステータスコード, フィードの XML 文字列)
+    """
+    res = get_session().get(CHANNEL_FEED_URL, params={"channel_id": channel_id}, timeout=HTTP_TIMEOUT)
+    return res.status_code, res.text
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Iterator
+import xml.etree.ElementTree as ET
+
+from api import get_channel_feed, get_playlist_items_pages, search_pages
+from common_utils import parse_datetime
+
+
+# 動画の検出方法
+# search  : search.list (100 quota/チャンネル)
+# playlist: アップロード動画の再生リスト + videos.list (1 quota/チャンネル + 1 quota/50動画)
+# feed    : 公開 Atom フィード + videos.list (0 quota/チャンネル + 1 quota/50動画)
+# playlist/feed は video ID のみを返し, videos.list は呼び出し側で全チャンネル分まとめて呼び出す
+SEARCH = "search"
+PLAYLIST = "playlist"
+FEED = "feed"
+
+FEED_NAMESPACES = {
+    "atom": "http://www.w3.org/2005/Atom",
+    "yt": "http://www.youtube.com/xml/schemas/2015",
+}
+
+
+def to_search_item(video: dict) -> dict:
+    """videos.list の item を search の item と同じ形に詰め直す関数.
+
+    is_upcoming() や get_videoid_from_item() をそのまま使えるようにするため \n
+    liveStreamingDetails も合わせて保持し, 再度 videos.list を呼ばなくて済むようにする
+
+    Args:
+        video (dict): videos.list の item
+
+    Returns:
+        dict: search の item と同じ形の dict
+    """
+    return {
+        "kind": "youtube#searchResult",
+        "id": {"kind": "youtube#video", "videoId": video["id"]},
+        "snippet": video.get("snippet", {}),
+        "liveStreamingDetails": video.get("liveStreamingDetails", {}),
+    }
+
+
+def to_video_id_item(video_id: str, published_at: str | None) -> dict:
+    """video ID のみ分かっている動画を search の item と同じ形にする関数.
+
+    liveBroadcastContent を持たないため配信予定とは判定されない. 呼び出し側で videos.list により解決する
+
+    Args:
+        video_id (str): video ID
+        published_at (str | None): 投稿日時 (取得済み位置の計算に使用する)
+
+    Returns:
+        dict: search の item と同じ形の dict
+    """
+    return {
+        "kind": "youtube#searchResult",
+        "id": {"kind": "youtube#video", "videoId": video_id},
+        "snippet": {"publishedAt": published_at} if published_at else {},
+    }
+
+
+def get_video_id(item: dict) -> str:
+    return item["id"]["videoId"]
+
+
+def is_older_than(item: dict, threshold: datetime) -> bool:
+    """item の publishedAt が threshold より前か判定する関数.
+
+    Args:
+        item (dict): search / playlistItems の item
+        threshold (datetime): 基準日時
+
+    Returns:
+        bool: threshold より前: True
+    """
+    published_at = item.get("snippet", {}).get("publishedAt")
+    return bool(published_at) and parse_datetime(published_at) < threshold
+
+
+def discover_by_search(yt_api_key: str, channel: dict, published_after: str) -> Iterator[dict]:
+    """search.list で直近の動画を1ページずつ取得する関数.
+
+    新しい順に取得し, published_after より前の動画が現れた時点で以降のページは取得しない
+
+    Args:
+        yt_api_key (str): YouTube API Key
+        channel (dict): スケジュールマスターのアイテム
+        published_after (str): この日時以降に投稿された動画を対象とする
+
+    Yields:
+        dict: search のレスポンス
+    """
+    threshold = parse_datetime(published_after)
+    pages = search_pages(
+        YT_API_KEY=yt_api_key,
+        channel_id=channel["channel_id"],
+        kwags={"publishedAfter": published_after, "order": "date"},
+    )
+    for res in pages:
+        if res.get("error"):
+            yield res
+            return
+        items = res.get("items", [])
+        newer_items = [item for item in items if not is_older_than(item, threshold)]
+        yield {"items": newer_items}
+        if len(newer_items) < len(items):
+            return
+
+
+def discover_by_playlist(yt_api_key: str, channel: dict, published_after: str) -> Iterator[dict]:
+    """アップロード動画の再生リストから直近の動画を1ページずつ取得する関数.
+
+    再生リストは新しい順に並んでいるため, published_after より前の動画が現れた時点で以降のページは取得しない \n
+    再生リスト ID が未解決のチャンネルは search にフォールバックする
+
+    Args:
+        yt_api_key (str): YouTube API Key
+        channel (dict): スケジュールマスターのアイテム
+        published_after (str): この日時以降に投稿された動画を対象とする
+
+    Yields:
+        dict: search と同じ形のレスポンス. items は video ID のみの item, video_ids は未解決の video ID
+    """
+    if not channel.get("uploads_playlist_id"):
+        yield from discover_by_search(yt_api_key, channel, published_after)
+        return
+
+    threshold = parse_datetime(published_after)
+    pages = get_playlist_items_pages(YT_API_KEY=yt_api_key, playlist_id=channel["uploads_playlist_id"])
+    for res in pages:
+        if res.get("error"):
+            yield res
+            return
+        items = res.get("items", [])
+        newer_items = [
+            to_video_id_item(item["snippet"]["resourceId"]["videoId"], item["snippet"].get("publishedAt"))
+            for item in items
+            if not is_older_than(item, threshold)
+        ]
+        yield {"items": newer_items, "video_ids": [get_video_id(item) for item in newer_items]}
+        if len(newer_items) < len(items):
+            return
+
+
+def discover_by_feed(yt_api_key: str, channel: dict, published_after: str) -> Iterator[dict]:
+    """チャンネルの公開 Atom フィードから直近の動画を取得する関数.
+
+    フィードは1ページのみ
+
+    Args:
+        yt_api_key (str): YouTube API Key
+        channel (dict): スケジュールマスターのアイテム
+        published_after (str): この日時以降に投稿された動画を対象とする
+
+    Yields:
+        dict: search と同じ形のレスポンス. items は video ID のみの item, video_ids は未解決の video ID
+    """
+    status_code, text = get_channel_feed(channel["channel_id"])
+    if status_code != 200:
+        yield {"error": {"code": status_code, "message": f"failed to fetch feed: {channel['channel_id']}"}}
+        return
+    try:
+        root = ET.fromstring(text)
+    except ET.ParseError as e:
+        yield {"error": {"code": status_code, "message": f"failed to parse feed: {channel['channel_id']} {e}"}}
+        return
+
+    threshold = parse_datetime(published_after)
+    items = [
+        to_video_id_item(
+            entry.findtext("yt:videoId", namespaces=FEED_NAMESPACES),
+            entry.findtext("atom:published", namespaces=FEED_NAMESPACES),
+        )
+        for entry in root.iterfind("atom:entry", FEED_NAMESPACES)
+        if parse_datetime(entry.findtext("atom:published", namespaces=FEED_NAMESPACES)) >= threshold
+    ]
+    yield {"items": items, "video_ids": [get_video_id(item) for item in items]}
+
+
+DISCOVERY_BACKENDS = {
+    SEARCH: discover_by_search,
+    PLAYLIST: discover_by_playlist,
+    FEED: discover_by_feed,
+}
+
+
+def discover(backend: str, yt_api_key: str, channel: dict, published_after: str) -> Iterator[dict]:
+    """指定された方法でチャンネルの直近の動画を1ページずつ取得する関数.
+
+    Args:
+        backend (str): 動画の検出方法 (search/playlist/feed)
+        yt_api_key (str): YouTube API Key
+        channel (dict): スケジュールマスターのアイテム
+        published_after (str): この日時以降に投稿された動画を対象とする
+
+    Returns:
+        Iterator[dict]: search と同じ形のレスポンス (1ページ分ずつ). \n
+            playlist/feed の場合は video_ids に videos.list で解決が必要な video ID を持つ
+    """
+    return DISCOVERY_BACKENDS[backend](yt_api_key, channel, published_after)
@@ -4,22 +4,68 @@ import logging
 import os
 import json
 import datetime
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
 
-from api import get_video, search
-from schedule_utils import (
+from api import get_channels, get_videos, VIDEOS_MAX_IDS
+from discovery import discover, to_search_item, PLAYLIST
+from quota import (
+    calc_runs_left_today,
+    estimate_reserved_units,
+    flush_usage,
+    get_active_key,
+    get_daily_usage,
+    get_quota_day,
+    has_key_error,
+    plan_discovery,
+    set_key_pool,
+)
+from common_utils import (
     calc_published_after_str, 
-    get_value_from_ssm,
-    get_target_channel_id_from_dyn, 
+    get_values_from_ssm,
+    clear_ssm_cache,
     calc_version,
-    register_schedule_to_db,
-    same_as_current_version,
-    publish_to_sns,
+    calc_content_hash,
+    get_masters,
+    claim_version,
+    build_version_item,
+    put_items,
+    update_content,
+    invoke_lambda_async,
+    mark_published,
+    parse_datetime,
+    publish_batch_to_sns,
+    SNS_PUBLISH_BATCH_MAX,
+)
+from schedule_utils import (
+    calc_published_after_from_cursor,
+    update_published_after_cursor,
+    get_target_channels_from_dyn,
+    register_uploads_playlist_id,
+    build_tracking_item,
+    register_tracking_video,
+    query_tracking_videos,
+    count_tracking_videos,
+    delete_tracking_video,
+    get_resume_channel_ids,
+    save_resume_channel_ids,
+    invoke_resume,
+    send_shards,
 )
 
 # set logging
 logger = logging.getLogger()
 logger.setLevel(os.environ["LOG_LEVEL"])
 
+# 配信状態の追跡 (handler の event に {"mode": "track"} を指定して起動する)
+TRACK_MODE = "track"
+# 前回処理しきれなかったチャンネルのみを処理する (handler の event に {"mode": "resume"} を指定して起動する)
+RESUME_MODE = "resume"
+# 実行時間の上限に達し, 処理しきれなかったチャンネルが残っている場合のステータスコード
+INCOMPLETE_STATUS_CODE = 206
+STARTED_STATUS = "配信が始まりました"
+
 
 def is_upcoming(item: dict) -> bool | None:
     return item.get("snippet") and item["snippet"].get("liveBroadcastContent") and item["snippet"]["liveBroadcastContent"] == "upcoming"
@@ -51,107 +97,1097 @@ def is_error(res: dict) -> bool:
     return False
 
 
+def calc_channel_published_after(channel: dict, timedelta_days: float, cursor_overlap_minutes: float) -> str:
+    """チャンネルごとに, どの日時以降の動画を取得するかを決める関数.
+
+    取得済み位置 (published_after_cursor) があればそこから余裕分を引いた日時, \n
+    なければ timedelta_days 日前とする
+
+    Args:
+        channel (dict): スケジュールマスターのアイテム
+        timedelta_days (float): 取得済み位置がない場合に何日前までの動画を対象とするか
+        cursor_overlap_minutes (float): 取得済み位置から遡る分数
+
+    Returns:
+        str: publishedAfter (%Y-%m-%dT%H:%M:%SZ)
+    """
+    if channel.get("published_after_cursor"):
+        return calc_published_after_from_cursor(channel["published_after_cursor"], float(cursor_overlap_minutes))
+    return calc_published_after_str(float(timedelta_days))
+
+
+def get_newest_published_at(res_search: dict) -> str | None:
+    """search の結果のうち, 最新の publishedAt を返す関数.
+
+    Args:
+        res_search (dict): YouTube API Response
+
+    Returns:
+        str | None: 最新の publishedAt (%Y-%m-%dT%H:%M:%SZ). 1件もない場合は None
+    """
+    published_ats = [
+        parse_datetime(item["snippet"]["publishedAt"])
+        for item in res_search.get("items", [])
+        if item.get("snippet", {}).get("publishedAt")
+    ]
+    if not published_ats:
+        return None
+    return max(published_ats).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def poll_channel(yt_api_key: str, channel: dict, published_after: str, discovery_backend: str) -> dict:
+    """チャンネルの直近で投稿された動画を1ページずつ取得し, 今後配信予定のものを抽出する関数.
+
+    ページごとに抽出して捨てるため, ページ数が増えてもメモリ使用量は増えない \n
+    スレッドプールから呼び出されるため, ログ出力は呼び出し側でまとめて行う
+
+    Args:
+        yt_api_key (str): YouTube API Key
+        channel (dict): スケジュールマスターのアイテム
+        published_after (str): この日時以降に投稿された動画を対象とする
+        discovery_backend (str): 動画の検出方法 (search/playlist/feed)
+
+    Returns:
+        dict: error: エラーのレスポンス (正常時は None. 例外の場合も error に詰める), items: 配信予定の item,
+              video_ids: videos.list で解決が必要な video ID (playlist/feed), \n
+              newest_published_at: 最新の publishedAt, total: 取得した動画数
+    """
+    result = {"error": None, "items": [], "video_ids": [], "newest_published_at": None, "total": 0}
+    pages = discover(
+        backend=discovery_backend,
+        yt_api_key=yt_api_key,
+        channel=channel,
+        published_after=published_after,
+    )
+    try:
+        for res_search in pages:
+            if res_search.get("error"):
+                result["error"] = res_search
+                break
+            result["total"] += len(res_search.get("items", []))
+            result["items"].extend(extract_upcoming_items(res_search))
+            result["video_ids"].extend(res_search.get("video_ids", []))
+            newest_published_at = get_newest_published_at(res_search)
+            if newest_published_at and (result["newest_published_at"] or "") < newest_published_at:
+                result["newest_published_at"] = newest_published_at
+    except Exception as e:
+        # 通信エラー等で1チャンネルが失敗しても, 他のチャンネルの処理は続ける
+        result["error"] = {"error": {"message": f"{type(e).__name__}: {e}", "channel_id": channel["channel_id"]}}
+    return result
+
+
+def resolve_uploads_playlist_ids(yt_api_key: str, schedule_master_table_name: str, channels: list[dict]) -> None:
+    """アップロード動画の再生リスト ID が未登録のチャンネルについて解決し, マスターに登録する関数.
+
+    一度登録すれば以降は channels.list を呼ばない \n
+    解決したIDは channels の各アイテムにも反映する
+
+    Args:
+        yt_api_key (str): YouTube API Key
+        schedule_master_table_name (str): スケジュールマスターテーブル名
+        channels (list[dict]): スケジュールマスターのアイテム
+    """
+    unresolved = {channel["channel_id"]: channel for channel in channels if not channel.get("uploads_playlist_id")}
+    channel_ids = list(unresolved)
+    for i in range(0, len(channel_ids), VIDEOS_MAX_IDS):
+        res_channels = get_channels(YT_API_KEY=yt_api_key, channel_id=",".join(channel_ids[i:i + VIDEOS_MAX_IDS]))
+        if is_error(res_channels):
+            # 未解決のチャンネルは search にフォールバックする
+            return
+        for item in res_channels.get("items", []):
+            uploads_playlist_id = item.get("contentDetails", {}).get("relatedPlaylists", {}).get("uploads")
+            if not uploads_playlist_id:
+                continue
+            register_uploads_playlist_id(schedule_master_table_name, item["id"], uploads_playlist_id)
+            unresolved[item["id"]]["uploads_playlist_id"] = uploads_playlist_id
+            logger.info(f"register uploads playlist: {item['id']} -> {uploads_playlist_id}")
+
+
+def extract_upcoming_items(res_search: dict) -> list[dict]:
+    """search の結果から, 今後配信予定のものを抽出する関数.
+
+    Args:
+        res_search (dict): YouTube API Response
+
+    Returns:
+        list[dict]: 配信予定の search item
+    """
+    upcoming_items = []
+    for item in res_search.get("items", []):
+        # 今後配信予定のブロードキャスト
+        if is_upcoming(item) and get_videoid_from_item(item):
+            upcoming_items.append(item)
+    return upcoming_items
+
+
+def resolve_videos(yt_api_key: str, video_ids: list[str]) -> list[dict] | None:
+    """playlist/feed で検出した video ID を, 全チャンネル分まとめて search と同じ形の item に解決する関数.
+
+    videos.list (snippet,liveStreamingDetails) を50件ずつのバッチで呼び出す
+
+    Args:
+        yt_api_key (str): YouTube API Key
+        video_ids (list[str]): video ID のリスト
+
+    Returns:
+        list[dict] | None: search と同じ形の item (liveStreamingDetails を含む). エラーの場合は None
+    """
+    items = []
+    for res in get_videos(YT_API_KEY=yt_api_key, video_ids=video_ids, kwags={"part": "snippet,liveStreamingDetails"}):
+        if is_error(res):
+            return None
+        items.extend(to_search_item(video) for video in res.get("items", []))
+    return items
+
+
+def get_live_streaming_details(yt_api_key: str, video_ids: list[str]) -> dict[str, dict] | None:
+    """video ID ごとの liveStreamingDetails をまとめて取得する関数.
+
+    videos.list を50件ずつのバッチで呼び出し, video ID をキーとした辞書に詰め直す
+
+    Args:
+        yt_api_key (str): YouTube API Key
+        video_ids (list[str]): video ID のリスト
+
+    Returns:
+        dict[str, dict] | None: video ID -> liveStreamingDetails. エラーの場合は None
+    """
+    details = {}
+    for res_get_video in get_videos(YT_API_KEY=yt_api_key, video_ids=video_ids):
+        if is_error(res_get_video):
+            return None
+        for video in res_get_video.get("items", []):
+            details[video["id"]] = video.get("liveStreamingDetails", {})
+    return details
+
+
+def process_upcoming_item(
+    channel_id: str,
+    item: dict,
+    live_streaming_details: dict,
+    master: dict | None,
+    notify_controller_table_name: str,
+) -> dict | None:
+    """配信予定の動画1件について, 通知が必要か判定し通知内容を返す関数.
+
+    予定開始時刻が変わった場合のみ新しいバージョンとして通知する \n
+    タイトルのみ変わった場合はマスターのタイトルを書き換えるだけとし, 通知時にマスターから読み込ませる \n
+    同じバージョンでも未通知 (published=false) のまま残っている場合は, 前回の実行が通知前に中断したため通知し直す \n
+    マスターへの登録と通知は publish_upcoming_items でまとめて行う (他の実行が通知中の場合はそこで除外される)
+
+    Args:
+        channel_id (str): channel ID
+        item (dict): search item
+        live_streaming_details (dict): videos.list で取得した liveStreamingDetails
+        master (dict | None): 登録済みのマスター. 未登録の場合は None
+        notify_controller_table_name (str): 通知管理テーブル名
+
+    Returns:
+        dict | None: 通知する内容 (channel_id, video_id, version, title, scheduled_start_time, content_hash, \n
+            time_stamp). 通知不要の場合は None
+    """
+    # 各種値を取得
+    video_id = get_videoid_from_item(item)
+    title = item["snippet"]["title"]
+    scheduled_start_time = live_streaming_details["scheduledStartTime"]
+    version = calc_version(scheduled_start_time)
+    content_hash = calc_content_hash(title)
+    current_version = master["current_version"] if master else None
+    dt_now = datetime.datetime.now()
+    time_stamp = dt_now.strftime('%Y-%m-%d %H:%M:%S [UTC]')
+
+    # すでに取得済みのものであればSkip. タイトルのみ変わっていればマスターを書き換える
+    if current_version == version:
+        if master.get("content_hash") != content_hash and update_content(
+            table_name=notify_controller_table_name,
+            video_id=video_id,
+            version=version,
+            title=title,
+            content_hash=content_hash,
+            time_stamp=time_stamp,
+        ):
+            logger.info(f"update title: {video_id} {title}")
+        # published がないマスターは, 未通知の印を導入する前に通知済みのもの
+        if master.get("published", True):
+            return None
+        logger.warning(f"not published yet: {video_id} {version}")
+
+    return {
+        "channel_id": channel_id,
+        "video_id": video_id,
+        "version": version,
+        "title": title,
+        "scheduled_start_time": scheduled_start_time,
+        "content_hash": content_hash,
+        "time_stamp": time_stamp,
+    }
+
+
+def build_sns_item(upcoming: dict) -> dict:
+    """process_upcoming_item の戻り値から, SNSトピックに投げるメッセージを作成する関数.
+
+    Args:
+        upcoming (dict): process_upcoming_item の戻り値
+
+    Returns:
+        dict: プロトコルごとのメッセージ (MessageStructure=json)
+    """
+    lambda_input = {
+        "channel_id": upcoming["channel_id"],
+        "video_id": upcoming["video_id"],
+        "version": upcoming["version"],
+        "title": upcoming["title"],
+        "scheduled_start_time": upcoming["scheduled_start_time"],
+    }
+    dt_j = parse_datetime(upcoming["scheduled_start_time"]).astimezone(datetime.timezone(datetime.timedelta(hours=9)))
+    notify_str = f"枠が立ちました: {upcoming['title']} [{dt_j.isoformat()}]"
+    return {
+        "default": json.dumps(lambda_input, ensure_ascii=False),
+        "email": notify_str,
+        "lambda": json.dumps(lambda_input, ensure_ascii=False),
+        "sms": notify_str,
+    }
+
+
+def publish_upcoming_items(
+    upcomings: list[dict],
+    notify_controller_table_name: str,
+    topic_arn: str,
+) -> list[dict]:
+    """process_upcoming_item で判定した動画をマスターに登録し, 直後に SNSトピックへ PublishBatch でまとめて通知する関数.
+
+    先にマスターのバージョンを入れ替えて通知する権利を取得し (claim_version), 取得できた動画のみ通知する \n
+    並行して実行された場合でも二重に通知されない \n
+    通知に成功した動画は, 履歴と追跡のアイテムを1回の BatchWriteItem で書き込んでから通知済みにする \n
+    通知に失敗した動画や通知前に実行が中断した動画は未通知のまま残り, 権利の期限が切れた後の実行で通知し直す \n
+    ※ 中断に備えるため, 呼び出し側は SNS_PUBLISH_BATCH_MAX 件以下ずつ呼び出すこと
+
+    Args:
+        upcomings (list[dict]): process_upcoming_item の戻り値のリスト
+        notify_controller_table_name (str): 通知管理テーブル名
+        topic_arn (str): 通知先のSNSトピックのARN
+
+    Returns:
+        list[dict]: 通知に失敗した upcomings の要素
+    """
+    token = uuid.uuid4().hex
+    claimed = []
+    for upcoming in upcomings:
+        if not claim_version(
+            table_name=notify_controller_table_name,
+            video_id=upcoming["video_id"],
+            version=upcoming["version"],
+            title=upcoming["title"],
+            content_hash=upcoming["content_hash"],
+            time_stamp=upcoming["time_stamp"],
+            token=token,
+        ):
+            logger.info(f"already registered or publishing: {upcoming['video_id']} {upcoming['version']}")
+            continue
+        claimed.append(upcoming)
+    if not claimed:
+        return []
+    failed_indexes = set(publish_batch_to_sns(topic_arn, [build_sns_item(upcoming) for upcoming in claimed]))
+
+    failed = []
+    published = []
+    for index, upcoming in enumerate(claimed):
+        if index in failed_indexes:
+            logger.warning(f"failed to publish: {upcoming['video_id']} {upcoming['version']}")
+            failed.append(upcoming)
+        else:
+            published.append(upcoming)
+    if not published:
+        return failed
+
+    # 履歴と, 定期実行のたびに予定変更を確認するための追跡 (refresh_known_videos) のアイテム
+    put_items(notify_controller_table_name, [
+        item
+        for upcoming in published
+        for item in (
+            build_version_item(
+                video_id=upcoming["video_id"],
+                version=upcoming["version"],
+                title=upcoming["title"],
+                content_hash=upcoming["content_hash"],
+                scheduled_start_time=upcoming["scheduled_start_time"],
+                time_stamp=upcoming["time_stamp"],
+            ),
+            build_tracking_item(
+                upcoming["video_id"],
+                upcoming["channel_id"],
+                upcoming["version"],
+                upcoming["scheduled_start_time"],
+            ),
+        )
+    ])
+    for upcoming in published:
+        if not mark_published(notify_controller_table_name, upcoming["video_id"], token):
+            # 通知中に他の実行が新しいバージョンに入れ替えた場合. 古いバージョンの通知は後続の処理で無視される
+            logger.warning(f"superseded while publishing: {upcoming['video_id']} {upcoming['version']}")
+        logger.info(
+            f"put event title={upcoming['title']} scheduled_start_time={upcoming['scheduled_start_time']}")
+    return failed
+
+
+def build_started_message(tracking: dict, video: dict) -> dict:
+    """配信開始の通知内容を組み立てる関数.
+
+    create_rule_service がルールに設定する通知内容と同じ形にする
+
+    Args:
+        tracking (dict): query_tracking_videos の要素
+        video (dict): videos.list の item
+
+    Returns:
+        dict: 通知内容
+    """
+    return {
+        "channel_id": tracking["channel_id"],
+        "video_id": tracking["video_id"],
+        "version": tracking["schedule_version"],
+        "title": video["snippet"]["title"],
+        "scheduled_start_time": tracking["scheduled_start_time"],
+        "status": STARTED_STATUS,
+        "rule_name": f"rul_{tracking['channel_id']}_{tracking['video_id']}_sdk",
+    }
+
+
+def track_live(
+    yt_api_key: str,
+    track_horizon_hours: float,
+    notify_controller_table_name: str,
+    topic_arn: str,
+    notify_lambda_arn: str,
+) -> int:
+    """追跡中の動画の配信状態を確認し, 配信開始の通知と予定変更の反映を行う関数.
+
+    予定開始時刻の前後 track_horizon_hours 時間以内の動画を videos.list で50件ずつまとめて問い合わせる \n
+    ・actualStartTime が入った動画: 配信開始を通知し, 追跡を終える \n
+    ・scheduledStartTime が変わった動画: 新しいバージョンとして登録し直す (ルールは create_rule_service が作り直す) \n
+    ・取得できなくなった動画, 予定開始時刻を track_horizon_hours 時間以上過ぎた動画: 追跡を終える
+
+    Args:
+        yt_api_key (str): YouTube API Key
+        track_horizon_hours (float): 追跡する範囲 (時間)
+        notify_controller_table_name (str): 通知管理テーブル名
+        topic_arn (str): 予定変更の通知先のSNSトピックのARN
+        notify_lambda_arn (str): 配信開始を通知する Lambda の ARN
+
+    Returns:
+        int: ステータスコード
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    horizon = datetime.timedelta(hours=float(track_horizon_hours))
+    targets = []
+    for tracking in query_tracking_videos(notify_controller_table_name):
+        scheduled_start_time = parse_datetime(tracking["scheduled_start_time"])
+        if scheduled_start_time < now - horizon:
+            delete_tracking_video(notify_controller_table_name, tracking["video_id"], tracking["scheduled_start_time"])
+            logger.info(f"give up tracking: {tracking['video_id']}")
+        elif scheduled_start_time <= now + horizon:
+            targets.append(tracking)
+    if not targets:
+        return 200
+
+    videos = {}
+    for res in get_videos(
+        YT_API_KEY=yt_api_key,
+        video_ids=[tracking["video_id"] for tracking in targets],
+        kwags={"part": "snippet,liveStreamingDetails"},
+    ):
+        if is_error(res):
+            return 400
+        videos.update((video["id"], video) for video in res.get("items", []))
+
+    started = []
+    rescheduled = []
+    for tracking in targets:
+        video = videos.get(tracking["video_id"])
+        if video is None:
+            delete_tracking_video(notify_controller_table_name, tracking["video_id"], tracking["scheduled_start_time"])
+            logger.info(f"video not found. stop tracking: {tracking['video_id']}")
+            continue
+        details = video.get("liveStreamingDetails", {})
+        if details.get("actualStartTime"):
+            # 削除に成功した実行のみ通知し, 二重に通知しない
+            if delete_tracking_video(notify_controller_table_name, tracking["video_id"], tracking["scheduled_start_time"]):
+                started.append((tracking, build_started_message(tracking, video)))
+        elif details.get("scheduledStartTime") and details["scheduledStartTime"] != tracking["scheduled_start_time"]:
+            rescheduled.append((tracking, video))
+
+    if started:
+        try:
+            invoke_lambda_async(notify_lambda_arn, [message for _, message in started])
+        except Exception:
+            # 次の実行で再度通知されるよう, 追跡を元に戻す
+            for tracking, _ in started:
+                register_tracking_video(
+                    notify_controller_table_name,
+                    tracking["video_id"],
+                    tracking["channel_id"],
+                    tracking["schedule_version"],
+                    tracking["scheduled_start_time"],
+                )
+            raise
+        for _, message in started:
+            logger.info(f"started: {message['video_id']} {message['title']}")
+
+    if rescheduled:
+        masters = get_masters(notify_controller_table_name, [tracking["video_id"] for tracking, _ in rescheduled])
+        upcomings = []
+        for tracking, video in rescheduled:
+            scheduled_start_time = video["liveStreamingDetails"]["scheduledStartTime"]
+            logger.info(f"rescheduled: {tracking['video_id']} {tracking['scheduled_start_time']} -> {scheduled_start_time}")
+            upcoming = process_upcoming_item(
+                channel_id=tracking["channel_id"],
+                item=to_search_item(video),
+                live_streaming_details=video["liveStreamingDetails"],
+                master=masters.get(tracking["video_id"]),
+                notify_controller_table_name=notify_controller_table_name,
+            )
+            if upcoming is not None:
+                upcomings.append(upcoming)
+        # 追跡中の予定開始時刻は, 通知した実行 (定期実行側を含む) が publish_upcoming_items で更新する
+        # 通知に失敗した動画は更新せず, 次の実行で再度検出させる
+        failed = []
+        for i in range(0, len(upcomings), SNS_PUBLISH_BATCH_MAX):
+            failed.extend(publish_upcoming_items(
+                upcomings[i:i + SNS_PUBLISH_BATCH_MAX], notify_controller_table_name, topic_arn))
+        if failed:
+            return 400
+    return 200
+
+
+def refresh_known_videos(
+    yt_api_key: str,
+    notify_controller_table_name: str,
+    topic_arn: str,
+    track_horizon_hours: float,
+    live_tracking: bool,
+    skip_video_ids: set[str] | None = None,
+) -> int:
+    """登録済みで配信開始前の動画を videos.list で確認し直し, 予定開始時刻やタイトルの変更を反映する関数.
+
+    取得済み位置から遡る範囲を過ぎた動画は検出し直されないため, 定期実行のたびに呼び出す \n
+    対象は通知管理テーブルの tracking パーティションの動画で, videos.list を50件ずつまとめて呼び出す (1 quota/50動画) \n
+    ・予定開始時刻が変わった動画: 新しいバージョンとして登録し直す \n
+    ・タイトルのみ変わった動画: マスターのタイトルを書き換える \n
+    ・配信が始まった動画, 取得できなくなった動画, 予定開始時刻を track_horizon_hours 時間以上過ぎた動画: 登録を削除する \n
+    ※ 配信状態を追跡する場合, 配信開始の検知と登録の削除は track_live に任せる
+
+    Args:
+        yt_api_key (str): YouTube API Key
+        notify_controller_table_name (str): 通知管理テーブル名
+        topic_arn (str): 通知先のSNSトピックのARN
+        track_horizon_hours (float): 予定開始時刻を過ぎてから確認を続ける時間
+        live_tracking (bool): 配信状態を追跡する場合 True
+        skip_video_ids (set[str] | None): 同じ実行の process_channels で確認済みのため問い合わせない video ID
+
+    Returns:
+        int: ステータスコード
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    horizon = datetime.timedelta(hours=float(track_horizon_hours))
+    skip_video_ids = skip_video_ids or set()
+    targets = []
+    for tracking in query_tracking_videos(notify_controller_table_name):
+        if tracking["video_id"] in skip_video_ids:
+            continue
+        if parse_datetime(tracking["scheduled_start_time"]) < now - horizon:
+            if not live_tracking:
+                delete_tracking_video(notify_controller_table_name, tracking["video_id"], tracking["scheduled_start_time"])
+            continue
+        targets.append(tracking)
+    if not targets:
+        return 200
+
+    items = resolve_videos(yt_api_key, [tracking["video_id"] for tracking in targets])
+    if items is None:
+        return 400
+    items = {get_videoid_from_item(item): item for item in items}
+    masters = get_masters(notify_controller_table_name, [tracking["video_id"] for tracking in targets])
+
+    upcomings = []
+    for tracking in targets:
+        item = items.get(tracking["video_id"])
+        details = item["liveStreamingDetails"] if item else {}
+        if item is None or details.get("actualStartTime") or not details.get("scheduledStartTime"):
+            if not live_tracking:
+                delete_tracking_video(notify_controller_table_name, tracking["video_id"], tracking["scheduled_start_time"])
+            continue
+        upcoming = process_upcoming_item(
+            channel_id=tracking["channel_id"],
+            item=item,
+            live_streaming_details=details,
+            master=masters.get(tracking["video_id"]),
+            notify_controller_table_name=notify_controller_table_name,
+        )
+        if upcoming is not None:
+            logger.info(f"rescheduled: {tracking['video_id']} {tracking['scheduled_start_time']} -> {upcoming['scheduled_start_time']}")
+            upcomings.append(upcoming)
+
+    failed = []
+    for i in range(0, len(upcomings), SNS_PUBLISH_BATCH_MAX):
+        failed.extend(publish_upcoming_items(
+            upcomings[i:i + SNS_PUBLISH_BATCH_MAX], notify_controller_table_name, topic_arn))
+    return 400 if failed else 200
+
+
+def order_channels(channels: list[dict], resume_channel_ids: list[str], resume_only: bool) -> list[dict]:
+    """前回処理しきれなかったチャンネルを先頭に並べ替える関数.
+
+    Args:
+        channels (list[dict]): スケジュールマスターのアイテム
+        resume_channel_ids (list[str]): 前回処理しきれなかった channel ID
+        resume_only (bool): 前回処理しきれなかったチャンネルのみを対象とする場合 True
+
+    Returns:
+        list[dict]: 並べ替えたチャンネル
+    """
+    resume_channel_ids = set(resume_channel_ids)
+    resumed = [channel for channel in channels if channel["channel_id"] in resume_channel_ids]
+    if resume_only:
+        return resumed
+    return resumed + [channel for channel in channels if channel["channel_id"] not in resume_channel_ids]
+
+
+def process_channels(
+    yt_api_key: str,
+    channels: list[dict],
+    timedelta_days: float,
+    cursor_overlap_minutes: float,
+    discovery_backend: str,
+    max_workers: int,
+    schedule_master_table_name: str,
+    notify_controller_table_name: str,
+    topic_arn: str,
+    is_near_deadline: Callable[[], bool],
+) -> tuple[int, list[str], set[str]]:
+    """チャンネルごとに配信予定を検出し, 通知と登録を行う関数.
+
+    定期実行 (service) とシャードのワーカー (process_shard) の両方から呼び出す \n
+    videos.list で取得した最新の予定開始時刻とタイトルで判定済みの video ID を返し, \n
+    同じ実行の refresh_known_videos で問い合わせ直さないようにする
+
+    Args:
+        yt_api_key (str): YouTube API Key
+        channels (list[dict]): 対象チャンネル
+        timedelta_days (float): 取得済み位置がない場合に何日前までの動画を対象とするか
+        cursor_overlap_minutes (float): 取得済み位置から遡る分数
+        discovery_backend (str): 動画の検出方法 (search/playlist/feed)
+        max_workers (int): 並列にポーリングするスレッド数
+        schedule_master_table_name (str): スケジュールマスターテーブル名
+        notify_controller_table_name (str): 通知管理テーブル名
+        topic_arn (str): 通知先のSNSトピックのARN
+        is_near_deadline (Callable[[], bool]): 実行時間の上限が近い場合 True を返す関数
+
+    Returns:
+        tuple[int, list[str], set[str]]: (ステータスコード, 処理しきれなかった channel ID, 判定済みの video ID)
+    """
+    status_code = 200
+    max_workers = max(1, int(max_workers))
+    if discovery_backend == PLAYLIST:
+        resolve_uploads_playlist_ids(yt_api_key, schedule_master_table_name, channels)
+
+    # 全チャンネル分の配信予定を先に集める
+    # video ID を集約しておき, videos.list をまとめて呼び出すため
+    # search はチャンネルごとに並列で実行し, 結果はチャンネルの並び順に集計する
+    candidates = []
+    # 処理に成功したチャンネルの取得済み位置
+    cursors = {}
+    # 失敗したチャンネル (取得済み位置を進めず, 次の定期実行にて再処理する)
+    failed_channel_ids = set()
+    # 実行時間の上限に達して処理しきれなかったチャンネル (次の実行に引き継ぐ)
+    pending_channel_ids = []
+    # process_upcoming_item で判定済みの動画
+    processed_video_ids = set()
+    # playlist/feed で検出し, videos.list で解決する video ID -> channel ID
+    unresolved = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for i in range(0, len(channels), max_workers):
+            if is_near_deadline():
+                pending_channel_ids = [channel["channel_id"] for channel in channels[i:]]
+                break
+            chunk = channels[i:i + max_workers]
+            results = executor.map(
+                lambda channel: poll_channel(
+                    yt_api_key,
+                    channel,
+                    calc_channel_published_after(channel, timedelta_days, cursor_overlap_minutes),
+                    discovery_backend,
+                ),
+                chunk,
+            )
+            for channel, result in zip(chunk, results):
+                channel_id = channel["channel_id"]
+                logger.info(
+                    f"start: {channel_id} total={result['total']} upcoming={len(result['items'])}"
+                    f" unresolved={len(result['video_ids'])}")
+                for item in result["items"]:
+                    logger.info(f'({item["snippet"]["channelTitle"]}) {item["snippet"]["title"]}')
+                candidates.extend((channel_id, item) for item in result["items"])
+                unresolved.update((video_id, channel_id) for video_id in result["video_ids"])
+                if result["error"] is not None and is_error(result["error"]):
+                    failed_channel_ids.add(channel_id)
+                    status_code = 400
+                    continue
+                if result["newest_published_at"]:
+                    cursors[channel_id] = result["newest_published_at"]
+
+    # playlist/feed で検出した動画は, 全チャンネル分まとめて videos.list (50件ずつ) で解決してから配信予定を抽出する
+    if unresolved:
+        try:
+            resolved_items = resolve_videos(yt_api_key, list(unresolved))
+        except Exception:
+            logger.exception("failed to resolve videos")
+            resolved_items = None
+        if resolved_items is None:
+            # 解決できなかった動画のチャンネルは失敗とし, 取得済み位置を進めない
+            failed_channel_ids.update(unresolved.values())
+            status_code = 400
+        else:
+            for item in extract_upcoming_items({"items": resolved_items}):
+                logger.info(f'({item["snippet"]["channelTitle"]}) {item["snippet"]["title"]}')
+                candidates.append((unresolved[get_videoid_from_item(item)], item))
+
+    # 同じ動画が複数回検出された場合は1件にまとめる
+    candidates = list({get_videoid_from_item(item): (channel_id, item) for channel_id, item in candidates}.values())
+
+    # 取得した video ID の予定開始時刻を50件ずつまとめて取得
+    # playlist/feed で検出した場合は videos.list で取得済みのため問い合わせない
+    details = {
+        get_videoid_from_item(item): item["liveStreamingDetails"]
+        for _, item in candidates if "liveStreamingDetails" in item
+    }
+    video_ids = list(dict.fromkeys(
+        get_videoid_from_item(item) for _, item in candidates
+        if get_videoid_from_item(item) not in details
+    ))
+    if video_ids:
+        try:
+            fetched_details = get_live_streaming_details(yt_api_key, video_ids)
+        except Exception:
+            logger.exception("failed to get liveStreamingDetails")
+            fetched_details = None
+        if fetched_details is None:
+            # 取得できなかった動画のチャンネルのみ失敗とし, 取得済みの動画は処理を続ける
+            failed_channel_ids.update(
+                channel_id for channel_id, item in candidates if get_videoid_from_item(item) in video_ids)
+            status_code = 400
+        else:
+            details.update(fetched_details)
+
+    # 登録済みのマスターをまとめて取得しておき, 各動画の判定は辞書の参照のみとする
+    masters = get_masters(
+        notify_controller_table_name,
+        [video_id for video_id in details if "scheduledStartTime" in details[video_id]],
+    )
+
+    # マスターへの登録と通知は SNS_PUBLISH_BATCH_MAX 件ずつまとめて行い, 登録した直後に PublishBatch で送信する
+    # 失敗したエントリのチャンネルのみ失敗とし, 次の実行にて未通知のマスターを通知し直す
+    upcomings = []
+
+    def flush_upcomings() -> None:
+        nonlocal status_code
+        try:
+            failed = publish_upcoming_items(upcomings, notify_controller_table_name, topic_arn)
+        except Exception:
+            logger.exception(f"failed to publish: {[upcoming['video_id'] for upcoming in upcomings]}")
+            failed = list(upcomings)
+        upcomings.clear()
+        if failed:
+            failed_channel_ids.update(upcoming["channel_id"] for upcoming in failed)
+            status_code = 400
+
+    # 取得に成功した場合, 各動画ごとに処理
+    for index, (channel_id, item) in enumerate(candidates):
+        if is_near_deadline():
+            # 残りの動画のチャンネルは, 次の実行で検出し直す
+            pending_channel_ids.extend(dict.fromkeys(
+                channel_id for channel_id, _ in candidates[index:] if channel_id not in pending_channel_ids))
+            break
+        video_id = get_videoid_from_item(item)
+        if channel_id in failed_channel_ids and video_id not in details:
+            continue
+        if video_id not in details or "scheduledStartTime" not in details[video_id]:
+            logger.warning(f"liveStreamingDetails not found: {video_id}")
+            continue
+        try:
+            upcoming = process_upcoming_item(
+                channel_id=channel_id,
+                item=item,
+                live_streaming_details=details[video_id],
+                master=masters.get(video_id),
+                notify_controller_table_name=notify_controller_table_name,
+            )
+        except Exception:
+            logger.exception(f"failed to process: {channel_id} {video_id}")
+            failed_channel_ids.add(channel_id)
+            status_code = 400
+            continue
+        processed_video_ids.add(video_id)
+        if upcoming is not None:
+            upcomings.append(upcoming)
+        if len(upcomings) >= SNS_PUBLISH_BATCH_MAX:
+            flush_upcomings()
+    flush_upcomings()
+
+    # すべての動画の処理が終わってから取得済み位置を進める
+    # 失敗したチャンネルや処理しきれなかったチャンネルは進めず, 次の実行にて同じ範囲を再処理する
+    channels_by_id = {channel["channel_id"]: channel for channel in channels}
+    for channel_id, cursor in cursors.items():
+        if channel_id in failed_channel_ids or channel_id in pending_channel_ids:
+            continue
+        if update_published_after_cursor(schedule_master_table_name, channel_id, cursor):
+            logger.info(f"advance cursor: {channel_id} -> {cursor}")
+        # キャッシュしているチャンネル一覧にも反映する
+        channels_by_id[channel_id]["published_after_cursor"] = cursor
+
+    if failed_channel_ids:
+        logger.warning(f"failed channels: {sorted(failed_channel_ids)}")
+    if pending_channel_ids:
+        logger.warning(f"deadline reached. pending channels: {len(pending_channel_ids)}")
+    return status_code, pending_channel_ids, processed_video_ids
+
+
+def plan_channels(
+    channels: list[dict],
+    discovery_backend: str,
+    remaining_quota_units: int,
+    notify_controller_table_name: str,
+    live_tracking: bool,
+    live_tracking_interval_minutes: float,
+) -> tuple[str, list[dict]]:
+    """本日の残りの quota に収まるよう, 検出方法の切り替えや優先度の低いチャンネルの除外を行う関数.
+
+    登録済みの動画の確認 (refresh_known_videos) と配信状態の追跡 (track_live) で消費する分は先に差し引く
+
+    Args:
+        channels (list[dict]): 対象チャンネル
+        discovery_backend (str): 設定されている検出方法
+        remaining_quota_units (int): 本日の残りの quota
+        notify_controller_table_name (str): 通知管理テーブル名
+        live_tracking (bool): 配信状態を追跡する場合 True
+        live_tracking_interval_minutes (float): 配信状態を追跡する間隔 (分)
+
+    Returns:
+        tuple[str, list[dict]]: (検出方法, 対象チャンネル)
+    """
+    reserved_units = estimate_reserved_units(
+        count_tracking_videos(notify_controller_table_name), live_tracking, live_tracking_interval_minutes)
+    planned_backend, planned_channels = plan_discovery(
+        channels, discovery_backend, remaining_quota_units, calc_runs_left_today(), reserved_units)
+    if planned_backend != discovery_backend or len(planned_channels) < len(channels):
+        logger.warning(
+            f"quota guard: remaining={remaining_quota_units} reserved={reserved_units} "
+            f"backend={discovery_backend}->{planned_backend} channels={len(channels)}->{len(planned_channels)}")
+    return planned_backend, planned_channels
+
+
 def service(
     yt_api_key: str,
     timedelta_days: float,
+    cursor_overlap_minutes: float,
+    discovery_backend: str,
+    max_workers: int,
+    channel_cache_ttl_seconds: float,
     schedule_master_table_name: str,
     notify_controller_table_name: str,
     topic_arn: str,
+    live_tracking: bool,
+    live_tracking_interval_minutes: float,
+    remaining_quota_units: int,
+    get_remaining_time_in_millis: Callable[[], int],
+    deadline_margin_seconds: float,
+    track_horizon_hours: float,
+    resume_only: bool = False,
 ) -> int:
 
     logger.debug("Service Start!")
-    
-    for channel_id in get_target_channel_id_from_dyn(schedule_master_table_name):
-        logger.info(f"start: {channel_id}")
-        # 直近で投稿された動画の一覧を取得する
-        params = {
-            "publishedAfter": calc_published_after_str(float(timedelta_days)),
-        }
-        res_search = search(
-            YT_API_KEY=yt_api_key,
-            channel_id=channel_id, 
-            kwags=params
+
+    # 前回処理しきれなかったチャンネルがあれば, そこから処理する
+    channels = order_channels(
+        get_target_channels_from_dyn(schedule_master_table_name, float(channel_cache_ttl_seconds)),
+        get_resume_channel_ids(schedule_master_table_name),
+        resume_only,
+    )
+    discovery_backend, channels = plan_channels(
+        channels,
+        discovery_backend,
+        remaining_quota_units,
+        notify_controller_table_name,
+        live_tracking,
+        live_tracking_interval_minutes,
+    )
+
+    status_code, pending_channel_ids, processed_video_ids = process_channels(
+        yt_api_key=yt_api_key,
+        channels=channels,
+        timedelta_days=timedelta_days,
+        cursor_overlap_minutes=cursor_overlap_minutes,
+        discovery_backend=discovery_backend,
+        max_workers=max_workers,
+        schedule_master_table_name=schedule_master_table_name,
+        notify_controller_table_name=notify_controller_table_name,
+        topic_arn=topic_arn,
+        is_near_deadline=lambda: get_remaining_time_in_millis() < float(deadline_margin_seconds) * 1000,
+    )
+    save_resume_channel_ids(schedule_master_table_name, pending_channel_ids)
+    if pending_channel_ids:
+        return INCOMPLETE_STATUS_CODE
+
+    # 続きからの実行では, 登録済みの動画の確認は定期実行に任せる
+    if not resume_only:
+        refresh_status_code = refresh_known_videos(
+            yt_api_key=yt_api_key,
+            notify_controller_table_name=notify_controller_table_name,
+            topic_arn=topic_arn,
+            track_horizon_hours=track_horizon_hours,
+            live_tracking=live_tracking,
+            skip_video_ids=processed_video_ids,
         )
-        if is_error(res_search):
-            return 400
-        
-        # 取得に成功した場合, 各動画ごとに処理
-        for item in res_search.get("items", []):
-            logger.info(f'({item["snippet"]["channelTitle"]}) {item["snippet"]["title"]}')
-            # 今後配信予定のブロードキャスト
-            if is_upcoming(item) and (video_id := get_videoid_from_item(item)):
-
-                # video_idを取得
-                res_get_video = get_video(YT_API_KEY=yt_api_key, video_id=video_id)
-                if is_error(res_get_video):
-                    return 400
-
-                # 各種値を取得
-                title = item["snippet"]["title"]
-                scheduled_start_time = res_get_video["items"][0]["liveStreamingDetails"]["scheduledStartTime"]
-                version = calc_version(title, scheduled_start_time)
-                dt_now = datetime.datetime.now()
-                time_stamp = dt_now.strftime('%Y-%m-%d %H:%M:%S [UTC]')
-
-                # すでに取得済みのものであればSkip
-                if same_as_current_version(notify_controller_table_name, video_id, version):
-                    continue
+        status_code = max(status_code, refresh_status_code)
+    return status_code
 
-                # 先にSNSトピックにメッセージを投げる
-                # この処理で失敗した場合, dbに登録されず次の定期実行にて再処理される
-                lambda_input = {
-                    "channel_id": channel_id,
-                    "video_id": video_id,
-                    "version": version,
-                    "title": title,
-                    "scheduled_start_time": scheduled_start_time,
-                }
-                dt = datetime.datetime.fromisoformat(scheduled_start_time.replace('Z', '+00:00'))
-                dt_j = dt.astimezone(datetime.timezone(datetime.timedelta(hours=9)))
-                notify_str = f"枠が立ちました: {title} [{dt_j.isoformat()}]"
-                publish_to_sns(
-                    topic_arn=topic_arn,
-                    item={
-                        "default": json.dumps(lambda_input, ensure_ascii=False),
-                        "email": notify_str,
-                        "lambda": json.dumps(lambda_input, ensure_ascii=False),
-                        "sms": notify_str,
-                    }
-                )
 
-                # 現状マスターの情報をもとに一連の処理を実施する決めるため, バージョン情報から書込み
-                register_schedule_to_db(
-                    table_name=notify_controller_table_name,
-                    item={
-                        "video_id": video_id,
-                        "version": version,
-                        "title": title,
-                        "scheduled_start_time": scheduled_start_time,
-                        "time_stamp": time_stamp,
-                    },
-                )
+def split_shards(channel_ids: list[str], shard_size: int) -> list[list[str]]:
+    return [channel_ids[i:i + shard_size] for i in range(0, len(channel_ids), shard_size)]
 
-                # マスター
-                register_schedule_to_db(
-                    table_name=notify_controller_table_name,
-                    item={
-                        "video_id": video_id,
-                        "version": "master",
-                        "current_version": version,
-                        "time_stamp": time_stamp,
-                    },
-                )
 
-                logger.info(
-                    f"put event title={title} scheduled_start_time={scheduled_start_time}")
-    return 200
+def coordinate(
+    yt_api_key: str,
+    discovery_backend: str,
+    channel_cache_ttl_seconds: float,
+    schedule_master_table_name: str,
+    notify_controller_table_name: str,
+    topic_arn: str,
+    live_tracking: bool,
+    live_tracking_interval_minutes: float,
+    track_horizon_hours: float,
+    remaining_quota_units: int,
+    shard_size: int,
+    shard_queue_url: str,
+) -> int:
+    """チャンネル一覧をシャードに分割し, SQS 経由でワーカーに配る関数 (コーディネーター).
 
+    quota の見積もりはチャンネル全体に対してここで1回だけ行い, 決めた検出方法をワーカーに渡す \n
+    登録済みの動画の確認 (refresh_known_videos) はシャードに分けず, ここで1回だけ行う
 
-def handler(event, context):
-    return service(
-        yt_api_key=get_value_from_ssm(os.environ["YOUTUBE_API_KEY"]),
-        timedelta_days=os.environ["TIMEDELTA_DAYS"],
-        schedule_master_table_name=os.environ["SCHEDULE_MASTER_TABLE"],
-        notify_controller_table_name=os.environ["NOTIFY_CONTROLLER_TABLE"],
-        topic_arn=os.environ["SNS_TOPICK_ARN"],
+    Args:
+        yt_api_key (str): YouTube API Key
+        discovery_backend (str): 設定されている検出方法
+        channel_cache_ttl_seconds (float): チャンネル一覧のキャッシュの有効期間 (秒)
+        schedule_master_table_name (str): スケジュールマスターテーブル名
+        notify_controller_table_name (str): 通知管理テーブル名
+        topic_arn (str): 通知先のSNSトピックのARN
+        live_tracking (bool): 配信状態を追跡する場合 True
+        live_tracking_interval_minutes (float): 配信状態を追跡する間隔 (分)
+        track_horizon_hours (float): 予定開始時刻を過ぎてから確認を続ける時間
+        remaining_quota_units (int): 本日の残りの quota
+        shard_size (int): 1シャードあたりのチャンネル数
+        shard_queue_url (str): シャードを送る SQS キューの URL
+
+    Returns:
+        int: ステータスコード
+    """
+    logger.debug("Coordinate Start!")
+
+    channels = get_target_channels_from_dyn(schedule_master_table_name, float(channel_cache_ttl_seconds))
+    discovery_backend, channels = plan_channels(
+        channels,
+        discovery_backend,
+        remaining_quota_units,
+        notify_controller_table_name,
+        live_tracking,
+        live_tracking_interval_minutes,
     )
+    shards = split_shards([channel["channel_id"] for channel in channels], int(shard_size))
+    send_shards(
+        shard_queue_url,
+        [{"channel_ids": channel_ids, "discovery_backend": discovery_backend} for channel_ids in shards],
+    )
+    logger.info(f"send shards: channels={len(channels)} shards={len(shards)} backend={discovery_backend}")
+    return refresh_known_videos(
+        yt_api_key=yt_api_key,
+        notify_controller_table_name=notify_controller_table_name,
+        topic_arn=topic_arn,
+        track_horizon_hours=track_horizon_hours,
+        live_tracking=live_tracking,
+    )
+
+
+def process_shard(
+    yt_api_key: str,
+    shard: dict,
+    timedelta_days: float,
+    cursor_overlap_minutes: float,
+    max_workers: int,
+    channel_cache_ttl_seconds: float,
+    schedule_master_table_name: str,
+    notify_controller_table_name: str,
+    topic_arn: str,
+    shard_queue_url: str,
+    is_near_deadline: Callable[[], bool],
+) -> int:
+    """シャード1つ分のチャンネルを処理する関数 (ワーカー).
+
+    処理しきれなかったチャンネルは新しいシャードとしてキューに戻す
+
+    Args:
+        yt_api_key (str): YouTube API Key
+        shard (dict): channel_ids, discovery_backend
+        timedelta_days (float): 取得済み位置がない場合に何日前までの動画を対象とするか
+        cursor_overlap_minutes (float): 取得済み位置から遡る分数
+        max_workers (int): 並列にポーリングするスレッド数
+        channel_cache_ttl_seconds (float): チャンネル一覧のキャッシュの有効期間 (秒)
+        schedule_master_table_name (str): スケジュールマスターテーブル名
+        notify_controller_table_name (str): 通知管理テーブル名
+        topic_arn (str): 通知先のSNSトピックのARN
+        shard_queue_url (str): シャードを送る SQS キューの URL
+        is_near_deadline (Callable[[], bool]): 実行時間の上限が近い場合 True を返す関数
+
+    Returns:
+        int: ステータスコード
+    """
+    channel_ids = set(shard["channel_ids"])
+    channels = [
+        channel
+        for channel in get_target_channels_from_dyn(schedule_master_table_name, float(channel_cache_ttl_seconds))
+        if channel["channel_id"] in channel_ids
+    ]
+    status_code, pending_channel_ids, _ = process_channels(
+        yt_api_key=yt_api_key,
+        channels=channels,
+        timedelta_days=timedelta_days,
+        cursor_overlap_minutes=cursor_overlap_minutes,
+        discovery_backend=shard["discovery_backend"],
+        max_workers=max_workers,
+        schedule_master_table_name=schedule_master_table_name,
+        notify_controller_table_name=notify_controller_table_name,
+        topic_arn=topic_arn,
+        is_near_deadline=is_near_deadline,
+    )
+    if pending_channel_ids:
+        send_shards(shard_queue_url, [{**shard, "channel_ids": pending_channel_ids}])
+        return INCOMPLETE_STATUS_CODE
+    return status_code
+
+
+def handle_shards(event: dict, context, yt_api_key: str) -> dict:
+    """SQS から受け取ったシャードを処理し, 失敗したメッセージのみを再試行させる関数.
+
+    チャンネル単位の失敗は取得済み位置を進めないことで次の定期実行に再処理されるため, \n
+    ここでは想定外の例外で処理を終えられなかったメッセージのみを batchItemFailures として返す
+
+    Args:
+        event (dict): SQS のイベント
+        context (LambdaContext): Lambda のコンテキスト
+        yt_api_key (str): YouTube API Key
+
+    Returns:
+        dict: batchItemFailures
+    """
+    deadline_margin_seconds = float(os.environ["DEADLINE_MARGIN_SECONDS"])
+    batch_item_failures = []
+    for record in event["Records"]:
+        try:
+            process_shard(
+                yt_api_key=yt_api_key,
+                shard=json.loads(record["body"]),
+                timedelta_days=os.environ["TIMEDELTA_DAYS"],
+                cursor_overlap_minutes=os.environ["CURSOR_OVERLAP_MINUTES"],
+                max_workers=os.environ["MAX_WORKERS"],
+                channel_cache_ttl_seconds=os.environ["CHANNEL_CACHE_TTL_SECONDS"],
+                schedule_master_table_name=os.environ["SCHEDULE_MASTER_TABLE"],
+                notify_controller_table_name=os.environ["NOTIFY_CONTROLLER_TABLE"],
+                topic_arn=os.environ["SNS_TOPICK_ARN"],
+                shard_queue_url=os.environ["SHARD_QUEUE_URL"],
+                is_near_deadline=lambda: context.get_remaining_time_in_millis() < deadline_margin_seconds * 1000,
+            )
+        except Exception:
+            logger.exception(f"failed to process shard: {record['messageId']}")
+            batch_item_failures.append({"itemIdentifier": record["messageId"]})
+    return {"batchItemFailures": batch_item_failures}
+
+
+def handler(event, context):
+    ssm_keys = [os.environ["YOUTUBE_API_KEY"]]
+    schedule_master_table_name = os.environ["SCHEDULE_MASTER_TABLE"]
+
+    # パラメータストアにはカンマ区切りで複数の API Key を格納できる (先頭から順に使用する)
+    yt_api_keys = [
+        key.strip()
+        for key in get_values_from_ssm(ssm_keys, float(os.environ["SSM_CACHE_TTL_SECONDS"]))[ssm_keys[0]].split(",")
+        if key.strip()
+    ]
+    quota_day = get_quota_day()
+    used_quota_units, exhausted_key_ids = get_daily_usage(schedule_master_table_name, quota_day)
+    remaining_quota_units = int(os.environ["QUOTA_DAILY_BUDGET"]) * len(yt_api_keys) - used_quota_units
+    yt_api_key = set_key_pool(yt_api_keys, exhausted_key_ids)
+    if yt_api_key is None:
+        logger.error(f"all API keys are exhausted: {quota_day}")
+        clear_ssm_cache(ssm_keys)
+        if "Records" in event:
+            return {"batchItemFailures": [{"itemIdentifier": record["messageId"]} for record in event["Records"]]}
+        return 400
+
+    try:
+        if "Records" in event:
+            # シャードのワーカーとして SQS から起動された場合
+            return handle_shards(event, context, yt_api_key)
+        if event.get("mode") == TRACK_MODE:
+            status_code = track_live(
+                yt_api_key=yt_api_key,
+                track_horizon_hours=os.environ["TRACK_HORIZON_HOURS"],
+                notify_controller_table_name=os.environ["NOTIFY_CONTROLLER_TABLE"],
+                topic_arn=os.environ["SNS_TOPICK_ARN"],
+                notify_lambda_arn=os.environ["NOTIFY_SCHEDULE_SERVICE"],
+            )
+        elif os.environ["SHARDING"].lower() == "true":
+            status_code = coordinate(
+                yt_api_key=yt_api_key,
+                discovery_backend=os.environ["DISCOVERY_BACKEND"],
+                channel_cache_ttl_seconds=os.environ["CHANNEL_CACHE_TTL_SECONDS"],
+                schedule_master_table_name=schedule_master_table_name,
+                notify_controller_table_name=os.environ["NOTIFY_CONTROLLER_TABLE"],
+                topic_arn=os.environ["SNS_TOPICK_ARN"],
+                live_tracking=os.environ["LIVE_TRACKING"].lower() == "true",
+                live_tracking_interval_minutes=os.environ["LIVE_TRACKING_INTERVAL_MINUTES"],
+                track_horizon_hours=os.environ["TRACK_HORIZON_HOURS"],
+                remaining_quota_units=remaining_quota_units,
+                shard_size=os.environ["SHARD_SIZE"],
+                shard_queue_url=os.environ["SHARD_QUEUE_URL"],
+            )
+        else:
+            status_code = service(
+                yt_api_key=yt_api_key,
+                timedelta_days=os.environ["TIMEDELTA_DAYS"],
+                cursor_overlap_minutes=os.environ["CURSOR_OVERLAP_MINUTES"],
+                discovery_backend=os.environ["DISCOVERY_BACKEND"],
+                max_workers=os.environ["MAX_WORKERS"],
+                channel_cache_ttl_seconds=os.environ["CHANNEL_CACHE_TTL_SECONDS"],
+                schedule_master_table_name=schedule_master_table_name,
+                notify_controller_table_name=os.environ["NOTIFY_CONTROLLER_TABLE"],
+                topic_arn=os.environ["SNS_TOPICK_ARN"],
+                live_tracking=os.environ["LIVE_TRACKING"].lower() == "true",
+                live_tracking_interval_minutes=os.environ["LIVE_TRACKING_INTERVAL_MINUTES"],
+                remaining_quota_units=remaining_quota_units,
+                get_remaining_time_in_millis=context.get_remaining_time_in_millis,
+                deadline_margin_seconds=os.environ["DEADLINE_MARGIN_SECONDS"],
+                track_horizon_hours=os.environ["TRACK_HORIZON_HOURS"],
+                resume_only=event.get("mode") == RESUME_MODE,
+            )
+    finally:
+        flush_usage(schedule_master_table_name, quota_day)
+
+    # 処理しきれなかったチャンネルは, 自身を呼び出して続きから処理する
+    # 連鎖の上限に達した場合は次の定期実行に引き継ぐ
+    chain = int(event.get("chain", 0))
+    if status_code == INCOMPLETE_STATUS_CODE and chain < int(os.environ["MAX_RESUME_CHAIN"]):
+        invoke_resume(context.function_name, chain + 1)
+    elif has_key_error() or get_active_key() is None:
+        # API Key が無効になった (または使い切った) 場合は更新されている可能性があるため, 次回の実行では取得し直す
+        # 通信エラーや 5xx 等の一時的な失敗ではキャッシュを使い続ける
+        clear_ssm_cache(ssm_keys)
+    return status_code
@@ -0,0 +1,349 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from aws_clients import get_resource
+
+
+# エンドポイントごとの1リクエストあたりの消費 quota
+# https://developers.google.com/youtube/v3/determine_quota_cost
+QUOTA_COSTS = {
+    "search": 100,
+    "videos": 1,
+    "channels": 1,
+    "playlistItems": 1,
+}
+
+# videos.list / channels.list の id パラメタに一度に指定できる最大数
+VIDEOS_MAX_IDS = 50
+
+# 1日の quota は太平洋時間の0時にリセットされる
+QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")
+
+# quota を使い切った場合のエラーの reason
+QUOTA_EXCEEDED_REASONS = {"quotaExceeded", "dailyLimitExceeded"}
+# API Key が無効/失効/許可されていない場合のエラーの reason (errors と details の両方を確認する)
+KEY_ERROR_REASONS = {"keyInvalid", "keyExpired", "forbidden", "API_KEY_INVALID", "API_KEY_EXPIRED"}
+
+# CloudWatch の埋め込みメトリクスフォーマット (EMF) で出力する名前空間
+METRICS_NAMESPACE = "NotifyDeliveryScheduleApp"
+
+# 検出方法ごとの1チャンネルあたりの見積もり quota (1ページ分 + videos.list)
+# playlist は uploads_playlist_id が登録済みのチャンネルの値. 未登録のチャンネルは search で見積もる (estimate_discovery_units)
+DISCOVERY_COSTS = {
+    "search": QUOTA_COSTS["search"] + QUOTA_COSTS["videos"],
+    "playlist": QUOTA_COSTS["playlistItems"] + QUOTA_COSTS["videos"],
+    "feed": QUOTA_COSTS["videos"],
+}
+# quota が足りない場合に切り替える順番 (消費の多い順)
+DISCOVERY_DOWNGRADES = ["search", "playlist", "feed"]
+
+# 1回の実行で消費した quota と, API Key のプール (ウォームスタート時は実行ごとに初期化する)
+_usage: dict[str, dict[str, int]] = {}
+_keys: list[str] = []
+_exhausted: set[str] = set()
+_key_errors: set[str] = set()
+_lock = threading.Lock()
+
+
+def calc_key_id(key: str) -> str:
+    """API Key をログや DynamoDB に残せる識別子に変換する関数.
+
+    Args:
+        key (str): API Key
+
+    Returns:
+        str: 識別子
+    """
+    return hashlib.md5(key.encode()).hexdigest()[:8]
+
+
+def set_key_pool(keys: list[str], exhausted_key_ids: set[str]) -> str | None:
+    """API Key のプールを設定し, 使用する API Key を返す関数.
+
+    Args:
+        keys (list[str]): API Key のリスト (優先する順)
+        exhausted_key_ids (set[str]): 本日 quota を使い切った API Key の識別子
+
+    Returns:
+        str | None: 使用する API Key. すべて使い切っている場合は None
+    """
+    with _lock:
+        _keys[:] = keys
+        _exhausted.clear()
+        _exhausted.update(key for key in keys if calc_key_id(key) in exhausted_key_ids)
+        _key_errors.clear()
+        _usage.clear()
+    return get_active_key()
+
+
+def get_active_key() -> str | None:
+    with _lock:
+        return next((key for key in _keys if key not in _exhausted), None)
+
+
+def resolve_key(key: str) -> str:
+    """使い切った API Key が指定された場合, プール内の次の API Key に差し替える関数.
+
+    Args:
+        key (str): 呼び出し側が指定した API Key
+
+    Returns:
+        str: 実際に使用する API Key
+    """
+    with _lock:
+        if key not in _exhausted:
+            return key
+    return get_active_key() or key
+
+
+def is_quota_exceeded(res: dict) -> bool:
+    errors = res.get("error", {}).get("errors", [])
+    return any(error.get("reason") in QUOTA_EXCEEDED_REASONS for error in errors)
+
+
+def is_key_error(res: dict) -> bool:
+    error = res.get("error", {})
+    reasons = [item.get("reason") for item in error.get("errors", []) + error.get("details", [])]
+    return any(reason in KEY_ERROR_REASONS for reason in reasons)
+
+
+def record_key_error(key: str) -> None:
+    with _lock:
+        _key_errors.add(calc_key_id(key))
+
+
+def has_key_error() -> bool:
+    """この実行で API Key が無効等のエラーを受けたか返す関数.
+
+    パラメータストアの API Key が更新されている可能性があるため, 呼び出し側はキャッシュを破棄する
+
+    Returns:
+        bool: 受けた場合 True
+    """
+    with _lock:
+        return bool(_key_errors)
+
+
+def mark_exhausted(key: str) -> str | None:
+    """API Key を使い切ったものとして記録し, 次に使用する API Key を返す関数.
+
+    Args:
+        key (str): 使い切った API Key
+
+    Returns:
+        str | None: 次に使用する API Key. すべて使い切っている場合は None
+    """
+    with _lock:
+        _exhausted.add(key)
+    return get_active_key()
+
+
+def record_usage(endpoint: str, key: str) -> None:
+    """1リクエスト分の quota の消費を記録する関数.
+
+    Args:
+        endpoint (str): エンドポイント名 (例: search)
+        key (str): 使用した API Key
+    """
+    with _lock:
+        usage = _usage.setdefault(calc_key_id(key), {})
+        usage[endpoint] = usage.get(endpoint, 0) + QUOTA_COSTS.get(endpoint, 0)
+
+
+def get_usage() -> dict[str, dict[str, int]]:
+    """この実行で消費した quota を返す関数.
+
+    Returns:
+        dict[str, dict[str, int]]: API Key の識別子 -> エンドポイント名 -> 消費 quota
+    """
+    with _lock:
+        return {key_id: dict(usage) for key_id, usage in _usage.items()}
+
+
+def get_quota_day(now: datetime | None = None) -> str:
+    return (now or datetime.now(QUOTA_TIMEZONE)).astimezone(QUOTA_TIMEZONE).strftime("%Y-%m-%d")
+
+
+def calc_runs_left_today(now: datetime | None = None) -> int:
+    """quota がリセットされるまでの残りの定期実行回数 (1時間毎) を返す関数.
+
+    Args:
+        now (datetime | None): 現在日時
+
+    Returns:
+        int: 残りの実行回数 (今回を含む)
+    """
+    now = (now or datetime.now(QUOTA_TIMEZONE)).astimezone(QUOTA_TIMEZONE)
+    reset_at = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return max(1, math.ceil((reset_at - now).total_seconds() / 3600))
+
+
+def build_quota_key(day: str) -> dict:
+    return {"pkey": "meta", "channel_id": f"quota_{day}"}
+
+
+def get_daily_usage(table_name: str, day: str) -> tuple[int, set[str]]:
+    """本日の消費 quota と, 使い切った API Key の識別子を取得する関数.
+
+    Args:
+        table_name (str): スケジュールマスターテーブル名
+        day (str): 日付 (太平洋時間)
+
+    Returns:
+        tuple[int, set[str]]: (全 API Key の合計消費 quota, 使い切った API Key の識別子)
+    """
+    table = get_resource("dynamodb").Table(table_name)
+    item = table.get_item(Key=build_quota_key(day)).get("Item") or {}
+    return int(item.get("units", 0)), set(item.get("exhausted", set()))
+
+
+def flush_usage(table_name: str, day: str) -> None:
+    """この実行で消費した quota を日毎の集計に加算し, メトリクスとして出力する関数.
+
+    Args:
+        table_name (str): スケジュールマスターテーブル名
+        day (str): 日付 (太平洋時間)
+    """
+    usage = get_usage()
+    with _lock:
+        exhausted_key_ids = {calc_key_id(key) for key in _exhausted}
+    units = sum(sum(endpoints.values()) for endpoints in usage.values())
+
+    update_expression = "ADD units :units"
+    values = {":units": units}
+    if exhausted_key_ids:
+        update_expression += ", exhausted :exhausted"
+        values[":exhausted"] = exhausted_key_ids
+    table = get_resource("dynamodb").Table(table_name)
+    table.update_item(
+        Key=build_quota_key(day),
+        UpdateExpression=update_expression,
+        ExpressionAttributeValues=values,
+    )
+
+    endpoints = {}
+    for key_usage in usage.values():
+        for endpoint, endpoint_units in key_usage.items():
+            endpoints[endpoint] = endpoints.get(endpoint, 0) + endpoint_units
+    for endpoint, endpoint_units in endpoints.items():
+        emit_metric("QuotaUnits", endpoint_units, {"Endpoint": endpoint})
+    emit_metric("QuotaUnitsPerRun", units, {})
+    emit_metric("ExhaustedApiKeys", len(exhausted_key_ids), {})
+
+
+def emit_metric(name: str, value: float, dimensions: dict[str, str]) -> None:
+    """CloudWatch の埋め込みメトリクスフォーマット (EMF) でメトリクスをログに出力する関数.
+
+    PutMetricData を呼ばずに, ログから CloudWatch メトリクスが作成される
+
+    Args:
+        name (str): メトリクス名
+        value (float): 値
+        dimensions (dict[str, str]): ディメンション
+    """
+    print(json.dumps({
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": METRICS_NAMESPACE,
+                "Dimensions": [list(dimensions)],
+                "Metrics": [{"Name": name, "Unit": "Count"}],
+            }],
+        },
+        name: value,
+        **dimensions,
+    }))
+
+
+def estimate_discovery_units(channels: list[dict], discovery_backend: str) -> int:
+    """チャンネルの検出に消費する quota を見積もる関数.
+
+    playlist の場合, uploads_playlist_id が未登録のチャンネルは channels.list (50件ずつ) で解決してから検出し, \n
+    解決できなければ search にフォールバックするため, search の quota と channels.list の quota で見積もる
+
+    Args:
+        channels (list[dict]): 対象チャンネル
+        discovery_backend (str): 検出方法
+
+    Returns:
+        int: 見積もり quota
+    """
+    if discovery_backend != "playlist":
+        return DISCOVERY_COSTS[discovery_backend] * len(channels)
+    unresolved = sum(1 for channel in channels if not channel.get("uploads_playlist_id"))
+    return (
+        DISCOVERY_COSTS["playlist"] * (len(channels) - unresolved)
+        + DISCOVERY_COSTS["search"] * unresolved
+        + QUOTA_COSTS["channels"] * math.ceil(unresolved / VIDEOS_MAX_IDS)
+    )
+
+
+def estimate_reserved_units(tracking_count: int, live_tracking: bool, live_tracking_interval_minutes: float) -> int:
+    """定期実行1回あたりに, チャンネルの検出以外で消費する quota を見積もる関数.
+
+    登録済みの動画の確認 (refresh_known_videos) は定期実行ごとに1回, \n
+    配信状態の追跡 (track_live) は有効な場合に1時間あたり 60 / live_tracking_interval_minutes 回, \n
+    それぞれ videos.list を50件ずつ呼び出す
+
+    Args:
+        tracking_count (int): 通知管理テーブルの tracking パーティションの動画数
+        live_tracking (bool): 配信状態を追跡する場合 True
+        live_tracking_interval_minutes (float): 配信状態を追跡する間隔 (分)
+
+    Returns:
+        int: 見積もり quota
+    """
+    units_per_pass = QUOTA_COSTS["videos"] * math.ceil(tracking_count / VIDEOS_MAX_IDS)
+    passes = 1
+    if live_tracking:
+        passes += math.ceil(60 / max(1.0, float(live_tracking_interval_minutes)))
+    return units_per_pass * passes
+
+
+def plan_discovery(
+    channels: list[dict],
+    discovery_backend: str,
+    remaining_units: int,
+    runs_left: int,
+    reserved_units: int = 0,
+) -> tuple[str, list[dict]]:
+    """残りの quota から, 今回の実行で使用する検出方法と対象チャンネルを決める関数.
+
+    残りの quota を残りの実行回数で割り, 検出以外で消費する分 (reserved_units) を除いた分を今回の上限とし, \n
+    上限を超える見込みの場合は消費の少ない検出方法に切り替える \n
+    最も消費の少ない方法でも超える場合は, poll_priority の低いチャンネルから対象外にする
+
+    Args:
+        channels (list[dict]): 対象チャンネル
+        discovery_backend (str): 設定されている検出方法
+        remaining_units (int): 本日の残りの quota
+        runs_left (int): 本日の残りの実行回数
+        reserved_units (int): 検出以外で消費する見積もり quota (estimate_reserved_units)
+
+    Returns:
+        tuple[str, list[dict]]: (検出方法, 対象チャンネル)
+    """
+    allowance = max(0, max(0, remaining_units) // max(1, runs_left) - reserved_units)
+    backends = DISCOVERY_DOWNGRADES[DISCOVERY_DOWNGRADES.index(discovery_backend):]
+    for backend in backends:
+        if estimate_discovery_units(channels, backend) <= allowance:
+            return backend, channels
+
+    backend = backends[-1]
+    prioritized = sorted(channels, key=lambda channel: int(channel.get("poll_priority", 0)), reverse=True)
+    # 見積もりは対象を増やすほど大きくなるため, 上限に収まる最大のチャンネル数を二分探索で求める
+    low, high = 0, len(prioritized)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_discovery_units(prioritized[:middle], backend) <= allowance:
+            low = middle
+        else:
+            high = middle - 1
+    return backend, prioritized[:low]
@@ -1,53 +1,302 @@
 from __future__ import annotations
 
+from datetime import datetime, timedelta
 import json
-from datetime import date, timedelta
-import hashlib
+import time
 
-import boto3
-from boto3.dynamodb.conditions import Key
+from aws_clients import get_client, get_resource
 
 
-def get_value_from_ssm(key: str = "YT_API_KEY") -> str:
-    client = boto3.client("ssm")
-    value = client.get_parameter(
-        Name=key,
-        WithDecryption=True
-    )
-    return value["Parameter"]["Value"]
+# スケジュールマスターのチャンネル一覧の変更を検知するためのカウンターアイテムのキー
+# チャンネルを追加/削除する処理は, このアイテムの version を加算すること
+CHANNELS_VERSION_KEY = {"pkey": "meta", "channel_id": "channels_version"}
+CHANNEL_PROJECTION = "channel_id, uploads_playlist_id, published_after_cursor, poll_priority"
+
+# 実行時間の上限に達して処理しきれなかったチャンネルを, 次の実行に引き継ぐためのアイテムのキー
+RESUME_CURSOR_KEY = {"pkey": "meta", "channel_id": "resume_cursor"}
+
+# SendMessageBatch で一度に送信できる最大数
+SQS_SEND_BATCH_MAX = 10
+
+# 通知した配信開始前の動画は, 通知管理テーブルのこのパーティションに video ID をソートキーとして登録する
+# 定期実行のたびに予定変更を確認し (refresh_known_videos), 配信状態の追跡 (track_live) にも使用する
+TRACKING_PARTITION = "tracking"
+
+# ウォームスタート時にチャンネル一覧を再利用するため, モジュールスコープで保持する
+_channels_cache = {"items": None, "version": None, "expires_at": 0.0}
+
+
+def calc_published_after_from_cursor(cursor: str, overlap_minutes: float = 60.0) -> str:
+    dt = datetime.strptime(cursor, "%Y-%m-%dT%H:%M:%SZ")
+    return (dt - timedelta(minutes=overlap_minutes)).strftime("%Y-%m-%dT%H:%M:%SZ")
 
 
-def calc_published_after_str(timedelta_days: float = 7.0) -> str:
-    return (date.today() - timedelta(days=timedelta_days)).strftime("%Y-%m-%dT%H:%M:%SZ")
+def query_channels_from_dyn(table_name: str, projection: str) -> list[dict]:
+    from boto3.dynamodb.conditions import Key
+
+    table = get_resource("dynamodb").Table(table_name)
+    kwargs = {
+        "KeyConditionExpression": Key("pkey").eq("youtube"),
+        "ProjectionExpression": projection,
+    }
+    items = []
+    while True:
+        res = table.query(**kwargs)
+        items.extend(res["Items"])
+        if "LastEvaluatedKey" not in res:
+            return items
+        kwargs["ExclusiveStartKey"] = res["LastEvaluatedKey"]
 
 
-    
 def get_target_channel_id_from_dyn(table_name: str) -> list[str]:
-    table = boto3.resource("dynamodb").Table(table_name)
-    res = table.query(KeyConditionExpression=Key("pkey").eq("youtube"))
-    return [item["channel_id"] for item in res["Items"]]
+    return [item["channel_id"] for item in query_channels_from_dyn(table_name, "channel_id")]
+
 
+def get_channels_version_from_dyn(table_name: str) -> int | None:
+    table = get_resource("dynamodb").Table(table_name)
+    item = table.get_item(Key=CHANNELS_VERSION_KEY, ProjectionExpression="version").get("Item")
+    return item["version"] if item else None
 
-def calc_version(title: str, scheduled_start_time: str) -> str:
-    return hashlib.md5(f"{title}-{scheduled_start_time}".encode()).hexdigest()
 
+def get_target_channels_from_dyn(table_name: str, ttl_seconds: float = 0.0) -> list[dict]:
+    """スケジュールマスターから対象チャンネルの一覧を取得する関数.
 
-def register_schedule_to_db(table_name: str, item: dict) -> None:
-    table = boto3.resource("dynamodb").Table(table_name)
-    table.put_item(Item=item)
+    取得結果はコンテナ内にキャッシュし, ttl_seconds の間は DynamoDB を参照しない \n
+    TTL 経過後はカウンターアイテムのみを読み, 変更がなければキャッシュを使い続ける \n
+    カウンターアイテムがない場合は TTL 経過ごとに全件を読み直す \n
+    返却するアイテムはキャッシュと同じオブジェクトのため, 更新した値はキャッシュにも反映される
 
+    Args:
+        table_name (str): スケジュールマスターテーブル名
+        ttl_seconds (float): キャッシュの有効期間 (秒)
 
-def same_as_current_version(table_name: str, video_id: str, version: str) -> bool:
-    table = boto3.resource("dynamodb").Table(table_name)
-    res = table.get_item(Key={"video_id":video_id, "version":"master"}).get("Item")
-    return bool(res and res["current_version"] == version)
+    Returns:
+        list[dict]: チャンネルごとのアイテム (channel_id, uploads_playlist_id, published_after_cursor, poll_priority)
+    """
+    now = time.monotonic()
+    if _channels_cache["items"] is not None and now < _channels_cache["expires_at"]:
+        return _channels_cache["items"]
 
+    version = get_channels_version_from_dyn(table_name)
+    if _channels_cache["items"] is None or version is None or version != _channels_cache["version"]:
+        _channels_cache["items"] = query_channels_from_dyn(table_name, CHANNEL_PROJECTION)
+        _channels_cache["version"] = version
+    _channels_cache["expires_at"] = now + ttl_seconds
+    return _channels_cache["items"]
 
-def publish_to_sns(topic_arn: str, item: dict, subject: str="youtube_schedule") -> None:
-    topic = boto3.resource('sns').Topic(topic_arn)
-    topic.publish(
-        Subject=subject,
-        Message=json.dumps(item, ensure_ascii=False),
-        MessageStructure="json",
+
+def register_uploads_playlist_id(table_name: str, channel_id: str, uploads_playlist_id: str) -> None:
+    table = get_resource("dynamodb").Table(table_name)
+    table.update_item(
+        Key={"pkey": "youtube", "channel_id": channel_id},
+        UpdateExpression="SET uploads_playlist_id = :uploads_playlist_id",
+        ExpressionAttributeValues={":uploads_playlist_id": uploads_playlist_id},
     )
 
+
+def update_published_after_cursor(table_name: str, channel_id: str, cursor: str) -> bool:
+    """チャンネルごとの取得済み位置 (最新の publishedAt) を進める関数.
+
+    現在値より新しい場合のみ更新するため, 並行して実行されても巻き戻らない
+
+    Args:
+        table_name (str): スケジュールマスターテーブル名
+        channel_id (str): channel ID
+        cursor (str): 取得済みの最新の publishedAt (%Y-%m-%dT%H:%M:%SZ)
+
+    Returns:
+        bool: 更新した場合 True
+    """
+    table = get_resource("dynamodb").Table(table_name)
+    try:
+        table.update_item(
+            Key={"pkey": "youtube", "channel_id": channel_id},
+            UpdateExpression="SET published_after_cursor = :cursor",
+            ConditionExpression="attribute_not_exists(published_after_cursor) OR published_after_cursor < :cursor",
+            ExpressionAttributeValues={":cursor": cursor},
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+
+def build_tracking_item(video_id: str, channel_id: str, version: str, scheduled_start_time: str) -> dict:
+    """通知管理テーブルに登録する, 配信開始前の動画のアイテムを作成する関数.
+
+    Args:
+        video_id (str): video ID
+        channel_id (str): channel ID
+        version (str): 現在のバージョン
+        scheduled_start_time (str): 予定開始時刻
+
+    Returns:
+        dict: tracking パーティションのアイテム
+    """
+    return {
+        "video_id": TRACKING_PARTITION,
+        "version": video_id,
+        "channel_id": channel_id,
+        "schedule_version": version,
+        "scheduled_start_time": scheduled_start_time,
+    }
+
+
+def register_tracking_video(
+    table_name: str,
+    video_id: str,
+    channel_id: str,
+    version: str,
+    scheduled_start_time: str,
+) -> None:
+    """配信開始前の動画を登録する関数.
+
+    同じ動画が登録済みの場合は予定開始時刻とバージョンを上書きする
+
+    Args:
+        table_name (str): 通知管理テーブル名
+        video_id (str): video ID
+        channel_id (str): channel ID
+        version (str): 現在のバージョン
+        scheduled_start_time (str): 予定開始時刻
+    """
+    table = get_resource("dynamodb").Table(table_name)
+    table.put_item(Item=build_tracking_item(video_id, channel_id, version, scheduled_start_time))
+
+
+def query_tracking_videos(table_name: str) -> list[dict]:
+    """登録されている配信開始前の動画を全件取得する関数.
+
+    Args:
+        table_name (str): 通知管理テーブル名
+
+    Returns:
+        list[dict]: video_id, channel_id, schedule_version, scheduled_start_time のリスト
+    """
+    from boto3.dynamodb.conditions import Key
+
+    table = get_resource("dynamodb").Table(table_name)
+    kwargs = {"KeyConditionExpression": Key("video_id").eq(TRACKING_PARTITION)}
+    items = []
+    while True:
+        res = table.query(**kwargs)
+        items.extend({**item, "video_id": item["version"]} for item in res["Items"])
+        if "LastEvaluatedKey" not in res:
+            return items
+        kwargs["ExclusiveStartKey"] = res["LastEvaluatedKey"]
+
+
+def count_tracking_videos(table_name: str) -> int:
+    """登録されている配信開始前の動画の数を取得する関数.
+
+    Args:
+        table_name (str): 通知管理テーブル名
+
+    Returns:
+        int: 動画の数
+    """
+    from boto3.dynamodb.conditions import Key
+
+    table = get_resource("dynamodb").Table(table_name)
+    kwargs = {"KeyConditionExpression": Key("video_id").eq(TRACKING_PARTITION), "Select": "COUNT"}
+    count = 0
+    while True:
+        res = table.query(**kwargs)
+        count += res["Count"]
+        if "LastEvaluatedKey" not in res:
+            return count
+        kwargs["ExclusiveStartKey"] = res["LastEvaluatedKey"]
+
+
+def delete_tracking_video(table_name: str, video_id: str, scheduled_start_time: str) -> bool:
+    """確認を終えた動画を削除する関数.
+
+    予定開始時刻が一致する場合のみ削除するため, 並行して実行されても削除に成功するのはいずれか一方のみとなる
+
+    Args:
+        table_name (str): 通知管理テーブル名
+        video_id (str): video ID
+        scheduled_start_time (str): 登録されている予定開始時刻
+
+    Returns:
+        bool: 削除した場合 True
+    """
+    table = get_resource("dynamodb").Table(table_name)
+    try:
+        table.delete_item(
+            Key={"video_id": TRACKING_PARTITION, "version": video_id},
+            ConditionExpression="scheduled_start_time = :scheduled_start_time",
+            ExpressionAttributeValues={":scheduled_start_time": scheduled_start_time},
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+
+def get_resume_channel_ids(table_name: str) -> list[str]:
+    """前回の実行で処理しきれなかったチャンネルの一覧を取得する関数.
+
+    Args:
+        table_name (str): スケジュールマスターテーブル名
+
+    Returns:
+        list[str]: channel ID のリスト. ない場合は空のリスト
+    """
+    table = get_resource("dynamodb").Table(table_name)
+    item = table.get_item(Key=RESUME_CURSOR_KEY, ProjectionExpression="channel_ids").get("Item")
+    return list(item["channel_ids"]) if item else []
+
+
+def save_resume_channel_ids(table_name: str, channel_ids: list[str]) -> None:
+    """処理しきれなかったチャンネルの一覧を保存する関数.
+
+    空のリストの場合は削除する
+
+    Args:
+        table_name (str): スケジュールマスターテーブル名
+        channel_ids (list[str]): channel ID のリスト
+    """
+    table = get_resource("dynamodb").Table(table_name)
+    if channel_ids:
+        table.put_item(Item={**RESUME_CURSOR_KEY, "channel_ids": channel_ids})
+    else:
+        table.delete_item(Key=RESUME_CURSOR_KEY)
+
+
+def invoke_resume(function_name: str, chain: int) -> None:
+    """処理しきれなかったチャンネルを続きから処理するため, 自身を非同期で呼び出す関数.
+
+    Args:
+        function_name (str): 自身の関数名
+        chain (int): 何回目の連鎖呼び出しか
+    """
+    client = get_client("lambda")
+    client.invoke(
+        FunctionName=function_name,
+        InvocationType="Event",
+        Payload=json.dumps({"mode": "resume", "chain": chain}).encode(),
+    )
+
+
+def send_shards(queue_url: str, shards: list[dict]) -> None:
+    """シャードを SQS に送信する関数.
+
+    SendMessageBatch で10件ずつ送信し, 失敗したエントリーのみ1回再送する
+
+    Args:
+        queue_url (str): SQS キューの URL
+        shards (list[dict]): シャード (channel_ids, discovery_backend)
+    """
+    client = get_client("sqs")
+    for i in range(0, len(shards), SQS_SEND_BATCH_MAX):
+        entries = [
+            {"Id": str(j), "MessageBody": json.dumps(shard)}
+            for j, shard in enumerate(shards[i:i + SQS_SEND_BATCH_MAX])
+        ]
+        for _ in range(2):
+            res = client.send_message_batch(QueueUrl=queue_url, Entries=entries)
+            failed_ids = {entry["Id"] for entry in res.get("Failed", [])}
+            entries = [entry for entry in entries if entry["Id"] in failed_ids]
+            if not entries:
+                break
+        else:
+            raise RuntimeError(f"failed to send shards: {res['Failed']}")
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import threading
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # 型注釈のみで参照する (実行時は _get_session で読み込む)
+    import boto3
+    import botocore.config
+
+
+# 全クライアント共通の設定 (botocore.config.Config の引数)
+# 並列に呼び出す場合を考慮し, コネクションプールは既定 (10) より大きくしておく
+CLIENT_CONFIG = {
+    "max_pool_connections": 16,
+    "retries": {
+        "max_attempts": 5,
+        "mode": "standard",
+    },
+}
+
+# ウォームスタート時に再利用するため, モジュールスコープで保持する
+_session: boto3.session.Session | None = None
+_config: botocore.config.Config | None = None
+_clients: dict = {}
+_resources: dict = {}
+_lock = threading.Lock()
+
+
+def _get_session() -> boto3.session.Session:
+    # boto3 はコールドスタート時間を抑えるため, 初めてクライアントを生成する時点で読み込む
+    global _session, _config
+    if _session is None:
+        import boto3
+        from botocore.config import Config
+        _config = Config(**CLIENT_CONFIG)
+        _session = boto3.session.Session()
+    return _session
+
+
+def get_client(service_name: str):
+    """boto3 のクライアントを返す関数.
+
+    サービスごとに初回呼び出し時にのみ生成し, 以降は同一コンテナ内で使い回す
+
+    Args:
+        service_name (str): AWS サービス名 (例: dynamodb)
+
+    Returns:
+        botocore.client.BaseClient: クライアント
+    """
+    with _lock:
+        if service_name not in _clients:
+            _clients[service_name] = _get_session().client(service_name, config=_config)
+        return _clients[service_name]
+
+
+def get_resource(service_name: str):
+    """boto3 のリソースを返す関数.
+
+    サービスごとに初回呼び出し時にのみ生成し, 以降は同一コンテナ内で使い回す \n
+    ※ リソースはスレッドセーフではないため, 複数スレッドから使用しないこと
+
+    Args:
+        service_name (str): AWS サービス名 (例: dynamodb)
+
+    Returns:
+        boto3.resources.base.ServiceResource: リソース
+    """
+    with _lock:
+        if service_name not in _resources:
+            _resources[service_name] = _get_session().resource(service_name, config=_config)
+        return _resources[service_name]
+
+
+def set_client(service_name: str, client) -> None:
+    """クライアントを差し替える関数 (テストでスタブを使う場合など).
+
+    Args:
+        service_name (str): AWS サービス名
+        client (botocore.client.BaseClient): 差し替えるクライアント
+    """
+    with _lock:
+        _clients[service_name] = client
+
+
+def set_resource(service_name: str, resource) -> None:
+    """リソースを差し替える関数 (テストでスタブを使う場合など).
+
+    Args:
+        service_name (str): AWS サービス名
+        resource (boto3.resources.base.ServiceResource): 差し替えるリソース
+    """
+    with _lock:
+        _resources[service_name] = resource
+
+
+def clear() -> None:
+    """保持しているクライアント/リソースを破棄する関数."""
+    with _lock:
+        _clients.clear()
+        _resources.clear()
@@ -0,0 +1,457 @@
+from __future__ import annotations
+
+import json
+from datetime import date, datetime, timedelta, timezone
+import hashlib
+import time
+
+from aws_clients import get_client, get_resource
+
+
+# GetParameters で一度に指定できる最大数
+SSM_GET_PARAMETERS_MAX_NAMES = 10
+
+# ウォームスタート時に再利用するため, モジュールスコープで保持する (パラメータ名 -> (値, 有効期限))
+_ssm_cache: dict[str, tuple[str, float]] = {}
+
+# BatchGetItem で一度に指定できる最大キー数
+BATCH_GET_MAX_KEYS = 100
+BATCH_GET_MAX_ATTEMPTS = 5
+BATCH_GET_BACKOFF_SECONDS = 0.1
+
+# PublishBatch で一度に送信できる最大件数
+SNS_PUBLISH_BATCH_MAX = 10
+
+# 通知する権利 (claim_version) の有効期間. Lambda の実行時間の上限以上とし,
+# 権利を取得した実行が通知を終える前に, 他の実行が同じバージョンを通知し直さないようにする
+PUBLISH_LEASE_SECONDS = 300
+
+
+def get_value_from_ssm(key: str = "YT_API_KEY") -> str:
+    client = get_client("ssm")
+    value = client.get_parameter(
+        Name=key,
+        WithDecryption=True
+    )
+    return value["Parameter"]["Value"]
+
+
+def get_values_from_ssm(keys: list[str], ttl_seconds: float = 0.0, force_refresh: bool = False) -> dict[str, str]:
+    """パラメータストアから複数の値をまとめて取得する関数.
+
+    GetParameters で10件ずつ復号して取得し, コンテナ内に ttl_seconds の間キャッシュする \n
+    認証エラー等でキーが更新された可能性がある場合は force_refresh=True で取得し直す
+
+    Args:
+        keys (list[str]): パラメータ名のリスト
+        ttl_seconds (float): キャッシュの有効期間 (秒)
+        force_refresh (bool): キャッシュを使わずに取得し直す場合 True
+
+    Returns:
+        dict[str, str]: パラメータ名 -> 値
+    """
+    now = time.monotonic()
+    expired = [key for key in dict.fromkeys(keys) if force_refresh or _ssm_cache.get(key, ("", 0.0))[1] <= now]
+    if expired:
+        client = get_client("ssm")
+        for i in range(0, len(expired), SSM_GET_PARAMETERS_MAX_NAMES):
+            res = client.get_parameters(Names=expired[i:i + SSM_GET_PARAMETERS_MAX_NAMES], WithDecryption=True)
+            if res.get("InvalidParameters"):
+                raise ValueError(f"parameter not found: {res['InvalidParameters']}")
+            for parameter in res["Parameters"]:
+                _ssm_cache[parameter["Name"]] = (parameter["Value"], now + ttl_seconds)
+    return {key: _ssm_cache[key][0] for key in keys}
+
+
+def clear_ssm_cache(keys: list[str]) -> None:
+    for key in keys:
+        _ssm_cache.pop(key, None)
+
+
+def calc_published_after_str(timedelta_days: float = 7.0) -> str:
+    return (date.today() - timedelta(days=timedelta_days)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def calc_version(scheduled_start_time: str) -> str:
+    """通知のタイミングに影響する項目 (予定開始時刻) からバージョンを計算する関数.
+
+    タイトルのみの変更ではバージョンは変わらない. タイトルは calc_content_hash で管理する
+
+    Args:
+        scheduled_start_time (str): 予定開始時刻
+
+    Returns:
+        str: バージョン
+    """
+    return hashlib.md5(scheduled_start_time.encode()).hexdigest()
+
+
+def calc_content_hash(title: str) -> str:
+    """通知に表示する項目 (タイトル) のハッシュを計算する関数.
+
+    Args:
+        title (str): タイトル
+
+    Returns:
+        str: ハッシュ
+    """
+    return hashlib.md5(title.encode()).hexdigest()
+
+
+def register_schedule_to_db(table_name: str, item: dict) -> None:
+    table = get_resource("dynamodb").Table(table_name)
+    table.put_item(Item=item)
+
+
+def get_version_from_db(table_name: str, video_id: str) -> str:
+    table = get_resource("dynamodb").Table(table_name)
+    result = table.get_item(
+        Key={
+            "video_id": video_id,
+            "version": "master",
+        }
+    )
+    return result["Item"]["current_version"]
+
+
+def same_as_current_version(table_name: str, video_id: str, version: str) -> bool:
+    table = get_resource("dynamodb").Table(table_name)
+    res = table.get_item(Key={"video_id":video_id, "version":"master"}).get("Item")
+    return bool(res and res["current_version"] == version)
+
+
+def get_masters(table_name: str, video_ids: list[str]) -> dict[str, dict]:
+    """video ID ごとのマスターをまとめて取得する関数.
+
+    BatchGetItem を100件ずつ呼び出し, UnprocessedKeys はバックオフしながら再試行する \n
+    再試行し切っても残ったキーは get_item で個別に取得する
+
+    Args:
+        table_name (str): 通知管理テーブル名
+        video_ids (list[str]): video ID のリスト
+
+    Returns:
+        dict[str, dict]: video ID -> マスター (current_version, content_hash, title, published). 未登録の video ID は含まない
+    """
+    dynamodb = get_resource("dynamodb")
+    masters = {}
+    for i in range(0, len(video_ids), BATCH_GET_MAX_KEYS):
+        request_items = {
+            table_name: {
+                "Keys": [{"video_id": video_id, "version": "master"} for video_id in video_ids[i:i + BATCH_GET_MAX_KEYS]],
+                "ProjectionExpression": "video_id, current_version, content_hash, title, published",
+            }
+        }
+        for attempt in range(BATCH_GET_MAX_ATTEMPTS):
+            res = dynamodb.batch_get_item(RequestItems=request_items)
+            for item in res.get("Responses", {}).get(table_name, []):
+                masters[item["video_id"]] = item
+            request_items = res.get("UnprocessedKeys")
+            if not request_items:
+                break
+            time.sleep(BATCH_GET_BACKOFF_SECONDS * (2 ** attempt))
+        else:
+            table = dynamodb.Table(table_name)
+            for key in request_items[table_name]["Keys"]:
+                item = table.get_item(Key=key).get("Item")
+                if item:
+                    masters[item["video_id"]] = item
+    return masters
+
+
+def get_current_versions(table_name: str, video_ids: list[str]) -> dict[str, str]:
+    """video ID ごとの現在のバージョンをまとめて取得する関数.
+
+    Args:
+        table_name (str): 通知管理テーブル名
+        video_ids (list[str]): video ID のリスト
+
+    Returns:
+        dict[str, str]: video ID -> current_version. マスターが未登録の video ID は含まない
+    """
+    return {video_id: master["current_version"] for video_id, master in get_masters(table_name, video_ids).items()}
+
+
+def claim_version(
+    table_name: str,
+    video_id: str,
+    version: str,
+    title: str,
+    content_hash: str,
+    time_stamp: str,
+    token: str,
+    lease_seconds: float = PUBLISH_LEASE_SECONDS,
+) -> bool:
+    """マスターを新しいバージョンに入れ替え, 通知する権利 (publishing_token) を取得する関数.
+
+    1回の条件付き更新で, 次のいずれかの場合のみマスターを未通知 (published=false) として書き換える \n
+    ・現在のバージョンと異なる場合 (compare-and-swap) \n
+    ・同じバージョンが未通知のまま残っており, 他の実行が権利を持っていないか権利の期限が切れている場合 \n
+    並行して実行された場合でも権利を取得できるのはいずれか一方のみとなり, 取得した実行のみ通知する \n
+    通知に成功した時点で mark_published により通知済みにする
+
+    Args:
+        table_name (str): 通知管理テーブル名
+        video_id (str): video ID
+        version (str): 新しいバージョン
+        title (str): タイトル
+        content_hash (str): タイトルのハッシュ
+        time_stamp (str): 処理時刻
+        token (str): 権利の識別子 (実行ごとに生成する)
+        lease_seconds (float): 権利の有効期間 (秒)
+
+    Returns:
+        bool: 権利を取得した場合 True
+    """
+    table = get_resource("dynamodb").Table(table_name)
+    now = int(time.time())
+    try:
+        table.update_item(
+            Key={"video_id": video_id, "version": "master"},
+            UpdateExpression=(
+                "SET current_version = :version, title = :title, content_hash = :content_hash, "
+                "time_stamp = :time_stamp, published = :false, "
+                "publishing_token = :token, publishing_expires_at = :expires_at"
+            ),
+            ConditionExpression=(
+                "attribute_not_exists(current_version) OR current_version <> :version OR "
+                "(published = :false AND (attribute_not_exists(publishing_token) OR publishing_expires_at < :now))"
+            ),
+            ExpressionAttributeValues={
+                ":version": version,
+                ":title": title,
+                ":content_hash": content_hash,
+                ":time_stamp": time_stamp,
+                ":false": False,
+                ":token": token,
+                ":expires_at": now + int(lease_seconds),
+                ":now": now,
+            },
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+
+def build_version_item(
+    video_id: str,
+    version: str,
+    title: str,
+    content_hash: str,
+    scheduled_start_time: str,
+    time_stamp: str,
+) -> dict:
+    return {
+        "video_id": video_id,
+        "version": version,
+        "title": title,
+        "content_hash": content_hash,
+        "scheduled_start_time": scheduled_start_time,
+        "time_stamp": time_stamp,
+    }
+
+
+def put_items(table_name: str, items: list[dict]) -> None:
+    """複数のアイテムを BatchWriteItem (25件ずつ) でまとめて書き込む関数.
+
+    未処理のアイテムは batch_writer が再送する
+
+    Args:
+        table_name (str): テーブル名
+        items (list[dict]): アイテムのリスト
+    """
+    table = get_resource("dynamodb").Table(table_name)
+    with table.batch_writer() as batch:
+        for item in items:
+            batch.put_item(Item=item)
+
+
+def update_content(
+    table_name: str,
+    video_id: str,
+    version: str,
+    title: str,
+    content_hash: str,
+    time_stamp: str,
+) -> bool:
+    """バージョンを変えずにマスターのタイトルのみを更新する関数.
+
+    予定開始時刻が変わっていない場合はルールを作り直す必要がないため, \n
+    通知時に参照するマスターのタイトルのみを書き換える
+
+    Args:
+        table_name (str): 通知管理テーブル名
+        video_id (str): video ID
+        version (str): 現在のバージョン
+        title (str): 新しいタイトル
+        content_hash (str): 新しいタイトルのハッシュ
+        time_stamp (str): 処理時刻
+
+    Returns:
+        bool: 更新した場合 True, バージョンが変わっていた場合 False
+    """
+    table = get_resource("dynamodb").Table(table_name)
+    try:
+        table.update_item(
+            Key={"video_id": video_id, "version": "master"},
+            UpdateExpression="SET title = :title, content_hash = :content_hash, time_stamp = :time_stamp",
+            ConditionExpression="current_version = :version",
+            ExpressionAttributeValues={
+                ":version": version,
+                ":title": title,
+                ":content_hash": content_hash,
+                ":time_stamp": time_stamp,
+            },
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+
+def mark_published(table_name: str, video_id: str, token: str) -> bool:
+    """claim_version で権利を取得したマスターを通知済み (published=true) にし, 権利を手放す関数.
+
+    未通知のまま残ったマスターは, 権利の期限が切れた後の実行で通知し直される \n
+    他の実行によってさらに新しいバージョンに入れ替えられていた場合は何もしない
+
+    Args:
+        table_name (str): 通知管理テーブル名
+        video_id (str): video ID
+        token (str): claim_version に指定した権利の識別子
+
+    Returns:
+        bool: 通知済みにした場合 True
+    """
+    table = get_resource("dynamodb").Table(table_name)
+    try:
+        table.update_item(
+            Key={"video_id": video_id, "version": "master"},
+            UpdateExpression="SET published = :published REMOVE publishing_token, publishing_expires_at",
+            ConditionExpression="publishing_token = :token",
+            ExpressionAttributeValues={":token": token, ":published": True},
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+
+def publish_to_sns(topic_arn: str, item: dict, subject: str="youtube_schedule") -> None:
+    topic = get_resource("sns").Topic(topic_arn)
+    topic.publish(
+        Subject=subject,
+        Message=json.dumps(item, ensure_ascii=False),
+        MessageStructure="json",
+    )
+
+
+def publish_batch_to_sns(topic_arn: str, items: list[dict], subject: str = "youtube_schedule") -> list[int]:
+    """複数のメッセージを PublishBatch で SNS_PUBLISH_BATCH_MAX 件ずつまとめて送信する関数.
+
+    呼び出し自体に失敗した場合は, その呼び出しに含まれるエントリをすべて失敗とする
+
+    Args:
+        topic_arn (str): SNSトピックのARN
+        items (list[dict]): プロトコルごとのメッセージ (MessageStructure=json) のリスト
+        subject (str): 件名
+
+    Returns:
+        list[int]: 送信に失敗したメッセージの items 内のインデックス
+    """
+    client = get_client("sns")
+    failed_indexes = []
+    for start in range(0, len(items), SNS_PUBLISH_BATCH_MAX):
+        indexes = range(start, min(start + SNS_PUBLISH_BATCH_MAX, len(items)))
+        try:
+            res = client.publish_batch(
+                TopicArn=topic_arn,
+                PublishBatchRequestEntries=[
+                    {
+                        "Id": str(index),
+                        "Subject": subject,
+                        "Message": json.dumps(items[index], ensure_ascii=False),
+                        "MessageStructure": "json",
+                    }
+                    for index in indexes
+                ],
+            )
+        except Exception:
+            failed_indexes.extend(indexes)
+            continue
+        failed_indexes.extend(int(entry["Id"]) for entry in res.get("Failed", []))
+    return sorted(failed_indexes)
+
+
+def invoke_lambda_async(function_name: str, messages: list[dict]) -> None:
+    """Lambda を非同期で呼び出し, 通知内容のリストを {"messages": [...]} として渡す関数.
+
+    notify_schedule_service の呼び出しや, 処理しきれなかった通知を自身に引き継ぐ場合に使用する
+
+    Args:
+        function_name (str): 呼び出す Lambda の関数名または ARN
+        messages (list[dict]): 通知内容のリスト
+    """
+    client = get_client("lambda")
+    client.invoke(
+        FunctionName=function_name,
+        InvocationType="Event",
+        Payload=json.dumps({"messages": messages}, ensure_ascii=False).encode(),
+    )
+
+
+def parse_datetime(value: str) -> datetime:
+    """RFC 3339 形式の文字列を timezone 付きの datetime に変換する関数.
+
+    timezone の指定がない場合は UTC とみなす
+
+    Args:
+        value (str): 日時文字列 (例: 2022-01-01T00:00:00Z)
+
+    Returns:
+        datetime: timezone 付きの datetime
+    """
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def coalesce_messages(messages: list[dict], window_minutes: float, max_group_size: int) -> list[dict]:
+    """同じステータスで予定開始時刻の近い通知を, 1件の通知にまとめる関数.
+
+    予定開始時刻の早い順に並べ, 先頭の通知から window_minutes 分未満のものを max_group_size 件までまとめる \n
+    まとめた通知は status, scheduled_start_time (先頭の通知のもの), rule_name, items (元の通知のリスト) を持つ \n
+    すでにまとめた通知が含まれる場合は元の通知に戻してからまとめ直す
+
+    Args:
+        messages (list[dict]): 通知内容のリスト
+        window_minutes (float): まとめる範囲 (分)
+        max_group_size (int): 1件にまとめる最大数
+
+    Returns:
+        list[dict]: 通知内容のリスト. まとめる相手がいない通知はそのまま返す
+    """
+    window = timedelta(minutes=float(window_minutes))
+    messages = [item for message in messages for item in message.get("items", [message])]
+    groups = []
+    for message in sorted(messages, key=lambda message: (message["status"], message["scheduled_start_time"])):
+        group = groups[-1] if groups else None
+        if (
+            group is not None
+            and group[0]["status"] == message["status"]
+            and len(group) < int(max_group_size)
+            and parse_datetime(message["scheduled_start_time"]) - parse_datetime(group[0]["scheduled_start_time"]) < window
+        ):
+            group.append(message)
+        else:
+            groups.append([message])
+
+    coalesced = []
+    for group in groups:
+        if len(group) == 1:
+            coalesced.append(group[0])
+            continue
+        coalesced.append({
+            "status": group[0]["status"],
+            "scheduled_start_time": group[0]["scheduled_start_time"],
+            "rule_name": f"digest_{group[0]['rule_name']}",
+            "items": group,
+        })
+    return coalesced
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import json
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from aws_clients import get_client
+from common_utils import get_current_versions
+
+
+logger = logging.getLogger()
+
+# create_rule_service が作成するルール名 (rul_<channel_id>_<video_id>[_30]_sdk)
+# CDK で作成したルール (rul_xxx_cdk) は対象外
+RULE_NAME_PATTERN = re.compile(r"^rul_(?P<channel_id>UC[\w-]{22})_(?P<video_id>[\w-]{11})(?:_30)?_sdk$")
+RULE_NAME_PREFIX = "rul_"
+RULE_SCHEDULE_FORMAT = "cron(%M %H %d %m ? %Y)"
+RULE_TARGET_ID = "to_lambda"
+
+
+def parse_rule_time(schedule_expression: str) -> datetime | None:
+    """ルールの ScheduleExpression から送信時刻を取り出す関数.
+
+    Args:
+        schedule_expression (str): ScheduleExpression (例: cron(30 12 01 01 ? 2022))
+
+    Returns:
+        datetime | None: 送信時刻 (UTC). 1回限りの cron でない場合は None
+    """
+    try:
+        return datetime.strptime(schedule_expression, RULE_SCHEDULE_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+
+def list_sdk_rules(name_prefix: str = RULE_NAME_PREFIX) -> list[dict]:
+    """create_rule_service が作成したルールを全件取得する関数.
+
+    Args:
+        name_prefix (str): ルール名の前方一致条件
+
+    Returns:
+        list[dict]: name, video_id, time のリスト
+    """
+    client = get_client("events")
+    rules = []
+    kwargs = {"NamePrefix": name_prefix}
+    while True:
+        res = client.list_rules(**kwargs)
+        for rule in res.get("Rules", []):
+            match = RULE_NAME_PATTERN.match(rule["Name"])
+            if match:
+                rules.append({
+                    "name": rule["Name"],
+                    "video_id": match.group("video_id"),
+                    "time": parse_rule_time(rule.get("ScheduleExpression")),
+                })
+        if not res.get("NextToken"):
+            return rules
+        kwargs["NextToken"] = res["NextToken"]
+
+
+def get_rule_version(rule_name: str) -> str | None:
+    """ルールのターゲットに渡している通知内容からバージョンを取り出す関数.
+
+    Args:
+        rule_name (str): ルール名
+
+    Returns:
+        str | None: バージョン. ターゲットがない場合は None
+    """
+    client = get_client("events")
+    for rule_target in client.list_targets_by_rule(Rule=rule_name).get("Targets", []):
+        if rule_target["Id"] == RULE_TARGET_ID and rule_target.get("Input"):
+            return json.loads(rule_target["Input"]).get("version")
+    return None
+
+
+def delete_rule(rule_name: str) -> None:
+    """ルールをターゲットごと削除する関数.
+
+    Args:
+        rule_name (str): ルール名
+    """
+    client = get_client("events")
+    try:
+        client.remove_targets(Rule=rule_name, Ids=[RULE_TARGET_ID])
+        client.delete_rule(Name=rule_name)
+    except client.exceptions.ResourceNotFoundException:
+        pass
+
+
+def is_stale_rule(rule: dict, current_version: str | None, now: datetime, expired_grace_minutes: float) -> bool:
+    """ルールが不要になっているか判定する関数.
+
+    以下のいずれかに当てはまるルールを不要とみなす \n
+    ・通知管理テーブルにマスターがない \n
+    ・送信時刻を expired_grace_minutes 分以上過ぎている (1回限りのため二度と実行されない) \n
+    ・ターゲットの通知内容が現在のバージョンと異なる
+
+    Args:
+        rule (dict): list_sdk_rules の要素
+        current_version (str | None): 通知管理テーブルの現在のバージョン
+        now (datetime): 現在日時 (UTC)
+        expired_grace_minutes (float): 送信時刻を過ぎてから不要とみなすまでの猶予 (分)
+
+    Returns:
+        bool: 不要な場合 True
+    """
+    if current_version is None:
+        return True
+    if rule["time"] is None or rule["time"] < now - timedelta(minutes=expired_grace_minutes):
+        return True
+    return get_rule_version(rule["name"]) != current_version
+
+
+def reconcile_rules(
+    notify_controller_table_name: str,
+    name_prefix: str = RULE_NAME_PREFIX,
+    expired_grace_minutes: float = 10.0,
+    max_workers: int = 8,
+    dry_run: bool = False,
+) -> list[str]:
+    """create_rule_service が作成したルールを通知管理テーブルと突き合わせ, 不要なルールを削除する関数.
+
+    定期実行で全件 (name_prefix="rul_") を対象とするほか, create_rule_service から \n
+    動画単位 (name_prefix="rul_<channel_id>_<video_id>_") で呼び出すこともできる \n
+    EventBridge の呼び出しはスレッドプールでまとめて実行する
+
+    Args:
+        notify_controller_table_name (str): 通知管理テーブル名
+        name_prefix (str): 対象とするルール名の前方一致条件
+        expired_grace_minutes (float): 送信時刻を過ぎてから不要とみなすまでの猶予 (分)
+        max_workers (int): EventBridge を並列に呼び出す数
+        dry_run (bool): True の場合は削除せずに対象のルール名のみ返す
+
+    Returns:
+        list[str]: 削除した (dry_run の場合は削除対象の) ルール名のリスト
+    """
+    rules = list_sdk_rules(name_prefix)
+    if not rules:
+        return []
+    versions = get_current_versions(notify_controller_table_name, list(dict.fromkeys(rule["video_id"] for rule in rules)))
+    now = datetime.utcnow()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        stale = list(executor.map(
+            lambda rule: is_stale_rule(rule, versions.get(rule["video_id"]), now, expired_grace_minutes),
+            rules,
+        ))
+        stale_rule_names = [rule["name"] for rule, is_stale in zip(rules, stale) if is_stale]
+        if not dry_run:
+            list(executor.map(delete_rule, stale_rule_names))
+
+    logger.info(f"reconcile rules: {len(stale_rule_names)}/{len(rules)} stale (dry_run={dry_run})")
+    return stale_rule_names
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import json
+from datetime import datetime, timedelta, timezone
+
+from aws_clients import get_resource
+
+
+# 通知予定を格納するバケット (UTC の分単位)
+BUCKET_FORMAT = "%Y-%m-%dT%H:%M"
+
+# ルール名 -> 登録先バケットの対応を保持するアイテムのパーティションキー
+# 予定時刻が変わった場合に, 古いバケットのアイテムを削除するために使用する
+LOCATOR_BUCKET = "locator"
+
+# DynamoDB の TTL に使用する属性名 (UNIX 時間)
+# dispatch_schedule_service が遡る範囲を過ぎても残ったアイテム (実行が長時間止まっていた場合等) は TTL で削除する
+TTL_ATTRIBUTE = "expires_at"
+EXPIRES_AFTER = timedelta(days=1)
+
+
+def to_bucket(time: datetime) -> str:
+    """日時をバケット名に変換する関数.
+
+    Args:
+        time (datetime): 日時 (UTC)
+
+    Returns:
+        str: バケット名 (例: 2022-01-01T12:30)
+    """
+    return time.strftime(BUCKET_FORMAT)
+
+
+def iter_buckets(now: datetime, lookback_minutes: int) -> list[str]:
+    """now から lookback_minutes 分前までのバケット名を古い順に返す関数.
+
+    Args:
+        now (datetime): 現在日時 (UTC)
+        lookback_minutes (int): 遡る分数
+
+    Returns:
+        list[str]: バケット名のリスト
+    """
+    return [to_bucket(now - timedelta(minutes=minutes)) for minutes in range(lookback_minutes, -1, -1)]
+
+
+def calc_expires_at(time: datetime) -> int:
+    """送信時刻からアイテムの有効期限 (TTL) を求める関数.
+
+    Args:
+        time (datetime): 送信時刻 (UTC)
+
+    Returns:
+        int: 有効期限 (UNIX 時間)
+    """
+    return int((time + EXPIRES_AFTER).replace(tzinfo=timezone.utc).timestamp())
+
+
+def put_schedule_to_index(table_name: str, time: datetime, contents: dict, rule_name: str) -> None:
+    """時間指定の通知を予定テーブルに登録する関数.
+
+    EventBridge のルールの代わりに使用する. 同じルール名で登録済みの場合は上書きし, \n
+    予定時刻が変わっていた場合は古いバケットのアイテムを削除する \n
+    送信されないまま残ったアイテムは, 送信時刻の EXPIRES_AFTER 後に TTL で削除される
+
+    Args:
+        table_name (str): 予定テーブル名
+        time (datetime): 送信時刻 (UTC)
+        contents (dict): 送信したい内容
+        rule_name (str): ルール名 (通知を一意に識別する)
+    """
+    table = get_resource("dynamodb").Table(table_name)
+    bucket = to_bucket(time)
+    expires_at = calc_expires_at(time)
+    locator = table.get_item(Key={"bucket": LOCATOR_BUCKET, "rule_name": rule_name}).get("Item")
+    with table.batch_writer() as batch:
+        batch.put_item(Item={
+            "bucket": bucket,
+            "rule_name": rule_name,
+            "contents": json.dumps(contents, ensure_ascii=False),
+            TTL_ATTRIBUTE: expires_at,
+        })
+        batch.put_item(Item={
+            "bucket": LOCATOR_BUCKET,
+            "rule_name": rule_name,
+            "due_bucket": bucket,
+            TTL_ATTRIBUTE: expires_at,
+        })
+        if locator and locator["due_bucket"] != bucket:
+            batch.delete_item(Key={"bucket": locator["due_bucket"], "rule_name": rule_name})
+
+
+def query_due_schedules(table_name: str, bucket: str) -> list[dict]:
+    """バケットに登録されている通知を取得する関数.
+
+    Args:
+        table_name (str): 予定テーブル名
+        bucket (str): バケット名
+
+    Returns:
+        list[dict]: rule_name, contents (dict) のリスト
+    """
+    table = get_resource("dynamodb").Table(table_name)
+    kwargs = {
+        "KeyConditionExpression": "#bucket = :bucket",
+        "ExpressionAttributeNames": {"#bucket": "bucket"},
+        "ExpressionAttributeValues": {":bucket": bucket},
+    }
+    items = []
+    while True:
+        res = table.query(**kwargs)
+        items.extend(
+            {"rule_name": item["rule_name"], "contents": json.loads(item["contents"])}
+            for item in res.get("Items", [])
+        )
+        if "LastEvaluatedKey" not in res:
+            return items
+        kwargs["ExclusiveStartKey"] = res["LastEvaluatedKey"]
+
+
+def delete_schedules_from_index(table_name: str, bucket: str, rule_names: list[str]) -> None:
+    """送信済みの通知を予定テーブルから削除する関数.
+
+    Args:
+        table_name (str): 予定テーブル名
+        bucket (str): バケット名
+        rule_names (list[str]): 削除するルール名のリスト
+    """
+    table = get_resource("dynamodb").Table(table_name)
+    with table.batch_writer() as batch:
+        for rule_name in rule_names:
+            batch.delete_item(Key={"bucket": bucket, "rule_name": rule_name})
+            batch.delete_item(Key={"bucket": LOCATOR_BUCKET, "rule_name": rule_name})
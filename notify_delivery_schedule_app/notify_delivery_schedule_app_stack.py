@@ -1,18 +1,25 @@
 from aws_cdk import (
+    Duration,
     Stack,
     aws_ssm as ssm,
+    aws_events as event,
     aws_events_targets as target,
     aws_iam as iam,
     aws_lambda_event_sources as event_source,
+    aws_sns_subscriptions as subscriptions,
 )
 from constructs import Construct
 
 from notify_delivery_schedule_app.stack_base import (
+    add_self_invoke_policy,
     create_lambda,
+    create_layer,
     create_iam_role_for_lambda,
     create_sns,
+    create_sqs,
     create_dynamodb_exist_sort_key,
     create_schdule_rule_every_hour,
+    create_schdule_rule_every_minute,
     subscribe_sns_to_lambda,
 )
 import notify_delivery_schedule_app.stack_config as config
@@ -24,6 +31,12 @@ class NotifyDeliveryScheduleAppStack(Stack):
 
         # Declaring a resource
 
+        lyr_common_layer = create_layer(
+            self,
+            service_name=config.COMMON_LAYER_NAME,
+            service_description=config.COMMON_LAYER_DESCRIPTION,
+        )
+
         rul_youtube_schedule_service_cdk = create_schdule_rule_every_hour(
             self,
             service_name=config.YOUTUBE_SCHEDULE_SERVICE_NAME,
@@ -40,8 +53,35 @@ class NotifyDeliveryScheduleAppStack(Stack):
             service_description=config.YOUTUBE_SCHEDULE_SERVICE_DESCRIPTION,
             environment=config.YOUTUBE_SCHEDULE_SERVICE_PARAMATER,
             lambda_role=iam_youtube_schedule_service,
+            layers=[lyr_common_layer],
+            reserved_concurrent_executions=(
+                config.YOUTUBE_SHARD_MAX_CONCURRENCY + config.YOUTUBE_SHARD_RESERVED_HEADROOM
+                if config.YOUTUBE_SHARDING_ENABLED else None
+            ),
         )
         rul_youtube_schedule_service_cdk.add_target(target.LambdaFunction(lmd_youtube_schedule_service))
+        sqs_youtube_schedule_shard = create_sqs(
+            self,
+            service_name=config.YOUTUBE_SHARD_QUEUE_NAME,
+            max_receive_count=config.YOUTUBE_SHARD_MAX_RECEIVE_COUNT,
+        )
+        if config.YOUTUBE_SHARDING_ENABLED:
+            lmd_youtube_schedule_service.add_event_source(event_source.SqsEventSource(
+                sqs_youtube_schedule_shard,
+                batch_size=config.YOUTUBE_SHARD_BATCH_SIZE,
+                report_batch_item_failures=True,
+            ))
+        if config.LIVE_TRACKING_ENABLED:
+            rul_youtube_live_tracking = create_schdule_rule_every_minute(
+                self,
+                service_name=config.LIVE_TRACKING_NAME,
+                service_description=config.LIVE_TRACKING_DESCRIPTION,
+                minutes=config.LIVE_TRACKING_INTERVAL_MINUTES,
+            )
+            rul_youtube_live_tracking.add_target(target.LambdaFunction(
+                lmd_youtube_schedule_service,
+                event=event.RuleTargetInput.from_object({"mode": "track"}),
+            ))
         ssm_youtube_api_key = ssm.StringParameter.from_secure_string_parameter_attributes(
             self, config.SSM_YOUTUBE_API_KEY,
             version=1,
@@ -114,8 +154,21 @@ class NotifyDeliveryScheduleAppStack(Stack):
             environment=config.CREATE_RULE_SERVICE_PARAMATER,
             service_description=config.CREATE_RULE_SERVICE_DESCRIPTION,
             lambda_role=iam_create_rule_service,
+            layers=[lyr_common_layer],
         )
-        lmd_create_rule_service.add_event_source(event_source.SnsEventSource(sns_youtube_schedule_service))
+        sqs_create_rule_service = create_sqs(
+            self,
+            service_name=config.CREATE_RULE_QUEUE_NAME,
+        )
+        sns_youtube_schedule_service.add_subscription(
+            subscriptions.SqsSubscription(sqs_create_rule_service, raw_message_delivery=True)
+        )
+        lmd_create_rule_service.add_event_source(event_source.SqsEventSource(
+            sqs_create_rule_service,
+            batch_size=config.CREATE_RULE_BATCH_SIZE,
+            max_batching_window=Duration.seconds(config.CREATE_RULE_MAX_BATCHING_WINDOW_SECONDS),
+            report_batch_item_failures=True,
+        ))
 
 
         iam_notify_schedule_service = create_iam_role_for_lambda(
@@ -129,6 +182,7 @@ class NotifyDeliveryScheduleAppStack(Stack):
             environment=config.NOTIFY_SCHEDULE_SERVICE_PARAMATER,
             service_description=config.NOTIFY_SCHEDULE_SERVICE_DESCRIPTION,
             lambda_role=iam_notify_schedule_service,
+            layers=[lyr_common_layer],
         )
         lmd_notify_schedule_service.add_permission(
             "permission_lmd_notify_schedule_service",
@@ -137,6 +191,58 @@ class NotifyDeliveryScheduleAppStack(Stack):
         )
 
 
+        dyn_schedule_index_table = create_dynamodb_exist_sort_key(
+            self,
+            service_name=config.SCHEDULE_INDEX_TABLE_NAME,
+            partition_key=config.SCHEDULE_INDEX_TABLE_PARTITION_KEY,
+            sort_key=config.SCHEDULE_INDEX_TABLE_SORT_KEY,
+            read_capacity=config.SCHEDULE_INDEX_TABLE_READ_CAPACITY,
+            write_capacity=config.SCHEDULE_INDEX_TABLE_WRITE_CAPACITY,
+            time_to_live_attribute=config.SCHEDULE_INDEX_TABLE_TTL_ATTRIBUTE,
+        )
+        rul_dispatch_schedule_service = create_schdule_rule_every_minute(
+            self,
+            service_name=config.DISPATCH_SCHEDULE_SERVICE_NAME,
+            service_description=config.DISPATCH_SCHEDULE_SERVICE_DESCRIPTION,
+        )
+        iam_dispatch_schedule_service = create_iam_role_for_lambda(
+            self,
+            service_name=config.DISPATCH_SCHEDULE_SERVICE_NAME,
+            service_description=config.DISPATCH_SCHEDULE_SERVICE_DESCRIPTION,
+        )
+        lmd_dispatch_schedule_service = create_lambda(
+            self,
+            service_name=config.DISPATCH_SCHEDULE_SERVICE_NAME,
+            environment=config.DISPATCH_SCHEDULE_SERVICE_PARAMATER,
+            service_description=config.DISPATCH_SCHEDULE_SERVICE_DESCRIPTION,
+            lambda_role=iam_dispatch_schedule_service,
+            layers=[lyr_common_layer],
+        )
+        rul_dispatch_schedule_service.add_target(target.LambdaFunction(lmd_dispatch_schedule_service))
+
+
+        rul_reconcile_rule_service = create_schdule_rule_every_hour(
+            self,
+            service_name=config.RECONCILE_RULE_SERVICE_NAME,
+            service_description=config.RECONCILE_RULE_SERVICE_DESCRIPTION,
+            minute=config.RECONCILE_RULE_SCHEDULE_MINUTE,
+        )
+        iam_reconcile_rule_service = create_iam_role_for_lambda(
+            self,
+            service_name=config.RECONCILE_RULE_SERVICE_NAME,
+            service_description=config.RECONCILE_RULE_SERVICE_DESCRIPTION,
+        )
+        lmd_reconcile_rule_service = create_lambda(
+            self,
+            service_name=config.RECONCILE_RULE_SERVICE_NAME,
+            environment=config.RECONCILE_RULE_SERVICE_PARAMATER,
+            service_description=config.RECONCILE_RULE_SERVICE_DESCRIPTION,
+            lambda_role=iam_reconcile_rule_service,
+            layers=[lyr_common_layer],
+        )
+        rul_reconcile_rule_service.add_target(target.LambdaFunction(lmd_reconcile_rule_service))
+
+
         sns_post_twitter_service = create_sns(
             self,
             service_name=config.POST_TWITTER_SERVICE_NAME,
@@ -152,14 +258,28 @@ class NotifyDeliveryScheduleAppStack(Stack):
             environment=config.POST_TWITTER_SERVICE_PARAMATER,
             service_description=config.POST_TWITTER_SERVICE_DESCRIPTION,
             lambda_role=iam_post_twitter_service,
+            layers=[lyr_common_layer],
         )
-        subscribe_sns_to_lambda(
+        sqs_post_twitter_service = create_sqs(
             self,
-            service_name=config.POST_TWITTER_SERVICE_NAME,
-            topic=sns_post_twitter_service,
-            target_lambda=lmd_post_twitter_service,
-        )
-        lmd_post_twitter_service.add_event_source(event_source.SnsEventSource(sns_post_twitter_service))
+            service_name=config.POST_TWITTER_QUEUE_NAME,
+        )
+        sns_post_twitter_service.add_subscription(
+            subscriptions.SqsSubscription(sqs_post_twitter_service, raw_message_delivery=True)
+        )
+        # まとめない場合は待たずに受け取る (配信開始の通知を遅らせない)
+        lmd_post_twitter_service.add_event_source(event_source.SqsEventSource(
+            sqs_post_twitter_service,
+            batch_size=(
+                config.POST_TWITTER_COALESCE_BATCH_SIZE
+                if config.POST_TWITTER_COALESCE_ENABLED else config.POST_TWITTER_BATCH_SIZE
+            ),
+            max_batching_window=(
+                Duration.seconds(config.POST_TWITTER_MAX_BATCHING_WINDOW_SECONDS)
+                if config.POST_TWITTER_COALESCE_ENABLED else None
+            ),
+            report_batch_item_failures=True,
+        ))
         ssm_twitter_api_key = ssm.StringParameter.from_secure_string_parameter_attributes(
             self, config.SSM_TWITTER_API_KEY,
             version=1,
@@ -186,8 +306,16 @@ class NotifyDeliveryScheduleAppStack(Stack):
 
         ssm_youtube_api_key.grant_read(iam_youtube_schedule_service)
         sns_youtube_schedule_service.grant_publish(iam_youtube_schedule_service)
-        dyn_youtube_schedule_service.grant_read_data(iam_youtube_schedule_service)
+        dyn_youtube_schedule_service.grant_read_write_data(iam_youtube_schedule_service)
         dyn_notify_controller_table.grant_read_write_data(iam_youtube_schedule_service)
+        lmd_notify_schedule_service.grant_invoke(iam_youtube_schedule_service)
+        sqs_youtube_schedule_shard.grant_send_messages(iam_youtube_schedule_service)
+        # 処理しきれなかったチャンネルを続きから処理するため, 自身を呼び出す
+        add_self_invoke_policy(
+            self,
+            service_name=config.YOUTUBE_SCHEDULE_SERVICE_NAME,
+            lambda_role=iam_youtube_schedule_service,
+        )
 
         dyn_youtube_schedule_service.grant_write_data(iam_register_schedule_master_service_cdk)
         
@@ -195,13 +323,42 @@ class NotifyDeliveryScheduleAppStack(Stack):
 
         iam_create_rule_service.add_to_policy(
             iam.PolicyStatement(
-                actions=["events:PutRule", "events:PutTargets", "events:TagResource"],
+                actions=[
+                    "events:PutRule",
+                    "events:PutTargets",
+                    "events:TagResource",
+                    "events:ListRules",
+                    "events:ListTargetsByRule",
+                    "events:RemoveTargets",
+                    "events:DeleteRule",
+                ],
                 effect=iam.Effect.ALLOW,
                 resources=[config.CREATE_RULE_NAME],
             )
         )
+        dyn_notify_controller_table.grant_read_data(iam_create_rule_service)
+
+        iam_reconcile_rule_service.add_to_policy(
+            iam.PolicyStatement(
+                actions=[
+                    "events:ListRules",
+                    "events:ListTargetsByRule",
+                    "events:RemoveTargets",
+                    "events:DeleteRule",
+                ],
+                effect=iam.Effect.ALLOW,
+                resources=[config.CREATE_RULE_NAME],
+            )
+        )
+        dyn_notify_controller_table.grant_read_data(iam_reconcile_rule_service)
+
+        dyn_schedule_index_table.grant_read_write_data(iam_create_rule_service)
+
+        dyn_schedule_index_table.grant_read_write_data(iam_dispatch_schedule_service)
+        lmd_notify_schedule_service.grant_invoke(iam_dispatch_schedule_service)
 
         sns_post_twitter_service.grant_publish(iam_notify_schedule_service)
+        dyn_notify_controller_table.grant_read_data(iam_notify_schedule_service)
 
         sns_post_twitter_service.grant_publish(iam_post_twitter_service)
         ssm_twitter_api_key.grant_read(iam_post_twitter_service)
@@ -216,6 +373,12 @@ class NotifyDeliveryScheduleAppStack(Stack):
             )
         )
         dyn_notify_controller_table.grant_read_data(iam_post_twitter_service)
+        # 実行時間内にツイートしきれなかった通知を引き継ぐため, 自身を呼び出す
+        add_self_invoke_policy(
+            self,
+            service_name=config.POST_TWITTER_SERVICE_NAME,
+            lambda_role=iam_post_twitter_service,
+        )
 
 
         # Name resolution of environment variables
@@ -235,6 +398,30 @@ class NotifyDeliveryScheduleAppStack(Stack):
             key=config.SSM_YOUTUBE_API_KEY.upper(),
             value=ssm_youtube_api_key.parameter_name,
         )
+        lmd_youtube_schedule_service.add_environment(
+            key=config.NOTIFY_SCHEDULE_SERVICE_NAME.upper(),
+            value=lmd_notify_schedule_service.function_arn,
+        )
+        lmd_youtube_schedule_service.add_environment(
+            key=config.LIVE_TRACKING_KEY,
+            value=str(config.LIVE_TRACKING_ENABLED).lower(),
+        )
+        lmd_youtube_schedule_service.add_environment(
+            key=config.LIVE_TRACKING_INTERVAL_KEY,
+            value=str(config.LIVE_TRACKING_INTERVAL_MINUTES),
+        )
+        lmd_youtube_schedule_service.add_environment(
+            key=config.SHARDING_KEY,
+            value=str(config.YOUTUBE_SHARDING_ENABLED).lower(),
+        )
+        lmd_youtube_schedule_service.add_environment(
+            key=config.SHARD_SIZE_KEY,
+            value=str(config.YOUTUBE_SHARD_SIZE),
+        )
+        lmd_youtube_schedule_service.add_environment(
+            key=config.SHARD_QUEUE_URL_KEY,
+            value=sqs_youtube_schedule_shard.queue_url,
+        )
 
         lmd_register_schedule_master_service_cdk.add_environment(
             key=config.SCHEDULE_MASTER_TABLE_NAME.upper(),
@@ -255,15 +442,51 @@ class NotifyDeliveryScheduleAppStack(Stack):
             value=lmd_notify_schedule_service.function_arn,
         )
 
+        lmd_create_rule_service.add_environment(
+            key=config.SCHEDULE_INDEX_TABLE_NAME.upper(),
+            value=dyn_schedule_index_table.table_name,
+        )
+
+        lmd_create_rule_service.add_environment(
+            key=config.NOTIFY_CONTROLLER_TABLE_NAME.upper(),
+            value=dyn_notify_controller_table.table_name,
+        )
+        lmd_create_rule_service.add_environment(
+            key=config.LIVE_TRACKING_KEY,
+            value=str(config.LIVE_TRACKING_ENABLED).lower(),
+        )
+
+        lmd_reconcile_rule_service.add_environment(
+            key=config.NOTIFY_CONTROLLER_TABLE_NAME.upper(),
+            value=dyn_notify_controller_table.table_name,
+        )
+
+        lmd_dispatch_schedule_service.add_environment(
+            key=config.SCHEDULE_INDEX_TABLE_NAME.upper(),
+            value=dyn_schedule_index_table.table_name,
+        )
+        lmd_dispatch_schedule_service.add_environment(
+            key=config.NOTIFY_SCHEDULE_SERVICE_NAME.upper(),
+            value=lmd_notify_schedule_service.function_arn,
+        )
+
         lmd_notify_schedule_service.add_environment(
             key=config.POST_TWITTER_SERVICE_NAME.upper(),
             value=sns_post_twitter_service.topic_arn,
         )
+        lmd_notify_schedule_service.add_environment(
+            key=config.NOTIFY_CONTROLLER_TABLE_NAME.upper(),
+            value=dyn_notify_controller_table.table_name,
+        )
 
         lmd_post_twitter_service.add_environment(
             key=config.NOTIFY_CONTROLLER_TABLE_NAME.upper(),
             value=dyn_notify_controller_table.table_name,
         )
+        lmd_post_twitter_service.add_environment(
+            key=config.COALESCE_KEY,
+            value=str(config.POST_TWITTER_COALESCE_ENABLED).lower(),
+        )
         lmd_post_twitter_service.add_environment(
             key=config.SSM_TWITTER_API_KEY.upper(),
             value=ssm_twitter_api_key.parameter_name,
@@ -1,7 +1,10 @@
+from __future__ import annotations
+
 import os
 
 import aws_cdk as cdk
 from aws_cdk import (
+    ArnFormat,
     aws_lambda as lambda_,
     aws_logs as logs,
     aws_iam as iam, 
@@ -60,6 +63,8 @@ def create_lambda(
     environment: dict,
     service_description: str,
     lambda_role: iam.Role,
+    layers: list[lambda_.ILayerVersion] | None = None,
+    reserved_concurrent_executions: int | None = None,
 ) -> lambda_.Function:
     """Lambdaを作成する関数.
 
@@ -68,6 +73,8 @@ def create_lambda(
         environment (dict): 環境変数
         service_description (str): 詳細
         lambda_role (iam.Role): Lambda実行ロール
+        layers (list[lambda_.ILayerVersion] | None): 追加するLambda Layer
+        reserved_concurrent_executions (int | None): 同時実行数の上限 (None の場合は指定しない)
 
     Returns:
         lambda_.Function: Lambda
@@ -84,6 +91,32 @@ def create_lambda(
         memory_size=config.LAMBDA_MEMORY_SIZE,
         log_retention=logs.RetentionDays.THREE_MONTHS,
         role=lambda_role,
+        layers=layers,
+        reserved_concurrent_executions=reserved_concurrent_executions,
+    )
+
+
+@set_tags
+def create_layer(
+    self,
+    service_name: str,
+    service_description: str,
+) -> lambda_.LayerVersion:
+    """Lambda Layerを作成する関数.
+
+    Args:
+        service_name (str): レイヤー名
+        service_description (str): 詳細
+
+    Returns:
+        lambda_.LayerVersion: Lambda Layer
+    """
+    return lambda_.LayerVersion(
+        self, build_resource_name(config.LAYER_PREFIX, service_name),
+        code=lambda_.Code.from_asset(os.path.join(config.LAMBDA_LAYER_DEPLOY_DIR, service_name)),
+        compatible_runtimes=[lambda_.Runtime.PYTHON_3_9],
+        layer_version_name=build_resource_name(config.LAYER_PREFIX, service_name),
+        description=service_description,
     )
 
 
@@ -117,20 +150,33 @@ def create_iam_role_for_lambda(
 @set_tags
 def create_sqs(
     self,
-    service_name: str
+    service_name: str,
+    max_receive_count: int = config.SQS_MAX_RECEIVE_COUNT,
 ) -> sqs.Queue:
     """SQSを作成する関数.
 
+    max_receive_count 回受信しても削除されなかったメッセージは, デッドレターキュー (<service_name>_dlq) に移す
+
     Args:
         service_name (str): サービス名
+        max_receive_count (int): デッドレターキューに移すまでの受信回数
 
     Returns:
         sqs.Queue: SQS
     """
+    dead_letter_queue = sqs.Queue(
+        self, build_resource_name(config.SQS_PREFIX, f"{service_name}_dlq"),
+        queue_name=build_resource_name(config.SQS_PREFIX, f"{service_name}_dlq"),
+        retention_period=cdk.Duration.days(config.SQS_DEAD_LETTER_RETENTION_DAYS),
+    )
     return sqs.Queue(
         self, build_resource_name(config.SQS_PREFIX, service_name),
         queue_name=build_resource_name(config.SQS_PREFIX, service_name),
-        visibility_timeout=cdk.Duration.seconds(config.SQS_VISIBILITY_TIMEOUT)
+        visibility_timeout=cdk.Duration.seconds(config.SQS_VISIBILITY_TIMEOUT),
+        dead_letter_queue=sqs.DeadLetterQueue(
+            max_receive_count=max_receive_count,
+            queue=dead_letter_queue,
+        ),
     )
 
 
@@ -139,12 +185,14 @@ def create_schdule_rule_every_hour(
     self,
     service_name: str,
     service_description: str,
+    minute: str = "28",
 ) -> event.Rule:
     """1H毎のイベントを作成する関数.
 
     Args:
         service_name (str): サービス名
         service_description (str): 詳細
+        minute (str): 実行する分
 
     Returns:
         event.Rule: [description]
@@ -152,7 +200,7 @@ def create_schdule_rule_every_hour(
     return event.Rule(
         self, build_resource_name(config.RULE_PREFIX, service_name),
         schedule=event.Schedule.cron(
-            minute="28",
+            minute=minute,
             hour="*",
             day="*",
             month="*",
@@ -164,6 +212,32 @@ def create_schdule_rule_every_hour(
     )
 
 
+@set_tags
+def create_schdule_rule_every_minute(
+    self,
+    service_name: str,
+    service_description: str,
+    minutes: int = 1,
+) -> event.Rule:
+    """数分毎のイベントを作成する関数.
+
+    Args:
+        service_name (str): サービス名
+        service_description (str): 詳細
+        minutes (int): 実行間隔 (分)
+
+    Returns:
+        event.Rule: EventBridge Rule
+    """
+    return event.Rule(
+        self, build_resource_name(config.RULE_PREFIX, service_name),
+        schedule=event.Schedule.rate(cdk.Duration.minutes(minutes)),
+        rule_name=build_resource_name(config.RULE_PREFIX, service_name),
+        description=service_description,
+        enabled=config.RULE_ENABLED
+    )
+
+
 @set_tags
 def create_dynamodb_exist_sort_key(
     self,
@@ -172,6 +246,7 @@ def create_dynamodb_exist_sort_key(
     sort_key: str,
     read_capacity: int,
     write_capacity: int,
+    time_to_live_attribute: str | None = None,
 ) -> dynamodb.Table:
     """dynamodbを作成する関数.\n
 
@@ -184,6 +259,7 @@ def create_dynamodb_exist_sort_key(
         sort_key (str): ソートキー名
         read_capacity (int): 読込キャパシティユニット
         write_capacity (int): 書込キャパシティユニット
+        time_to_live_attribute (str | None): TTL に使用する属性名 (None の場合は TTL を無効にする)
 
     Returns:
         dynamodb.Table: dynamodb
@@ -204,6 +280,7 @@ def create_dynamodb_exist_sort_key(
             name=sort_key,
             type=dynamodb.AttributeType.STRING,
         ),
+        time_to_live_attribute=time_to_live_attribute,
     )
 
 
@@ -263,6 +340,33 @@ def create_sns(
     )
 
 
+def add_self_invoke_policy(
+    self,
+    service_name: str,
+    lambda_role: iam.Role,
+) -> None:
+    """Lambdaが自身を非同期で呼び出せるように, 実行ロールにポリシーを追加する関数.
+
+    関数の ARN を参照すると (関数 -> ロール -> 関数) の循環参照になるため, 関数名から ARN を組み立てる
+
+    Args:
+        service_name (str): サービス名
+        lambda_role (iam.Role): Lambda実行ロール
+    """
+    lambda_role.add_to_policy(
+        iam.PolicyStatement(
+            actions=["lambda:InvokeFunction"],
+            effect=iam.Effect.ALLOW,
+            resources=[cdk.Stack.of(self).format_arn(
+                service="lambda",
+                resource="function",
+                resource_name=build_resource_name(config.LAMBDA_PREFIX, service_name),
+                arn_format=ArnFormat.COLON_RESOURCE_NAME,
+            )],
+        )
+    )
+
+
 def subscribe_sns_to_lambda(
     self,
     service_name: str,
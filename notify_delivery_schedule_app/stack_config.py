@@ -1,3 +1,4 @@
+import math
 from pathlib import Path
 
 import yaml
@@ -15,6 +16,7 @@ RULE_PREFIX = "rul"
 DYNAMODB_PREFIX = "dyn"
 SNS_PREFIX = "sns"
 SNS_SUBSCRIPTION_PREFIX = "sub"
+LAYER_PREFIX = "lyr"
 
 # Lambda paramater
 LAMBDA_DEPLOY_DIR = "deploy"
@@ -22,11 +24,47 @@ LAMBDA_HANDLER_PATH = "lambda_function.handler"
 LAMBDA_TIMEOUT = 300
 LAMBDA_MEMORY_SIZE = 256
 
+# Lambda Layer paramater
+LAMBDA_LAYER_DEPLOY_DIR = "deploy_layer"
+
 # SQS paramater
 SQS_VISIBILITY_TIMEOUT = 500
+# 受信がこの回数を超えたメッセージはデッドレターキューに移す (失敗し続けるメッセージで処理が滞らないようにする)
+SQS_MAX_RECEIVE_COUNT = 5
+SQS_DEAD_LETTER_RETENTION_DAYS = 14
+# create_rule_service が SQS から一度に受け取る件数と, 件数が揃うまで待つ最大秒数
+CREATE_RULE_BATCH_SIZE = 10
+CREATE_RULE_MAX_BATCHING_WINDOW_SECONDS = 5
+# post_twitter_service が SQS から一度に受け取る件数 (届いた時点ですぐに受け取る)
+POST_TWITTER_BATCH_SIZE = 10
+
+# Coalesce paramater
+# 有効にすると, post_twitter_service は件数が揃うまで最大 POST_TWITTER_MAX_BATCHING_WINDOW_SECONDS 秒待って受け取り,
+# その間に届いた通知を1件のツイートにまとめる (無効の場合は待たない)
+POST_TWITTER_COALESCE_ENABLED = False
+POST_TWITTER_COALESCE_BATCH_SIZE = 20
+POST_TWITTER_MAX_BATCHING_WINDOW_SECONDS = 60
 
 # Rule paramater
 RULE_ENABLED = True
+RECONCILE_RULE_SCHEDULE_MINUTE = "45"
+
+# Sharding paramater
+# 有効にすると, 定期実行はチャンネル一覧をシャードに分割して SQS に送り, 各シャードを並列に処理する
+YOUTUBE_SHARDING_ENABLED = False
+YOUTUBE_SHARD_SIZE = 20
+YOUTUBE_SHARD_BATCH_SIZE = 1
+# ワーカーの同時実行数. 定期実行 (コーディネーター) 等の分を加えて関数の予約同時実行数とする
+YOUTUBE_SHARD_MAX_CONCURRENCY = 5
+YOUTUBE_SHARD_RESERVED_HEADROOM = 2
+# 予約同時実行数でスロットリングされた受信も受信回数に数えられるため, 処理に失敗していないシャードが
+# デッドレターキューに移らないよう多めにする (関数のタイムアウト / 可視性タイムアウトの5倍以上, かつ10以上)
+YOUTUBE_SHARD_MAX_RECEIVE_COUNT = max(10, 5 * math.ceil(LAMBDA_TIMEOUT / SQS_VISIBILITY_TIMEOUT))
+
+# Live tracking paramater
+# 有効にすると, 配信開始の通知は予定時刻のルールではなく actualStartTime の検知で行う
+LIVE_TRACKING_ENABLED = False
+LIVE_TRACKING_INTERVAL_MINUTES = 5
 CREATE_RULE_NAME = "*"
 
 # DynamoDB paramater
@@ -38,6 +76,12 @@ NOTIFY_CONTROLLER_TABLE_PARTITION_KEY = "video_id"
 NOTIFY_CONTROLLER_TABLE_SORT_KEY = "version"
 NOTIFY_CONTROLLER_TABLE_READ_CAPACITY = 1
 NOTIFY_CONTROLLER_TABLE_WRITE_CAPACITY = 1
+SCHEDULE_INDEX_TABLE_PARTITION_KEY = "bucket"
+SCHEDULE_INDEX_TABLE_SORT_KEY = "rule_name"
+SCHEDULE_INDEX_TABLE_READ_CAPACITY = 1
+SCHEDULE_INDEX_TABLE_WRITE_CAPACITY = 1
+# 送信されないまま残ったアイテムを削除するための TTL の属性名 (schedule_index.TTL_ATTRIBUTE と合わせる)
+SCHEDULE_INDEX_TABLE_TTL_ATTRIBUTE = "expires_at"
 
 # service_name
 YOUTUBE_SCHEDULE_SERVICE_NAME = "youtube_schedule_service"
@@ -48,6 +92,14 @@ REGISTER_SCHEDULE_MASTER_SERVICE_NAME = "register_schedule_master_service"
 SCHEDULE_MASTER_TABLE_NAME = "schedule_master_table"
 MANUAL_SCHEDULE_SERVICE_NAME = "manual_schedule_service"
 NOTIFY_CONTROLLER_TABLE_NAME = "notify_controller_table"
+COMMON_LAYER_NAME = "common_layer"
+DISPATCH_SCHEDULE_SERVICE_NAME = "dispatch_schedule_service"
+SCHEDULE_INDEX_TABLE_NAME = "schedule_index_table"
+RECONCILE_RULE_SERVICE_NAME = "reconcile_rule_service"
+LIVE_TRACKING_NAME = "youtube_live_tracking"
+YOUTUBE_SHARD_QUEUE_NAME = "youtube_schedule_shard"
+CREATE_RULE_QUEUE_NAME = "create_rule_service"
+POST_TWITTER_QUEUE_NAME = "post_twitter_service"
 
 # service_description
 YOUTUBE_SCHEDULE_SERVICE_DESCRIPTION = "Get the delivery schedule."
@@ -56,6 +108,10 @@ NOTIFY_SCHEDULE_SERVICE_DESCRIPTION = "Notify the delivery schedule."
 POST_TWITTER_SERVICE_DESCRIPTION = "Post to Twitter."
 REGISTER_SCHEDULE_MASTER_SERVICE_DESCRIPTION = "Register a master in schedule_master_table."
 MANUAL_SCHEDULE_SERVICE_DESCRIPTION = "Register a delivery schedule manually."
+COMMON_LAYER_DESCRIPTION = "Common utilities shared by each service."
+DISPATCH_SCHEDULE_SERVICE_DESCRIPTION = "Dispatch the due notifications every minute."
+RECONCILE_RULE_SERVICE_DESCRIPTION = "Delete superseded and expired event rules."
+LIVE_TRACKING_DESCRIPTION = "Track the live state of upcoming streams."
 
 # paramater store
 SSM_YOUTUBE_API_KEY = "youtube_api_key"
@@ -74,6 +130,14 @@ NOTIFY_SCHEDULE_SERVICE_PARAMATER = lambda_param[NOTIFY_SCHEDULE_SERVICE_NAME]
 POST_TWITTER_SERVICE_PARAMATER = lambda_param[POST_TWITTER_SERVICE_NAME]
 REGISTER_SCHEDULE_MASTER_SERVICE_PARAMATER = lambda_param[REGISTER_SCHEDULE_MASTER_SERVICE_NAME]
 MANUAL_SCHEDULE_SERVICE_PARAMATER = lambda_param[MANUAL_SCHEDULE_SERVICE_NAME]
+DISPATCH_SCHEDULE_SERVICE_PARAMATER = lambda_param[DISPATCH_SCHEDULE_SERVICE_NAME]
+RECONCILE_RULE_SERVICE_PARAMATER = lambda_param[RECONCILE_RULE_SERVICE_NAME]
 
 # Lambda env key
 SNS_TOPICK_NAME_KEY = "SNS_TOPICK_ARN"
+LIVE_TRACKING_KEY = "LIVE_TRACKING"
+LIVE_TRACKING_INTERVAL_KEY = "LIVE_TRACKING_INTERVAL_MINUTES"
+SHARDING_KEY = "SHARDING"
+SHARD_SIZE_KEY = "SHARD_SIZE"
+SHARD_QUEUE_URL_KEY = "SHARD_QUEUE_URL"
+COALESCE_KEY = "COALESCE"
@@ -0,0 +1,159 @@
+"""ローカルで起動する Twitter API (POST /1.1/statuses/update.json) の偽物.
+
+投稿ごとに x-rate-limit-limit / x-rate-limit-remaining / x-rate-limit-reset を返し, \n
+残り回数を使い切った場合は 429 を返す. fail_next で 429 や 5xx 等を任意に返させることができる
+"""
+from __future__ import annotations
+
+import json
+import math
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Mapping
+
+
+UPDATE_PATH = "/1.1/statuses/update.json"
+
+
+class FakeTwitterServer:
+    """Twitter API の偽物.
+
+    with 文で起動/停止する. 受け付けた投稿は requests に (status, in_reply_to_status_id, code) として記録する
+
+    Args:
+        limit (int): レート制限の期間あたりの投稿回数
+        window_seconds (float): レート制限の期間 (秒)
+    """
+
+    def __init__(self, limit: int = 300, window_seconds: float = 900.0):
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self.remaining = limit
+        self.reset_at = 0
+        self.requests = []
+        self._failures = []
+        self._next_id = 1000
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}{UPDATE_PATH}"
+
+    @property
+    def posted(self) -> list[dict]:
+        return [request for request in self.requests if request["code"] == 200]
+
+    def fail_next(self, code: int, count: int = 1, headers: Mapping[str, str] | None = None) -> None:
+        """次の count 回の投稿を code で失敗させる関数.
+
+        Args:
+            code (int): ステータスコード (429, 503 等)
+            count (int): 失敗させる回数
+            headers (Mapping[str, str] | None): 返すヘッダー. None の場合はレート制限のヘッダーを返す
+        """
+        with self._lock:
+            self._failures.extend([(code, headers)] * count)
+
+    def _rate_limit_headers(self) -> dict[str, str]:
+        return {
+            "x-rate-limit-limit": str(self.limit),
+            "x-rate-limit-remaining": str(self.remaining),
+            "x-rate-limit-reset": str(self.reset_at),
+        }
+
+    def handle(self, form: dict[str, str]) -> tuple[int, dict[str, str], dict]:
+        with self._lock:
+            now = time.time()
+            if now >= self.reset_at:
+                self.remaining = self.limit
+                self.reset_at = math.ceil(now + self.window_seconds)
+            if self._failures:
+                code, headers = self._failures.pop(0)
+                body = {"errors": [{"code": code, "message": "fake failure"}]}
+                headers = self._rate_limit_headers() if headers is None else dict(headers)
+            elif self.remaining <= 0:
+                code, headers, body = 429, self._rate_limit_headers(), {"errors": [{"code": 88, "message": "Rate limit exceeded"}]}
+            else:
+                self.remaining -= 1
+                self._next_id += 1
+                code, headers, body = 200, self._rate_limit_headers(), {"id_str": str(self._next_id), "text": form.get("status")}
+            self.requests.append({
+                "status": form.get("status"),
+                "in_reply_to_status_id": form.get("in_reply_to_status_id"),
+                "code": code,
+            })
+            return code, headers, body
+
+    def __enter__(self) -> FakeTwitterServer:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if urllib.parse.urlsplit(self.path).path != UPDATE_PATH:
+                    self.send_error(404)
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                form = dict(urllib.parse.parse_qsl(self.rfile.read(length).decode()))
+                code, headers, body = server.handle(form)
+                payload = json.dumps(body).encode()
+                self.send_response(code)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                return
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._httpd.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+
+def build_post(url: str):
+    """偽物の Twitter API に投稿する post (dispatch_tweets に渡す関数) を返す関数.
+
+    本番の post と同様に, 失敗は rate_limit の例外に置き換える
+
+    Args:
+        url (str): 投稿先の URL
+
+    Returns:
+        Callable[[str, str | None], tuple[str, Mapping[str, str]]]: post
+    """
+    # post_twitter_service の lambda_function と同じモジュールを使うため, load_service の後に読み込む
+    import rate_limit
+
+    def post(post_message: str, in_reply_to_status_id: str | None) -> tuple[str, Mapping[str, str]]:
+        form = {"status": post_message}
+        if in_reply_to_status_id is not None:
+            form["in_reply_to_status_id"] = in_reply_to_status_id
+        request = urllib.request.Request(url, data=urllib.parse.urlencode(form).encode(), method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                return json.loads(response.read())["id_str"], response.headers
+        except urllib.error.HTTPError as e:
+            if e.code == 429:
+                raise rate_limit.RateLimitedError(e.headers) from e
+            if e.code >= 500:
+                raise rate_limit.RetryableError(repr(e)) from e
+            raise rate_limit.PermanentError(repr(e)) from e
+        except urllib.error.URLError as e:
+            raise rate_limit.RetryableError(repr(e)) from e
+
+    return post
@@ -0,0 +1,302 @@
+"""Lambda のテストで共通して使用するヘルパー.
+
+各サービスの lambda_function は同じモジュール名のため, サービスごとに別名で読み込む. \n
+AWS へは通信せず, aws_clients.set_client/set_resource でインメモリの偽物に差し替える
+"""
+from __future__ import annotations
+
+import importlib.util
+import os
+import re
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+LAMBDA_DIR = ROOT_DIR / "lambda"
+LAYER_DIRS = [path / "python" for path in sorted((ROOT_DIR / "layer").iterdir()) if (path / "python").is_dir()]
+
+# lambda_function はインポート時にログレベルを参照する
+os.environ.setdefault("LOG_LEVEL", "DEBUG")
+for layer_dir in LAYER_DIRS:
+    if str(layer_dir) not in sys.path:
+        sys.path.insert(0, str(layer_dir))
+
+
+def load_service(service_name: str):
+    """サービスの lambda_function を <service_name>.lambda_function として読み込む関数.
+
+    同じディレクトリのモジュール (post_utils 等) をインポートできるよう, サービスのディレクトリを sys.path に追加する \n
+    ※ それらのモジュールは lambda_function と同じものを使うため, テストからも通常の import で参照すること
+
+    Args:
+        service_name (str): サービス名 (例: dispatch_schedule_service)
+
+    Returns:
+        module: 読み込んだモジュール
+    """
+    name = f"{service_name}.lambda_function"
+    if name in sys.modules:
+        return sys.modules[name]
+    service_dir = LAMBDA_DIR / service_name
+    if str(service_dir) not in sys.path:
+        sys.path.insert(0, str(service_dir))
+    spec = importlib.util.spec_from_file_location(name, service_dir / "lambda_function.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class ConditionalCheckFailedException(Exception):
+    pass
+
+
+EXPRESSION_TOKEN = re.compile(r"\s*(<>|<=|>=|[=<>(),]|[#:]?\w+)")
+
+
+class ConditionParser:
+    """ConditionExpression の偽物の評価器.
+
+    AND/OR/NOT, 括弧, 比較 (=, <>, <, <=, >, >=), attribute_exists/attribute_not_exists のみ扱う
+    """
+
+    def __init__(self, expression: str, item: dict, values: dict, names: dict):
+        self.tokens = EXPRESSION_TOKEN.findall(expression)
+        self.position = 0
+        self.item = item
+        self.values = values
+        self.names = names
+
+    def peek(self) -> str | None:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self) -> str:
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def parse(self) -> bool:
+        result = self.parse_or()
+        if self.peek() is not None:
+            raise NotImplementedError(self.tokens)
+        return result
+
+    def parse_or(self) -> bool:
+        result = self.parse_and()
+        while (self.peek() or "").upper() == "OR":
+            self.take()
+            result = self.parse_and() or result
+        return result
+
+    def parse_and(self) -> bool:
+        result = self.parse_not()
+        while (self.peek() or "").upper() == "AND":
+            self.take()
+            result = self.parse_not() and result
+        return result
+
+    def parse_not(self) -> bool:
+        if (self.peek() or "").upper() == "NOT":
+            self.take()
+            return not self.parse_not()
+        return self.parse_primary()
+
+    def parse_primary(self) -> bool:
+        token = self.take()
+        if token == "(":
+            result = self.parse_or()
+            self.take()
+            return result
+        if token in ("attribute_exists", "attribute_not_exists"):
+            self.take()
+            name = self.names.get(self.take(), self.tokens[self.position - 1])
+            self.take()
+            return (name in self.item) == (token == "attribute_exists")
+        left = self.operand(token)
+        operator = self.take()
+        right = self.operand(self.take())
+        if left is None or right is None:
+            return operator == "<>" and left != right
+        return {
+            "=": left == right,
+            "<>": left != right,
+            "<": left < right,
+            "<=": left <= right,
+            ">": left > right,
+            ">=": left >= right,
+        }[operator]
+
+    def operand(self, token: str):
+        if token.startswith(":"):
+            return self.values[token]
+        return self.item.get(self.names.get(token, token))
+
+
+def evaluate_condition(expression: str | None, item: dict | None, values: dict | None, names: dict | None) -> bool:
+    if expression is None:
+        return True
+    return ConditionParser(expression, item or {}, values or {}, names or {}).parse()
+
+
+def apply_update(expression: str, item: dict, values: dict, names: dict) -> None:
+    """UpdateExpression (SET a = :v, REMOVE a, ADD a :v) を item に反映する関数."""
+    for action, body in re.findall(r"(SET|REMOVE|ADD)\s+(.*?)(?=\s+(?:SET|REMOVE|ADD)\s|$)", expression.strip()):
+        for clause in (part.strip() for part in body.split(",")):
+            if action == "REMOVE":
+                item.pop(names.get(clause, clause), None)
+                continue
+            name, value = re.split(r"\s*=\s*|\s+", clause, maxsplit=1)
+            name, value = names.get(name, name), values[value.strip()]
+            if action == "SET":
+                item[name] = value
+            elif isinstance(value, set):
+                item[name] = set(item.get(name, set())) | value
+            else:
+                item[name] = item.get(name, 0) + value
+
+
+class FakeTable:
+    """DynamoDB のテーブルの偽物.
+
+    キーの完全一致, パーティションキーの等価条件の query, 条件付きの書き込み (ConditionParser) のみ扱う
+    """
+
+    def __init__(self, partition_key: str, sort_key: str | None = None):
+        self.partition_key = partition_key
+        self.sort_key = sort_key
+        self.items = {}
+        self.meta = SimpleNamespace(client=SimpleNamespace(
+            exceptions=SimpleNamespace(ConditionalCheckFailedException=ConditionalCheckFailedException)))
+
+    def _key(self, item: dict) -> tuple:
+        return (item[self.partition_key], item.get(self.sort_key) if self.sort_key else None)
+
+    def _check(self, key: tuple, kwargs: dict) -> None:
+        if not evaluate_condition(
+            kwargs.get("ConditionExpression"),
+            self.items.get(key),
+            kwargs.get("ExpressionAttributeValues"),
+            kwargs.get("ExpressionAttributeNames"),
+        ):
+            raise ConditionalCheckFailedException(kwargs.get("ConditionExpression"))
+
+    def get_item(self, Key: dict, **kwargs) -> dict:
+        item = self.items.get(self._key(Key))
+        return {"Item": dict(item)} if item is not None else {}
+
+    def put_item(self, Item: dict, **kwargs) -> dict:
+        self._check(self._key(Item), kwargs)
+        self.items[self._key(Item)] = dict(Item)
+        return {}
+
+    def update_item(self, Key: dict, UpdateExpression: str, **kwargs) -> dict:
+        key = self._key(Key)
+        self._check(key, kwargs)
+        item = dict(self.items.get(key) or Key)
+        apply_update(UpdateExpression, item, kwargs.get("ExpressionAttributeValues", {}), kwargs.get("ExpressionAttributeNames", {}))
+        self.items[key] = item
+        return {}
+
+    def delete_item(self, Key: dict, **kwargs) -> dict:
+        self._check(self._key(Key), kwargs)
+        self.items.pop(self._key(Key), None)
+        return {}
+
+    def query(self, KeyConditionExpression: str, ExpressionAttributeValues: dict, ExpressionAttributeNames: dict | None = None, **kwargs) -> dict:
+        match = re.fullmatch(r"\s*(#?\w+)\s*=\s*(:\w+)\s*", KeyConditionExpression)
+        if match is None:
+            raise NotImplementedError(KeyConditionExpression)
+        name = (ExpressionAttributeNames or {}).get(match.group(1), match.group(1))
+        if name != self.partition_key:
+            raise NotImplementedError(KeyConditionExpression)
+        value = ExpressionAttributeValues[match.group(2)]
+        items = [dict(item) for key, item in sorted(self.items.items(), key=lambda entry: str(entry[0])) if key[0] == value]
+        return {"Items": items}
+
+    def batch_writer(self, **kwargs) -> FakeTable:
+        return self
+
+    def __enter__(self) -> FakeTable:
+        return self
+
+    def __exit__(self, *args) -> None:
+        return None
+
+
+class FakeDynamoDBResource:
+    """DynamoDB のリソースの偽物.
+
+    Args:
+        key_schema (dict[str, tuple]): テーブル名 -> (パーティションキー名, ソートキー名)
+        batch_get_limit (int | None): batch_get_item で1回に処理するキー数. 残りは UnprocessedKeys として返す
+    """
+
+    def __init__(self, key_schema: dict[str, tuple], batch_get_limit: int | None = None):
+        self.tables = {table_name: FakeTable(*keys) for table_name, keys in key_schema.items()}
+        self.batch_get_limit = batch_get_limit
+        self.batch_get_calls = []
+
+    def Table(self, table_name: str) -> FakeTable:
+        return self.tables[table_name]
+
+    def batch_get_item(self, RequestItems: dict, **kwargs) -> dict:
+        self.batch_get_calls.append(RequestItems)
+        responses = {}
+        unprocessed = {}
+        for table_name, request in RequestItems.items():
+            limit = len(request["Keys"]) if self.batch_get_limit is None else self.batch_get_limit
+            table = self.tables[table_name]
+            responses[table_name] = [
+                dict(table.items[table._key(key)]) for key in request["Keys"][:limit] if table._key(key) in table.items
+            ]
+            if request["Keys"][limit:]:
+                unprocessed[table_name] = {**request, "Keys": request["Keys"][limit:]}
+        return {"Responses": responses, "UnprocessedKeys": unprocessed}
+
+
+class FakeLambdaClient:
+    """Lambda のクライアントの偽物. 呼び出し内容を invocations に記録する.
+
+    Args:
+        error (Exception | None): invoke で送出する例外
+    """
+
+    def __init__(self, error: Exception | None = None):
+        self.error = error
+        self.invocations = []
+
+    def invoke(self, **kwargs) -> dict:
+        if self.error is not None:
+            raise self.error
+        self.invocations.append(kwargs)
+        return {"StatusCode": 202}
+
+
+class FakeSNSClient:
+    """SNS のクライアントの偽物. PublishBatch の送信内容を published に記録する.
+
+    Args:
+        failed_ids (set[str] | None): 失敗として返すエントリーの Id
+    """
+
+    def __init__(self, failed_ids: set[str] | None = None):
+        self.failed_ids = failed_ids or set()
+        self.published = []
+
+    def publish_batch(self, TopicArn: str, PublishBatchRequestEntries: list[dict]) -> dict:
+        failed = [entry for entry in PublishBatchRequestEntries if entry["Id"] in self.failed_ids]
+        self.published.extend(entry for entry in PublishBatchRequestEntries if entry["Id"] not in self.failed_ids)
+        return {"Failed": [{"Id": entry["Id"], "Code": "InternalError"} for entry in failed]}
+
+
+class FakeSQSClient:
+    """SQS のクライアントの偽物. SendMessageBatch の送信内容を sent に記録する."""
+
+    def __init__(self):
+        self.sent = []
+
+    def send_message_batch(self, QueueUrl: str, Entries: list[dict]) -> dict:
+        self.sent.extend({"QueueUrl": QueueUrl, **entry} for entry in Entries)
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries], "Failed": []}
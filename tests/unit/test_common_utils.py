@@ -0,0 +1,113 @@
+import pytest
+
+from tests.unit.helpers import FakeDynamoDBResource
+
+import aws_clients
+import common_utils
+
+
+TABLE_NAME = "dyn_notify_controller_table_cdk"
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(common_utils, "BATCH_GET_BACKOFF_SECONDS", 0)
+
+
+@pytest.fixture(autouse=True)
+def clear_clients():
+    yield
+    aws_clients.clear()
+
+
+def create_resource(**kwargs) -> FakeDynamoDBResource:
+    resource = FakeDynamoDBResource({TABLE_NAME: ("video_id", "version")}, **kwargs)
+    aws_clients.set_resource("dynamodb", resource)
+    return resource
+
+
+def put_masters(resource: FakeDynamoDBResource, video_ids: list[str]) -> None:
+    table = resource.Table(TABLE_NAME)
+    for video_id in video_ids:
+        table.put_item(Item={"video_id": video_id, "version": "master", "current_version": f"version {video_id}"})
+
+
+def test_get_masters_splits_keys_by_batch_limit():
+    resource = create_resource()
+    video_ids = [f"video{i}" for i in range(common_utils.BATCH_GET_MAX_KEYS + 1)]
+    put_masters(resource, video_ids[:-1])
+
+    masters = common_utils.get_masters(TABLE_NAME, video_ids)
+
+    # 未登録の video ID は含まない
+    assert set(masters) == set(video_ids[:-1])
+    assert masters["video0"]["current_version"] == "version video0"
+    assert [len(call[TABLE_NAME]["Keys"]) for call in resource.batch_get_calls] == [common_utils.BATCH_GET_MAX_KEYS, 1]
+
+
+def test_get_masters_retries_unprocessed_keys():
+    resource = create_resource(batch_get_limit=2)
+    video_ids = [f"video{i}" for i in range(5)]
+    put_masters(resource, video_ids)
+
+    masters = common_utils.get_masters(TABLE_NAME, video_ids)
+
+    assert set(masters) == set(video_ids)
+    # UnprocessedKeys のみを再試行する
+    assert [len(call[TABLE_NAME]["Keys"]) for call in resource.batch_get_calls] == [5, 3, 1]
+
+
+def test_get_masters_falls_back_to_get_item():
+    resource = create_resource(batch_get_limit=0)
+    video_ids = ["video0", "video1", "video2"]
+    put_masters(resource, video_ids[:2])
+
+    masters = common_utils.get_masters(TABLE_NAME, video_ids)
+
+    # 再試行し切っても残ったキーは get_item で取得する
+    assert set(masters) == {"video0", "video1"}
+    assert len(resource.batch_get_calls) == common_utils.BATCH_GET_MAX_ATTEMPTS
+
+
+def claim(version: str, token: str, **kwargs) -> bool:
+    return common_utils.claim_version(TABLE_NAME, "video", version, "title", "hash", "time_stamp", token, **kwargs)
+
+
+def test_claim_version_is_granted_once():
+    resource = create_resource()
+
+    assert claim("first", "run1")
+    # 同じバージョンは, 権利を持つ実行が通知を終えるまで他の実行に渡さない
+    assert not claim("first", "run2")
+    master = resource.Table(TABLE_NAME).items[("video", "master")]
+    assert master["current_version"] == "first"
+    assert master["published"] is False
+    assert master["publishing_token"] == "run1"
+
+    assert common_utils.mark_published(TABLE_NAME, "video", "run1")
+    master = resource.Table(TABLE_NAME).items[("video", "master")]
+    assert master["published"] is True
+    assert "publishing_token" not in master
+    # 通知済みのバージョンは権利を取り直せない
+    assert not claim("first", "run2")
+
+
+def test_claim_version_swaps_to_new_version():
+    resource = create_resource()
+    assert claim("first", "run1")
+
+    # 新しいバージョンへの入れ替えは, 他の実行が権利を持っていても行う
+    assert claim("second", "run2")
+    assert resource.Table(TABLE_NAME).items[("video", "master")]["current_version"] == "second"
+    # 入れ替えられた古い権利では通知済みにしない
+    assert not common_utils.mark_published(TABLE_NAME, "video", "run1")
+    assert common_utils.mark_published(TABLE_NAME, "video", "run2")
+
+
+def test_claim_version_after_lease_expired():
+    create_resource()
+    # 通知前に中断した実行の権利は, 期限が切れた後に他の実行が取り直す
+    assert claim("first", "run1", lease_seconds=-1)
+    assert claim("first", "run2")
+    assert not common_utils.mark_published(TABLE_NAME, "video", "run1")
+    assert common_utils.mark_published(TABLE_NAME, "video", "run2")
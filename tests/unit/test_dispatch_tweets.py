@@ -0,0 +1,174 @@
+import datetime
+import json
+
+import pytest
+
+from tests.unit.fake_twitter import FakeTwitterServer, build_post
+from tests.unit.helpers import load_service
+
+
+post_twitter_service = load_service("post_twitter_service")
+
+import rate_limit
+
+
+@pytest.fixture(autouse=True)
+def reset_rate_limit():
+    rate_limit.reset()
+    yield
+    rate_limit.reset()
+
+
+def format_time(minutes: float) -> str:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return (now + datetime.timedelta(minutes=minutes)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def build_message(video_id: str, minutes: float) -> dict:
+    return {
+        "channel_id": "channel",
+        "video_id": video_id,
+        "version": "version",
+        "title": f"title {video_id}",
+        "scheduled_start_time": format_time(minutes),
+        "status": "30分後に配信が始まります",
+        "rule_name": f"rul_channel_{video_id}_30_sdk",
+    }
+
+
+def dispatch(server: FakeTwitterServer, sns_messages: list[dict], finished: list[dict], **kwargs) -> list[dict]:
+    params = {
+        "post": build_post(server.url),
+        "sns_messages": sns_messages,
+        "useful_window_minutes": 30,
+        "max_attempts": 5,
+        "backoff_base_seconds": 0.01,
+        "backoff_max_seconds": 0.05,
+        "is_near_deadline": lambda: False,
+        "on_finished": finished.append,
+    }
+    params.update(kwargs)
+    return post_twitter_service.dispatch_tweets(**params)
+
+
+def test_posts_in_scheduled_order():
+    messages = [build_message("c", 30), build_message("a", 10), build_message("b", 20)]
+    finished = []
+    with FakeTwitterServer() as server:
+        assert dispatch(server, messages, finished) == []
+    assert [request["status"].split("\n")[1] for request in server.posted] == ["title a", "title b", "title c"]
+    assert [message["video_id"] for message in finished] == ["a", "b", "c"]
+
+
+def test_waits_for_rate_limit_reset():
+    messages = [build_message("a", 10), build_message("b", 20)]
+    finished = []
+    with FakeTwitterServer(limit=1, window_seconds=1) as server:
+        assert dispatch(server, messages, finished) == []
+    # 残り回数を使い切った後はリセットまで待つため, 429 を受けない
+    assert [request["code"] for request in server.requests] == [200, 200]
+    assert len(finished) == 2
+
+
+def test_backoff_on_server_error():
+    finished = []
+    with FakeTwitterServer() as server:
+        server.fail_next(503, count=2)
+        assert dispatch(server, [build_message("a", 10)], finished) == []
+    assert [request["code"] for request in server.requests] == [503, 503, 200]
+    assert len(finished) == 1
+
+
+def test_backoff_on_rate_limit_without_headers():
+    finished = []
+    with FakeTwitterServer() as server:
+        server.fail_next(429, headers={})
+        assert dispatch(server, [build_message("a", 10)], finished) == []
+    assert [request["code"] for request in server.requests] == [429, 200]
+
+
+def test_gives_up_after_max_attempts():
+    finished = []
+    with FakeTwitterServer() as server:
+        server.fail_next(500, count=10)
+        assert dispatch(server, [build_message("a", 10)], finished, max_attempts=3) == []
+    assert [request["code"] for request in server.requests] == [500, 500, 500]
+    assert [message["video_id"] for message in finished] == ["a"]
+
+
+def test_gives_up_on_permanent_error():
+    finished = []
+    with FakeTwitterServer() as server:
+        server.fail_next(403)
+        assert dispatch(server, [build_message("a", 10), build_message("b", 20)], finished) == []
+    assert [request["code"] for request in server.requests] == [403, 200]
+    assert [message["video_id"] for message in finished] == ["a", "b"]
+
+
+def test_gives_up_after_useful_window():
+    # b は投稿できるが, 続く a はリセット (60秒後) を待つと期限 (予定開始時刻 + 30分) を過ぎる
+    messages = [build_message("a", -29.5), build_message("b", -29.9)]
+    finished = []
+    with FakeTwitterServer(limit=1, window_seconds=60) as server:
+        assert dispatch(server, messages, finished) == []
+    assert [request["status"].split("\n")[1] for request in server.requests] == ["title b"]
+    assert [message["video_id"] for message in finished] == ["b", "a"]
+
+
+def test_defers_when_near_deadline():
+    messages = [build_message("c", 30), build_message("a", 10), build_message("b", 20)]
+    finished = []
+    with FakeTwitterServer() as server:
+        deferred = dispatch(server, messages, finished, is_near_deadline=lambda: len(server.posted) >= 1)
+    assert len(server.posted) == 1
+    assert [message["video_id"] for message in finished] == ["a"]
+    # 残りは予定開始時刻の早い順に引き継ぐ
+    assert [message["video_id"] for message in deferred] == ["b", "c"]
+
+
+def test_resumes_thread_after_deferral():
+    digest = {
+        "status": "30分後に配信が始まります",
+        "scheduled_start_time": format_time(10),
+        "rule_name": "digest_rul_channel_a_30_sdk",
+        "items": [
+            {**build_message(video_id, 10), "title": "配信" * 60}
+            for video_id in ("a", "b")
+        ],
+    }
+    post_messages = post_twitter_service.build_post_messages(digest)
+    assert len(post_messages) == 2
+
+    finished = []
+    with FakeTwitterServer() as server:
+        deferred = dispatch(server, [digest], finished, is_near_deadline=lambda: len(server.posted) >= 1)
+        assert finished == []
+        assert len(deferred) == 1
+        assert deferred[0]["thread_posted"] == 1
+        first_id = deferred[0]["thread_reply_to"]
+
+        # 引き継いだ実行は, 投稿済みの続きから返信として投稿する
+        assert dispatch(server, deferred, finished) == []
+    assert [request["status"] for request in server.requests] == post_messages
+    assert [request["in_reply_to_status_id"] for request in server.requests] == [None, first_id]
+    assert len(finished) == 1
+
+
+def test_coalesce_flattens_digests():
+    digest = post_twitter_service.coalesce_messages([build_message("a", 10), build_message("b", 10.2)], 1, 10)
+    assert len(digest) == 1
+    # SQS のバッチで後から届いた通知も, まとめた通知と合わせてまとめ直す
+    coalesced = post_twitter_service.coalesce_messages([*digest, build_message("c", 10.5), build_message("d", 20)], 1, 10)
+    assert [[item["video_id"] for item in post_twitter_service.iter_items(message)] for message in coalesced] == [["a", "b", "c"], ["d"]]
+
+
+def test_parse_records_reports_invalid_body():
+    records = [
+        {"messageId": "1", "body": json.dumps(build_message("a", 10))},
+        {"messageId": "2", "body": "not json"},
+        {"messageId": "3", "body": json.dumps({**build_message("b", 10), "items": [build_message("b", 10), build_message("c", 10)]})},
+    ]
+    sns_messages, record_ids, failures = post_twitter_service.parse_records(records)
+    assert len(sns_messages) == 2
+    assert failures == ["2"]
+    assert record_ids == {"rul_channel_a_30_sdk": "1", "rul_channel_b_30_sdk": "3", "rul_channel_c_30_sdk": "3"}
@@ -0,0 +1,66 @@
+import datetime
+
+from tests.unit.helpers import load_service
+
+load_service("youtube_schedule_service")
+
+import quota
+
+
+def build_channels(count: int, uploads_playlist_id: str | None = "uploads") -> list[dict]:
+    return [
+        {"channel_id": f"channel{i}", "uploads_playlist_id": uploads_playlist_id, "poll_priority": i}
+        for i in range(count)
+    ]
+
+
+def test_estimate_discovery_units_prices_unresolved_playlist_at_search():
+    resolved = build_channels(3)
+    unresolved = build_channels(2, uploads_playlist_id=None)
+
+    assert quota.estimate_discovery_units(resolved, "playlist") == 3 * quota.DISCOVERY_COSTS["playlist"]
+    # 未登録のチャンネルは search と, 解決するための channels.list (50件ずつ) で見積もる
+    assert quota.estimate_discovery_units(resolved + unresolved, "playlist") == (
+        3 * quota.DISCOVERY_COSTS["playlist"] + 2 * quota.DISCOVERY_COSTS["search"] + quota.QUOTA_COSTS["channels"])
+    assert quota.estimate_discovery_units(build_channels(51, None), "playlist") == (
+        51 * quota.DISCOVERY_COSTS["search"] + 2 * quota.QUOTA_COSTS["channels"])
+    assert quota.estimate_discovery_units(unresolved, "feed") == 2 * quota.DISCOVERY_COSTS["feed"]
+
+
+def test_estimate_reserved_units():
+    assert quota.estimate_reserved_units(0, True, 5) == 0
+    assert quota.estimate_reserved_units(51, False, 5) == 2
+    # 配信状態の追跡が有効な場合は, 1時間あたりの追跡の回数分を加える
+    assert quota.estimate_reserved_units(51, True, 5) == 2 * (1 + 12)
+
+
+def test_plan_discovery_keeps_backend_within_allowance():
+    channels = build_channels(10)
+    allowance = quota.estimate_discovery_units(channels, "search")
+
+    assert quota.plan_discovery(channels, "search", allowance * 24, 24) == ("search", channels)
+    # 検出以外で消費する分を差し引くと足りなくなる場合は, 消費の少ない方法に切り替える
+    assert quota.plan_discovery(channels, "search", allowance * 24, 24, reserved_units=1) == ("playlist", channels)
+
+
+def test_plan_discovery_downgrades_unresolved_playlist_channels():
+    channels = build_channels(10, uploads_playlist_id=None)
+
+    # 未登録のチャンネルは search と同等の消費となるため, playlist のままでは収まらない
+    backend, planned = quota.plan_discovery(channels, "playlist", 10 * quota.DISCOVERY_COSTS["playlist"], 1)
+    assert backend == "feed"
+    assert planned == channels
+
+
+def test_plan_discovery_drops_low_priority_channels():
+    channels = build_channels(10)
+
+    backend, planned = quota.plan_discovery(channels, "search", 7, 1, reserved_units=3)
+    assert backend == "feed"
+    assert [channel["channel_id"] for channel in planned] == ["channel9", "channel8", "channel7", "channel6"]
+    assert quota.plan_discovery(channels, "search", 3, 1, reserved_units=3) == ("feed", [])
+
+
+def test_calc_runs_left_today():
+    now = datetime.datetime(2026, 10, 18, 22, 30, tzinfo=quota.QUOTA_TIMEZONE)
+    assert quota.calc_runs_left_today(now) == 2
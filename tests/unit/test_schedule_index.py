@@ -0,0 +1,98 @@
+import datetime
+import json
+
+import pytest
+
+from tests.unit.helpers import FakeDynamoDBResource, FakeLambdaClient, load_service
+
+import aws_clients
+import schedule_index
+
+
+TABLE_NAME = "dyn_schedule_index_table_cdk"
+LAMBDA_ARN = "arn:aws:lambda:ap-northeast-1:000000000000:function:lmd_notify_schedule_service_cdk"
+RULE_NAME = "rul_channel_video_30_sdk"
+
+dispatch_schedule_service = load_service("dispatch_schedule_service")
+
+
+@pytest.fixture
+def table():
+    resource = FakeDynamoDBResource({TABLE_NAME: ("bucket", "rule_name")})
+    aws_clients.set_resource("dynamodb", resource)
+    yield resource.Table(TABLE_NAME)
+    aws_clients.clear()
+
+
+def build_contents(scheduled_start_time: str) -> dict:
+    return {
+        "channel_id": "channel",
+        "video_id": "video",
+        "version": "version",
+        "title": "title",
+        "scheduled_start_time": scheduled_start_time,
+        "status": "30分後に配信が始まります",
+        "rule_name": RULE_NAME,
+    }
+
+
+def test_reschedule_and_dispatch(table):
+    lambda_client = FakeLambdaClient()
+    aws_clients.set_client("lambda", lambda_client)
+    now = datetime.datetime.utcnow()
+
+    # 登録した時点では予定時刻が先のため送信しない
+    first_time = now + datetime.timedelta(hours=1)
+    schedule_index.put_schedule_to_index(TABLE_NAME, first_time, build_contents("first"), RULE_NAME)
+    assert dispatch_schedule_service.service(TABLE_NAME, LAMBDA_ARN, "10", "10") == 200
+    assert lambda_client.invocations == []
+
+    # 予定時刻が変わった場合は古いバケットのアイテムを削除し, 位置を付け替える
+    due_time = now - datetime.timedelta(minutes=2)
+    schedule_index.put_schedule_to_index(TABLE_NAME, due_time, build_contents("second"), RULE_NAME)
+    assert (schedule_index.to_bucket(first_time), RULE_NAME) not in table.items
+    locator = table.items[(schedule_index.LOCATOR_BUCKET, RULE_NAME)]
+    assert locator["due_bucket"] == schedule_index.to_bucket(due_time)
+
+    assert dispatch_schedule_service.service(TABLE_NAME, LAMBDA_ARN, "10", "10") == 200
+    assert len(lambda_client.invocations) == 1
+    invocation = lambda_client.invocations[0]
+    assert invocation["FunctionName"] == LAMBDA_ARN
+    assert invocation["InvocationType"] == "Event"
+    assert json.loads(invocation["Payload"]) == {"messages": [build_contents("second")]}
+
+    # 送信した通知は位置のアイテムも含めて削除し, 二重に送信しない
+    assert table.items == {}
+    assert dispatch_schedule_service.service(TABLE_NAME, LAMBDA_ARN, "10", "10") == 200
+    assert len(lambda_client.invocations) == 1
+
+
+def test_dispatch_failure_keeps_schedule(table):
+    aws_clients.set_client("lambda", FakeLambdaClient(error=RuntimeError("invoke failed")))
+    due_time = datetime.datetime.utcnow() - datetime.timedelta(minutes=1)
+    schedule_index.put_schedule_to_index(TABLE_NAME, due_time, build_contents("first"), RULE_NAME)
+
+    assert dispatch_schedule_service.service(TABLE_NAME, LAMBDA_ARN, "10", "10") == 500
+    assert (schedule_index.to_bucket(due_time), RULE_NAME) in table.items
+
+    lambda_client = FakeLambdaClient()
+    aws_clients.set_client("lambda", lambda_client)
+    assert dispatch_schedule_service.service(TABLE_NAME, LAMBDA_ARN, "10", "10") == 200
+    assert len(lambda_client.invocations) == 1
+    assert table.items == {}
+
+
+def test_expired_schedule_is_left_to_ttl(table):
+    lambda_client = FakeLambdaClient()
+    aws_clients.set_client("lambda", lambda_client)
+    stale_time = datetime.datetime.utcnow() - datetime.timedelta(minutes=30)
+    schedule_index.put_schedule_to_index(TABLE_NAME, stale_time, build_contents("stale"), RULE_NAME)
+
+    assert dispatch_schedule_service.service(TABLE_NAME, LAMBDA_ARN, "10", "10") == 200
+    assert lambda_client.invocations == []
+
+    # 遡る範囲を過ぎたアイテムは送信時刻の EXPIRES_AFTER 後に TTL で削除される
+    expires_at = schedule_index.calc_expires_at(stale_time)
+    assert expires_at == int((stale_time + schedule_index.EXPIRES_AFTER).replace(tzinfo=datetime.timezone.utc).timestamp())
+    assert table.items[(schedule_index.to_bucket(stale_time), RULE_NAME)][schedule_index.TTL_ATTRIBUTE] == expires_at
+    assert table.items[(schedule_index.LOCATOR_BUCKET, RULE_NAME)][schedule_index.TTL_ATTRIBUTE] == expires_at
@@ -0,0 +1,271 @@
+import json
+from itertools import chain, repeat
+
+import pytest
+
+from tests.unit.helpers import FakeDynamoDBResource, FakeSNSClient, FakeSQSClient, load_service
+
+import aws_clients
+import common_utils
+
+
+NOTIFY_CONTROLLER_TABLE = "dyn_notify_controller_table_cdk"
+SCHEDULE_MASTER_TABLE = "dyn_schedule_master_table_cdk"
+TOPIC_ARN = "arn:aws:sns:ap-northeast-1:000000000000:sns_create_rule_service_cdk"
+SHARD_QUEUE_URL = "https://sqs.ap-northeast-1.amazonaws.com/000000000000/sqs_youtube_schedule_shard_cdk"
+
+youtube_schedule_service = load_service("youtube_schedule_service")
+
+import schedule_utils
+
+
+@pytest.fixture
+def resource():
+    resource = FakeDynamoDBResource({
+        NOTIFY_CONTROLLER_TABLE: ("video_id", "version"),
+        SCHEDULE_MASTER_TABLE: ("pkey", "channel_id"),
+    })
+    aws_clients.set_resource("dynamodb", resource)
+    yield resource
+    aws_clients.clear()
+
+
+def build_upcoming(video_id: str, scheduled_start_time: str = "2030-01-01T00:00:00Z") -> dict:
+    return {
+        "channel_id": "channel",
+        "video_id": video_id,
+        "version": common_utils.calc_version(scheduled_start_time),
+        "title": f"title {video_id}",
+        "scheduled_start_time": scheduled_start_time,
+        "content_hash": common_utils.calc_content_hash(f"title {video_id}"),
+        "time_stamp": "time_stamp",
+    }
+
+
+def test_publish_upcoming_items_registers_history_and_tracking(resource):
+    sns_client = FakeSNSClient(failed_ids={"1"})
+    aws_clients.set_client("sns", sns_client)
+    upcomings = [build_upcoming("video0"), build_upcoming("video1")]
+
+    failed = youtube_schedule_service.publish_upcoming_items(upcomings, NOTIFY_CONTROLLER_TABLE, TOPIC_ARN)
+
+    assert failed == [upcomings[1]]
+    assert [json.loads(json.loads(entry["Message"])["lambda"])["video_id"] for entry in sns_client.published] == ["video0"]
+    items = resource.Table(NOTIFY_CONTROLLER_TABLE).items
+    # 送信に成功した動画のみ, 履歴と tracking を登録して通知済みにする
+    assert items[("video0", "master")]["published"] is True
+    assert ("video0", upcomings[0]["version"]) in items
+    assert items[("tracking", "video0")]["schedule_version"] == upcomings[0]["version"]
+    # 送信に失敗した動画は未通知のまま権利を持ち, 期限が切れるまで他の実行は通知しない
+    assert items[("video1", "master")]["published"] is False
+    assert ("video1", upcomings[1]["version"]) not in items
+    assert ("tracking", "video1") not in items
+
+    sns_client = FakeSNSClient()
+    aws_clients.set_client("sns", sns_client)
+    assert youtube_schedule_service.publish_upcoming_items(upcomings, NOTIFY_CONTROLLER_TABLE, TOPIC_ARN) == []
+    assert sns_client.published == []
+
+
+def test_publish_upcoming_items_publishes_new_version(resource):
+    aws_clients.set_client("sns", FakeSNSClient())
+    first = build_upcoming("video", "2030-01-01T00:00:00Z")
+    assert youtube_schedule_service.publish_upcoming_items([first], NOTIFY_CONTROLLER_TABLE, TOPIC_ARN) == []
+
+    # 予定開始時刻が変わった場合は新しいバージョンとして通知し, 履歴を残す
+    sns_client = FakeSNSClient()
+    aws_clients.set_client("sns", sns_client)
+    second = build_upcoming("video", "2030-01-01T01:00:00Z")
+    assert youtube_schedule_service.publish_upcoming_items([second], NOTIFY_CONTROLLER_TABLE, TOPIC_ARN) == []
+    assert len(sns_client.published) == 1
+    items = resource.Table(NOTIFY_CONTROLLER_TABLE).items
+    assert items[("video", "master")]["current_version"] == second["version"]
+    assert ("video", first["version"]) in items and ("video", second["version"]) in items
+    assert items[("tracking", "video")]["scheduled_start_time"] == second["scheduled_start_time"]
+
+
+def build_search_item(channel_id: str, video_id: str) -> dict:
+    return {
+        "id": {"videoId": video_id},
+        "snippet": {
+            "channelId": channel_id,
+            "channelTitle": channel_id,
+            "title": f"title {video_id}",
+            "publishedAt": "2030-01-01T00:00:00Z",
+            "liveBroadcastContent": "upcoming",
+        },
+    }
+
+
+@pytest.fixture
+def youtube(monkeypatch):
+    """チャンネルごとの search の結果を返し, videos.list の予定開始時刻を固定する偽物."""
+    pages = {}
+    monkeypatch.setattr(
+        youtube_schedule_service, "discover",
+        lambda backend, yt_api_key, channel, published_after: [pages[channel["channel_id"]]],
+    )
+    monkeypatch.setattr(
+        youtube_schedule_service, "get_live_streaming_details",
+        lambda yt_api_key, video_ids: {video_id: {"scheduledStartTime": "2030-01-01T00:00:00Z"} for video_id in video_ids},
+    )
+    return pages
+
+
+def deadline_after(checks: int):
+    """checks 回目までは False, 以降は True を返す is_near_deadline."""
+    answers = chain(repeat(False, checks), repeat(True))
+    return lambda: next(answers)
+
+
+def process_channels(channels: list[dict], is_near_deadline) -> tuple[int, list[str], set[str]]:
+    return youtube_schedule_service.process_channels(
+        yt_api_key="key",
+        channels=channels,
+        timedelta_days=7,
+        cursor_overlap_minutes=60,
+        discovery_backend="search",
+        max_workers=1,
+        schedule_master_table_name=SCHEDULE_MASTER_TABLE,
+        notify_controller_table_name=NOTIFY_CONTROLLER_TABLE,
+        topic_arn=TOPIC_ARN,
+        is_near_deadline=is_near_deadline,
+    )
+
+
+def test_process_channels_stops_polling_near_deadline(resource, youtube):
+    sns_client = FakeSNSClient()
+    aws_clients.set_client("sns", sns_client)
+    channels = [{"channel_id": f"channel{i}"} for i in range(3)]
+    for i in range(3):
+        youtube[f"channel{i}"] = {"items": [build_search_item(f"channel{i}", f"video{i}")]}
+
+    status_code, pending_channel_ids, processed_video_ids = process_channels(channels, deadline_after(1))
+
+    # 期限に達した後のチャンネルはポーリングせず, ポーリング済みの動画も処理せずに次の実行に引き継ぐ
+    assert status_code == 200
+    assert pending_channel_ids == ["channel1", "channel2", "channel0"]
+    assert processed_video_ids == set()
+    assert sns_client.published == []
+    assert resource.Table(SCHEDULE_MASTER_TABLE).items == {}
+
+
+def test_process_channels_keeps_cursor_of_unprocessed_videos(resource, youtube):
+    sns_client = FakeSNSClient()
+    aws_clients.set_client("sns", sns_client)
+    channels = [{"channel_id": f"channel{i}"} for i in range(2)]
+    for i in range(2):
+        youtube[f"channel{i}"] = {"items": [build_search_item(f"channel{i}", f"video{i}")]}
+
+    # ポーリング (2回) と1件目の動画の処理までは期限に達しない
+    status_code, pending_channel_ids, processed_video_ids = process_channels(channels, deadline_after(3))
+
+    # 処理しきれなかった動画のチャンネルは取得済み位置を進めず, 次の実行で検出し直す
+    assert pending_channel_ids == ["channel1"]
+    assert processed_video_ids == {"video0"}
+    assert len(sns_client.published) == 1
+    schedule_master = resource.Table(SCHEDULE_MASTER_TABLE).items
+    assert ("youtube", "channel0") in schedule_master
+    assert ("youtube", "channel1") not in schedule_master
+
+
+def test_resume_cursor_round_trip(resource):
+    channels = [{"channel_id": f"channel{i}"} for i in range(3)]
+
+    schedule_utils.save_resume_channel_ids(SCHEDULE_MASTER_TABLE, ["channel2", "channel1"])
+    resume_channel_ids = schedule_utils.get_resume_channel_ids(SCHEDULE_MASTER_TABLE)
+    assert resume_channel_ids == ["channel2", "channel1"]
+
+    # 引き継いだチャンネルを先頭に並べ, 続きからの実行ではそれらのみを処理する
+    ordered = youtube_schedule_service.order_channels(channels, resume_channel_ids, resume_only=False)
+    assert [channel["channel_id"] for channel in ordered] == ["channel1", "channel2", "channel0"]
+    resumed = youtube_schedule_service.order_channels(channels, resume_channel_ids, resume_only=True)
+    assert [channel["channel_id"] for channel in resumed] == ["channel1", "channel2"]
+
+    # すべて処理し終えた場合は削除する
+    schedule_utils.save_resume_channel_ids(SCHEDULE_MASTER_TABLE, [])
+    assert schedule_utils.get_resume_channel_ids(SCHEDULE_MASTER_TABLE) == []
+
+
+class FakeContext:
+    def __init__(self, remaining_time_in_millis: int):
+        self.remaining_time_in_millis = remaining_time_in_millis
+
+    def get_remaining_time_in_millis(self) -> int:
+        return self.remaining_time_in_millis
+
+
+@pytest.fixture
+def channels(monkeypatch):
+    """スケジュールマスターのチャンネル一覧 (キャッシュ済みとして扱う)."""
+    channels = [{"channel_id": f"channel{i}"} for i in range(3)]
+    monkeypatch.setitem(schedule_utils._channels_cache, "items", channels)
+    monkeypatch.setitem(schedule_utils._channels_cache, "expires_at", float("inf"))
+    return channels
+
+
+@pytest.fixture
+def shard_env(monkeypatch):
+    for key, value in {
+        "DEADLINE_MARGIN_SECONDS": "30",
+        "TIMEDELTA_DAYS": "7",
+        "CURSOR_OVERLAP_MINUTES": "60",
+        "MAX_WORKERS": "1",
+        "CHANNEL_CACHE_TTL_SECONDS": "300",
+        "SCHEDULE_MASTER_TABLE": SCHEDULE_MASTER_TABLE,
+        "NOTIFY_CONTROLLER_TABLE": NOTIFY_CONTROLLER_TABLE,
+        "SNS_TOPICK_ARN": TOPIC_ARN,
+        "SHARD_QUEUE_URL": SHARD_QUEUE_URL,
+    }.items():
+        monkeypatch.setenv(key, value)
+
+
+def test_split_shards():
+    assert youtube_schedule_service.split_shards(["a", "b", "c", "d", "e"], 2) == [["a", "b"], ["c", "d"], ["e"]]
+    assert youtube_schedule_service.split_shards([], 2) == []
+
+
+def test_process_shard_requeues_pending_channels(resource, youtube, channels):
+    aws_clients.set_client("sns", FakeSNSClient())
+    sqs_client = FakeSQSClient()
+    aws_clients.set_client("sqs", sqs_client)
+    for channel in channels:
+        youtube[channel["channel_id"]] = {"items": []}
+    shard = {"channel_ids": ["channel0", "channel2"], "discovery_backend": "search"}
+
+    status_code = youtube_schedule_service.process_shard(
+        yt_api_key="key",
+        shard=shard,
+        timedelta_days=7,
+        cursor_overlap_minutes=60,
+        max_workers=1,
+        channel_cache_ttl_seconds=300,
+        schedule_master_table_name=SCHEDULE_MASTER_TABLE,
+        notify_controller_table_name=NOTIFY_CONTROLLER_TABLE,
+        topic_arn=TOPIC_ARN,
+        shard_queue_url=SHARD_QUEUE_URL,
+        is_near_deadline=deadline_after(1),
+    )
+
+    # シャード外のチャンネルは処理せず, 処理しきれなかったチャンネルは新しいシャードとしてキューに戻す
+    assert status_code == youtube_schedule_service.INCOMPLETE_STATUS_CODE
+    assert [json.loads(entry["MessageBody"]) for entry in sqs_client.sent] == [
+        {"channel_ids": ["channel2"], "discovery_backend": "search"}]
+
+
+def test_handle_shards_reports_failed_records(resource, youtube, channels, shard_env):
+    aws_clients.set_client("sns", FakeSNSClient())
+    sqs_client = FakeSQSClient()
+    aws_clients.set_client("sqs", sqs_client)
+    youtube["channel0"] = {"items": [build_search_item("channel0", "video0")]}
+    event = {"Records": [
+        {"messageId": "ok", "body": json.dumps({"channel_ids": ["channel0"], "discovery_backend": "search"})},
+        {"messageId": "broken", "body": "not json"},
+    ]}
+
+    res = youtube_schedule_service.handle_shards(event, FakeContext(600000), "key")
+
+    # 想定外の例外で処理できなかったメッセージのみ再試行させる
+    assert res == {"batchItemFailures": [{"itemIdentifier": "broken"}]}
+    assert sqs_client.sent == []
+    assert resource.Table(NOTIFY_CONTROLLER_TABLE).items[("video0", "master")]["published"] is True